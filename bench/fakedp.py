@@ -0,0 +1,151 @@
+# Copyright (C) 2018 [SD]RSiX Project
+#
+# Licensed under the Apache License, Version 2.0 (the “License”);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an “AS IS” BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Stand-in datapath for benchmarks
+
+FakeDatapath has the attributes and methods of ryu.controller.Datapath the
+applications use, but instead of writing to a socket it serializes the
+messages (as Ryu does before sending them) and records them. Writes of several
+serialized messages (see sd_ixp.outbound) are split by their OpenFlow headers.
+"""
+
+import collections
+import random
+import struct
+from collections import Counter
+
+from ryu.ofproto import ofproto_v1_3, ofproto_v1_3_parser
+
+
+# ofp_header, and the type of the multipart message after it
+_HEADER = struct.Struct('!BBHI')
+_MULTIPART_TYPE = struct.Struct('!H')
+
+# A message sent: its class name, xid and serialized form
+Message = collections.namedtuple('Message', ('name', 'xid', 'buf'))
+
+# Structure: { ofproto_parser module, { (type, multipart type), class name } }
+_names = {}
+
+
+def _message_names(ofproto_parser):
+    """Class names of the messages of an ofproto_parser module"""
+
+    names = _names.get(ofproto_parser)
+    if names is None:
+        names = _names[ofproto_parser] = {}
+        for name, cls in vars(ofproto_parser).items():
+            msg_type = getattr(cls, 'cls_msg_type', None)
+            if isinstance(cls, type) and msg_type is not None:
+                names.setdefault(
+                    (msg_type, getattr(cls, 'cls_stats_type', None)), name)
+    return names
+
+
+class FakeDatapath:
+    """Datapath that records the messages sent to it
+
+    Attributes:
+        id (int): datapath id
+        ofproto: ofproto module of the OpenFlow version in use
+        ofproto_parser: ofproto_parser module of the OpenFlow version in use
+        sent (Counter): number of messages sent per message class name
+        sent_bytes (int): number of bytes sent
+        writes (int): number of writes (send_msg() and send() calls)
+        record (bool): whether to keep the messages in messages
+        messages (list): the Messages sent (when record is set)
+    """
+
+    def __init__(self, dpid, ofproto=ofproto_v1_3,
+                 ofproto_parser=ofproto_v1_3_parser, record=False):
+        self.id = dpid
+        self.ofproto = ofproto
+        self.ofproto_parser = ofproto_parser
+        self.xid = random.randint(0, ofproto.MAX_XID)
+        self.is_active = True
+
+        self.record = record
+        self.messages = []
+        self.sent = Counter()
+        self.sent_bytes = 0
+        self.writes = 0
+
+    def set_xid(self, msg):
+        self.xid = (self.xid + 1) & self.ofproto.MAX_XID
+        msg.set_xid(self.xid)
+        return self.xid
+
+    def send_msg(self, msg):
+        if msg.xid is None:
+            self.set_xid(msg)
+        msg.serialize()
+
+        self.sent[msg.__class__.__name__] += 1
+        self.sent_bytes += len(msg.buf)
+        self.writes += 1
+        if self.record:
+            self.messages.append(Message(msg.__class__.__name__, msg.xid,
+                                         bytes(msg.buf)))
+
+        return True
+
+    def send(self, buf, close_socket=False):
+        names = _message_names(self.ofproto_parser)
+        multipart = (self.ofproto.OFPT_MULTIPART_REQUEST,
+                     self.ofproto.OFPT_MULTIPART_REPLY)
+
+        offset = 0
+        while offset < len(buf):
+            _, msg_type, length, xid = _HEADER.unpack_from(buf, offset)
+            stats_type = None
+            if msg_type in multipart:
+                stats_type, = _MULTIPART_TYPE.unpack_from(buf, offset + 8)
+
+            name = names.get((msg_type, stats_type), 'type %d' % msg_type)
+            self.sent[name] += 1
+            if self.record:
+                self.messages.append(Message(
+                    name, xid, bytes(buf[offset:offset + length])))
+            offset += length
+
+        self.sent_bytes += len(buf)
+        self.writes += 1
+
+        return True
+
+    def reset(self):
+        """Forget the messages sent so far"""
+
+        self.messages = []
+        self.sent = Counter()
+        self.sent_bytes = 0
+        self.writes = 0
+
+    def packet_in(self, data, in_port, buffer_id=None):
+        """Build an OFPPacketIn message as if this switch had sent it
+
+        The reason is 0: OFPR_NO_MATCH (OFPR_TABLE_MISS on OpenFlow 1.5).
+        """
+
+        parser = self.ofproto_parser
+        if buffer_id is None:
+            buffer_id = self.ofproto.OFP_NO_BUFFER
+
+        msg = parser.OFPPacketIn(
+            self, buffer_id=buffer_id, total_len=len(data),
+            reason=0, table_id=0,
+            match=parser.OFPMatch(in_port=in_port), data=data)
+        msg.msg_len = len(data)
+
+        return msg
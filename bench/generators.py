@@ -0,0 +1,169 @@
+# Copyright (C) 2018 [SD]RSiX Project
+#
+# Licensed under the Apache License, Version 2.0 (the “License”);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an “AS IS” BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""PacketIn workloads for benchmarks
+
+Every generator yields (datapath id, in_port, frame) tuples. Frames are built
+with struct, so generating the workload costs little compared to the handlers
+being measured. Hosts are spread over the switches and ports: host i is
+connected to switch (i % switches) + 1, port (i // switches) % ports + 1.
+"""
+
+import random
+import struct
+
+BROADCAST = b'\xff' * 6
+
+# Minimum Ethernet frame length (without FCS)
+MIN_FRAME = 60
+
+
+def host_mac(i):
+    """Locally administered unicast MAC of host i"""
+    return b'\x02\x00' + struct.pack('!I', i)
+
+
+def host_ipv4(i):
+    return struct.pack('!I', 0x0a000000 + i + 1)
+
+
+def host_ipv6(i):
+    # 2001:db8::/64 + host number
+    return b'\x20\x01\x0d\xb8' + b'\x00' * 8 + struct.pack('!I', i + 1)
+
+
+def host_location(i, switches, ports):
+    """(datapath id, port) host i is connected to"""
+    return i % switches + 1, (i // switches) % ports + 1
+
+
+def _pad(frame):
+    if len(frame) < MIN_FRAME:
+        frame += b'\x00' * (MIN_FRAME - len(frame))
+    return frame
+
+
+def arp_request(src, dst):
+    """ARP request from host src for the address of host dst"""
+
+    mac = host_mac(src)
+    return _pad(
+        BROADCAST + mac + b'\x08\x06' +
+        struct.pack('!HHBBH', 1, 0x0800, 6, 4, 1) +
+        mac + host_ipv4(src) + b'\x00' * 6 + host_ipv4(dst))
+
+
+def neighbor_solicitation(src, dst):
+    """Neighbor Solicitation from host src for the address of host dst"""
+
+    mac = host_mac(src)
+    target = host_ipv6(dst)
+
+    # Solicited-node multicast address and its MAC address
+    group = b'\xff\x02' + b'\x00' * 9 + b'\x01\xff' + target[13:]
+    group_mac = b'\x33\x33' + group[12:]
+
+    icmp = (struct.pack('!BBHI', 135, 0, 0, 0) + target +
+            struct.pack('!BB', 1, 1) + mac)
+    ip6 = (struct.pack('!IHBB', 6 << 28, len(icmp), 58, 255) +
+           host_ipv6(src) + group)
+
+    return group_mac + mac + b'\x86\xdd' + ip6 + icmp
+
+
+def unicast(src_mac, dst_mac):
+    """IPv4 frame between two MAC addresses"""
+    return _pad(dst_mac + src_mac + b'\x08\x00' + b'\x45' + b'\x00' * 19)
+
+
+def arp_storm(count, hosts=256, switches=1, ports=48, seed=0):
+    """ARP requests from random hosts for random hosts"""
+
+    rand = random.Random(seed)
+    for _ in range(count):
+        src = rand.randrange(hosts)
+        dst = rand.randrange(hosts)
+        dpid, port = host_location(src, switches, ports)
+        yield dpid, port, arp_request(src, dst)
+
+
+def nd_burst(count, hosts=256, switches=1, ports=48, seed=0):
+    """Neighbor Solicitations from random hosts for random hosts"""
+
+    rand = random.Random(seed)
+    for _ in range(count):
+        src = rand.randrange(hosts)
+        dst = rand.randrange(hosts)
+        dpid, port = host_location(src, switches, ports)
+        yield dpid, port, neighbor_solicitation(src, dst)
+
+
+def mac_churn(count, hosts=256, switches=1, ports=48, churn=0.5, seed=0):
+    """Unicast frames between hosts, a share of them from random new MACs
+
+    Args:
+        churn (float): probability of a frame having a never seen source MAC
+    """
+
+    rand = random.Random(seed)
+    for n in range(count):
+        src = rand.randrange(hosts)
+        dst = rand.randrange(hosts)
+        dpid, port = host_location(src, switches, ports)
+
+        if rand.random() < churn:
+            src_mac = b'\x06' + struct.pack('!IB', n, 0)
+        else:
+            src_mac = host_mac(src)
+
+        yield dpid, port, unicast(src_mac, host_mac(dst))
+
+
+def pcap(path, switches=1, ports=48):
+    """Frames of a pcap file
+
+    Frames are assigned to a switch and port by their source MAC address, so
+    all the frames of a host come from the same place.
+    """
+
+    with open(path, 'rb') as f:
+        header = f.read(24)
+        magic = header[:4]
+        if magic in (b'\xd4\xc3\xb2\xa1', b'\x4d\x3c\xb2\xa1'):
+            endian = '<'
+        elif magic in (b'\xa1\xb2\xc3\xd4', b'\xa1\xb2\x3c\x4d'):
+            endian = '>'
+        else:
+            raise ValueError('%s: not a pcap file' % path)
+
+        record = struct.Struct(endian + 'IIII')
+        while True:
+            raw = f.read(record.size)
+            if len(raw) < record.size:
+                return
+
+            _, _, captured, _ = record.unpack(raw)
+            frame = f.read(captured)
+            if len(frame) < 14:
+                continue
+
+            host = int.from_bytes(frame[6:12], 'big')
+            yield host_location(host, switches, ports) + (frame, )
+
+
+SCENARIOS = {
+    'arp-storm': arp_storm,
+    'nd-burst': nd_burst,
+    'mac-churn': mac_churn,
+}
@@ -0,0 +1,377 @@
+# Copyright (C) 2018 [SD]RSiX Project
+#
+# Licensed under the Apache License, Version 2.0 (the “License”);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an “AS IS” BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""PacketIn/FlowMod replay benchmark
+
+Drives the real handlers of the applications with PacketIns from a synthetic
+workload or a pcap file, using FakeDatapath objects instead of switches, and
+reports PacketIn throughput, handler latency, memory allocated and OpenFlow
+messages emitted per PacketIn.
+
+Examples:
+
+    python bench/run.py --target rsix --scenario arp-storm --count 20000
+    python bench/run.py --target learning --scenario mac-churn --switches 4
+    python bench/run.py --target add-flow --pcap trace.pcap --output new.json
+    python bench/run.py --target rsix --scenario nd-burst --compare old.json
+
+Targets:
+    rsix        SD_RSiX._packet_in_handler (rsix_app.py)
+    learning    LearningSwitch._packet_in_handler (learning_switch_13.py)
+    add-flow    Switch.add_flow with one (in_port, eth_src, eth_dst) entry per
+                PacketIn (sd_ixp/switch.py)
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+# The applications import sd_ixp as ryu-manager does: from the app directory
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                   'src')
+sys.path.insert(0, SRC)
+
+from ryu import cfg  # noqa: E402
+from ryu.controller import ofp_event  # noqa: E402
+from ryu.lib import hub  # noqa: E402
+
+import fakedp  # noqa: E402
+import generators  # noqa: E402
+
+# PacketIns replayed to measure allocations (tracemalloc slows handlers down)
+ALLOC_SAMPLE = 2000
+
+# PacketIns replayed between yields to the other green threads (the writers
+# of the switch outbound buffers), as the event loop of Ryu would
+YIELD_EVERY = 64
+
+
+class RSiXTarget:
+    """SD_RSiX application with connected fake switches"""
+
+    def __init__(self, switches, args):
+        import rsix_app
+
+        conf = cfg.CONF
+        if args.members:
+            conf.set_override('members', args.members, group='rsix')
+        # Every run starts cold
+        conf.set_override('snapshot_interval', 0, group='rsix')
+        conf.set_override('metrics_port', 0, group='rsix')
+        if not args.limit:
+            # Measure the handlers, not the PacketIn budget
+            conf.set_override('packet_in_rate', 10 ** 9, group='rsix')
+            conf.set_override('packet_in_burst', 10 ** 9, group='rsix')
+
+        self.app = rsix_app.SD_RSiX()
+        self.datapaths = {}
+
+        for dpid in range(1, switches + 1):
+            dp = fakedp.FakeDatapath(dpid, record=True)
+            self.datapaths[dpid] = dp
+
+            features = dp.ofproto_parser.OFPSwitchFeatures(dp)
+            self.app.switch_up(ofp_event.EventOFPSwitchFeatures(features))
+            hub.sleep(0)
+
+            # Reply the group desc and flow stats requests with empty tables,
+            # so the switch gets programmed from the member registry
+            for msg in dp.messages:
+                if msg.name == 'OFPGroupDescStatsRequest':
+                    reply = dp.ofproto_parser.OFPGroupDescStatsReply(dp)
+                    reply.xid, reply.flags, reply.body = msg.xid, 0, []
+                    self.app._group_desc_reply_handler(
+                        ofp_event.EventOFPGroupDescStatsReply(reply))
+                elif msg.name == 'OFPFlowStatsRequest':
+                    reply = dp.ofproto_parser.OFPFlowStatsReply(dp)
+                    reply.xid, reply.flags, reply.body = msg.xid, 0, []
+                    self.app._flow_stats_reply_handler(
+                        ofp_event.EventOFPFlowStatsReply(reply))
+
+            dp.record = False
+            self.flush()
+            dp.reset()
+
+    def event(self, dpid, port, frame):
+        dp = self.datapaths[dpid]
+        return ofp_event.EventOFPPacketIn(dp.packet_in(frame, port))
+
+    def handle(self, ev):
+        self.app._packet_in_handler(ev)
+
+    def flush(self):
+        for switch in self.app.switches.values():
+            switch.flush()
+        hub.sleep(0)
+
+
+class LearningTarget:
+    """LearningSwitch application with connected fake switches"""
+
+    def __init__(self, switches, args):
+        import learning_switch_13
+
+        self.app = learning_switch_13.LearningSwitch()
+        self.datapaths = {}
+
+        for dpid in range(1, switches + 1):
+            dp = fakedp.FakeDatapath(dpid)
+            self.datapaths[dpid] = dp
+
+            features = dp.ofproto_parser.OFPSwitchFeatures(dp)
+            self.app.switch_features_handler(
+                ofp_event.EventOFPSwitchFeatures(features))
+            dp.reset()
+
+    def event(self, dpid, port, frame):
+        dp = self.datapaths[dpid]
+        return ofp_event.EventOFPPacketIn(dp.packet_in(frame, port))
+
+    def handle(self, ev):
+        self.app._packet_in_handler(ev)
+
+    def flush(self):
+        pass
+
+
+class AddFlowTarget:
+    """Switch.add_flow with one entry per PacketIn"""
+
+    def __init__(self, switches, args):
+        from sd_ixp.switch import Switch
+
+        self.datapaths = {}
+        self.switches = {}
+
+        for dpid in range(1, switches + 1):
+            dp = fakedp.FakeDatapath(dpid)
+            self.datapaths[dpid] = dp
+            self.switches[dpid] = Switch(dp)
+            dp.reset()
+
+    def event(self, dpid, port, frame):
+        return dpid, port, frame
+
+    def handle(self, ev):
+        dpid, port, frame = ev
+        dp = self.datapaths[dpid]
+        ofproto = dp.ofproto
+        parser = dp.ofproto_parser
+
+        match = parser.OFPMatch(in_port=port, eth_dst=_mac(frame[0:6]),
+                                eth_src=_mac(frame[6:12]))
+        actions = [parser.OFPActionOutput(ofproto.OFPP_FLOOD)]
+        instructions = [
+            parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions)
+        ]
+
+        self.switches[dpid].add_flow(1, match, instructions, actions)
+
+    def flush(self):
+        for switch in self.switches.values():
+            switch.flush()
+        hub.sleep(0)
+
+
+TARGETS = {
+    'rsix': RSiXTarget,
+    'learning': LearningTarget,
+    'add-flow': AddFlowTarget,
+}
+
+
+def _mac(raw):
+    return ':'.join('%02x' % b for b in raw)
+
+
+def _percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def _version():
+    """git describe of the tree being measured, if available"""
+
+    try:
+        return subprocess.check_output(
+            ['git', 'describe', '--always', '--dirty'],
+            cwd=os.path.dirname(SRC), stderr=subprocess.DEVNULL,
+            universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _workload(args):
+    if args.pcap:
+        frames = generators.pcap(args.pcap, args.switches, args.ports)
+        return list(frames)[:args.count]
+
+    scenario = generators.SCENARIOS[args.scenario]
+    return list(scenario(args.count, hosts=args.hosts, switches=args.switches,
+                         ports=args.ports, seed=args.seed))
+
+
+def _replay(target, events):
+    """Replay events through the target; return the handler latencies"""
+
+    latencies = []
+    clock = time.perf_counter
+    handle = target.handle
+
+    for i, ev in enumerate(events, 1):
+        start = clock()
+        handle(ev)
+        latencies.append(clock() - start)
+
+        if not i % YIELD_EVERY:
+            hub.sleep(0)
+
+    return latencies
+
+
+def run(args):
+    """Run a benchmark and return its results"""
+
+    workload = _workload(args)
+    if not workload:
+        raise SystemExit('empty workload')
+
+    # Allocations are measured on a separate target, so tracemalloc does not
+    # distort the timings
+    sample = workload[:ALLOC_SAMPLE]
+    target = TARGETS[args.target](args.switches, args)
+    events = [target.event(*frame) for frame in sample]
+
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    blocks = sys.getallocatedblocks()
+    _replay(target, events)
+    target.flush()
+    after, peak = tracemalloc.get_traced_memory()
+    blocks = sys.getallocatedblocks() - blocks
+    tracemalloc.stop()
+
+    target = TARGETS[args.target](args.switches, args)
+    events = [target.event(*frame) for frame in workload]
+
+    start = time.perf_counter()
+    latencies = _replay(target, events)
+    target.flush()
+    elapsed = time.perf_counter() - start
+
+    count = len(events)
+    latencies.sort()
+
+    sent = {}
+    sent_bytes = 0
+    writes = 0
+    for dp in target.datapaths.values():
+        for name, number in dp.sent.items():
+            sent[name] = sent.get(name, 0) + number
+        sent_bytes += dp.sent_bytes
+        writes += dp.writes
+
+    # FlowMods sent inside OpenFlow 1.4+ bundles count as FlowMods
+    flow_mods = (sent.get('OFPFlowMod', 0) + sent.get('EncodedFlowMod', 0) +
+                 sent.get('OFPBundleAddMsg', 0))
+
+    return {
+        'version': _version(),
+        'python': platform.python_version(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'target': args.target,
+        'workload': args.pcap or args.scenario,
+        'packet_ins': count,
+        'switches': args.switches,
+        'packet_ins_per_s': count / elapsed,
+        'latency_us': {
+            'p50': _percentile(latencies, 0.50) * 1e6,
+            'p99': _percentile(latencies, 0.99) * 1e6,
+            'max': latencies[-1] * 1e6,
+        },
+        'alloc': {
+            'retained_bytes_per_packet': (after - before) / len(sample),
+            'retained_blocks_per_packet': blocks / len(sample),
+            'peak_kib': peak / 1024,
+        },
+        'flow_mods_per_packet': flow_mods / count,
+        'messages_per_packet': {
+            name: number / count for name, number in sorted(sent.items())
+        },
+        'bytes_per_packet': sent_bytes / count,
+        'writes_per_packet': writes / count,
+    }
+
+
+def compare(old, new):
+    """Print the relative change of the main metrics between two results"""
+
+    metrics = [
+        ('packet_ins_per_s', lambda r: r['packet_ins_per_s']),
+        ('latency p50 (us)', lambda r: r['latency_us']['p50']),
+        ('latency p99 (us)', lambda r: r['latency_us']['p99']),
+        ('retained bytes/packet',
+         lambda r: r['alloc']['retained_bytes_per_packet']),
+        ('flow_mods_per_packet', lambda r: r['flow_mods_per_packet']),
+        ('bytes_per_packet', lambda r: r['bytes_per_packet']),
+    ]
+
+    print('%-24s %14s %14s %9s' % ('', old['version'], new['version'], ''))
+    for name, get in metrics:
+        a, b = get(old), get(new)
+        change = (b - a) / a * 100 if a else 0.0
+        print('%-24s %14.2f %14.2f %+8.1f%%' % (name, a, b, change))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--target', choices=sorted(TARGETS), default='rsix')
+    parser.add_argument('--scenario', choices=sorted(generators.SCENARIOS),
+                        default='arp-storm')
+    parser.add_argument('--pcap', help='replay the frames of a pcap file')
+    parser.add_argument('--count', type=int, default=10000,
+                        help='number of PacketIns')
+    parser.add_argument('--switches', type=int, default=1)
+    parser.add_argument('--ports', type=int, default=48,
+                        help='ports per switch')
+    parser.add_argument('--hosts', type=int, default=256)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--members', help='member registry (rsix target)')
+    parser.add_argument('--limit', action='store_true',
+                        help='keep the PacketIn budget (rsix target)')
+    parser.add_argument('--output', help='write the results to a JSON file')
+    parser.add_argument('--compare', metavar='JSON',
+                        help='compare the results with a previous run')
+    args = parser.parse_args()
+
+    results = run(args)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+    else:
+        print(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
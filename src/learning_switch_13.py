@@ -22,15 +22,47 @@
 # the original version has been modified to make it in a multi-switches learning
 # app (the original version does not work with more than one switch).
 
+import logging
+
+from ryu import cfg
 from ryu.base import app_manager
 from ryu.controller import ofp_event
 from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER
 from ryu.controller.handler import set_ev_cls
+from ryu.lib import hub
 from ryu.ofproto import ofproto_v1_3
 from ryu.lib.packet import packet
 from ryu.lib.packet import ethernet
 from ryu.lib.packet import ether_types
 
+from sd_ixp import allowlist
+from sd_ixp import classifier
+from sd_ixp import compiler
+from sd_ixp import cookie as cookies
+from sd_ixp import log
+from sd_ixp import mactable
+from sd_ixp import template
+from sd_ixp.flow import OUTPUT, Flow, output
+from sd_ixp.member import load_members
+
+CONF = cfg.CONF
+CONF.register_opts([
+    cfg.StrOpt('allowlist', default='',
+               help='member registry (JSON) file whose member ports only '
+               'accept the MACs of their member (empty: any port accepts any '
+               'MAC)'),
+    cfg.IntOpt('mac-idle-timeout', default=mactable.DEFAULT_IDLE_TIMEOUT,
+               help='seconds a learned MAC is kept without being seen again '
+               '(0 keeps it until its hard timeout)'),
+    cfg.IntOpt('mac-max-entries', default=mactable.DEFAULT_MAX_ENTRIES,
+               help='MACs learned per switch'),
+    cfg.IntOpt('mac-max-per-port', default=mactable.DEFAULT_MAX_PER_PORT,
+               help='MACs learned per switch port'),
+], group='learning')
+
+# Interval (in seconds) between aging rounds of the learning tables
+AGING_INTERVAL = 1
+
 
 class LearningSwitch(app_manager.RyuApp):
     """OpenFlow learning switch
@@ -46,10 +78,38 @@ class LearningSwitch(app_manager.RyuApp):
     def __init__(self, *args, **kwargs):
         super(LearningSwitch, self).__init__(*args, **kwargs)
 
-        # Initiates a dictionary to store MAC-port mapping
-        # mac_to_port structure: { datapath_id, { MAC, port } }
+        # Initiates a dictionary to store MAC-port mapping. Each switch has a
+        # bounded table whose MACs age out (see sd_ixp.mactable), so a port
+        # sending from random sources cannot grow it without limit
+        # mac_to_port structure: { datapath_id, MACTable }
         self.mac_to_port = {}
 
+        # Logging a line per PacketIn costs more than forwarding the packet, so
+        # the log is written by a thread of its own and PacketIn records are
+        # sampled: a few per interval, plus a count of PacketIns per switch at
+        # the end of each interval
+        log.start_queue_logging()
+        self.event_log = log.EventLog(self.logger)
+
+        # Ports of registered members only accept the members' MACs (see
+        # sd_ixp.allowlist)
+        self.allowlist = allowlist.MACAllowlist()
+        if CONF.learning.allowlist:
+            for member in load_members(CONF.learning.allowlist):
+                self.allowlist.add_member(member)
+
+        # Ages the learned MACs
+        self.threads.append(hub.spawn(self._aging_loop))
+
+    def _aging_loop(self):
+        """Expire the learned MACs (every second)"""
+
+        while True:
+            hub.sleep(AGING_INTERVAL)
+
+            for table in list(self.mac_to_port.values()):
+                table.expire()
+
     # When Ryu receives an OpenFlow message, it generates an event handler with
     # a function and event object. Through a decorator of
     # ryu.controller.handler.set_ev_cls you may write a function to implement
@@ -105,7 +165,8 @@ class LearningSwitch(app_manager.RyuApp):
         self.logger.info("New switch: {0:16d}\tOF version: {1:2d}".format(
             datapath.id, ofproto.OFP_VERSION))
 
-    def add_flow(self, datapath, priority, match, actions, buffer_id=None):
+    def add_flow(self, datapath, priority, match, actions, buffer_id=None,
+                 cookie=cookies.OWNER):
         """PacketOut - Install a flow entry on a switch
 
         Args:
@@ -117,6 +178,9 @@ class LearningSwitch(app_manager.RyuApp):
             buffer_id (default=None): id of the packet buffered at the switch.
                     When there is no buffered packet associated buffer_id must
                     be set to OFP_NO_BUFFER in the flow_mod.
+            cookie: opaque value the switch keeps with the entry (see
+                    sd_ixp.cookie); a single flow mod with a cookie and a
+                    cookie mask deletes every entry whose cookie matches
         """
 
         ofproto = datapath.ofproto
@@ -135,6 +199,7 @@ class LearningSwitch(app_manager.RyuApp):
         if buffer_id:
             mod = parser.OFPFlowMod(
                 datapath=datapath,
+                cookie=cookie,
                 buffer_id=buffer_id,
                 priority=priority,
                 match=match,
@@ -142,6 +207,7 @@ class LearningSwitch(app_manager.RyuApp):
         else:
             mod = parser.OFPFlowMod(
                 datapath=datapath,
+                cookie=cookie,
                 priority=priority,
                 match=match,
                 instructions=inst)
@@ -161,18 +227,32 @@ class LearningSwitch(app_manager.RyuApp):
         # If you hit this you might want to increase
         # the "miss_send_length" of your switch
         if ev.msg.msg_len < ev.msg.total_len:
-            self.logger.debug("packet truncated: only %s of %s bytes",
-                              ev.msg.msg_len, ev.msg.total_len)
+            self.event_log.log('truncated', logging.DEBUG,
+                               "packet truncated: only %s of %s bytes",
+                               ev.msg.msg_len, ev.msg.total_len)
 
         msg = ev.msg
         datapath = msg.datapath
         ofproto = datapath.ofproto
-        parser = datapath.ofproto_parser
 
         # Get the in_port from the ev.msg object.
         # Options available for OF 1.3 at https://goo.gl/qwxpaU
         in_port = msg.match['in_port']
 
+        # Frames from a source the port does not accept are dropped before
+        # they are parsed, learned or flooded. The first one of a source gets
+        # a drop entry installed, so the switch drops the ones that follow.
+        src = classifier.eth_src(msg.data)
+        verdict = self.allowlist.check(datapath.id, in_port, src)
+        if verdict != allowlist.ALLOW:
+            if verdict == allowlist.BLOCK:
+                blocked = compiler.compile_blocked(
+                    in_port, mactable.int_to_mac(src),
+                    self.allowlist.block_duration)
+                datapath.send_msg(template.flow_mod(datapath, blocked,
+                                                    ofproto.OFPFC_ADD))
+            return
+
         # Analyse the received packets using the packet library
         # Extract MAC addresses (src, dst)
         pkt = packet.Packet(msg.data)
@@ -185,53 +265,64 @@ class LearningSwitch(app_manager.RyuApp):
         dst_MAC = eth.dst
         src_MAC = eth.src
 
-        # Get Datapath ID to identify OpenFlow switches.
-        # The setdefault() dictionary method returns the value of the key (dpid)
-        # if it exists. If the the key does not exist, it adds the key (dpid)
-        # with an empty dictionary as value.
+        # Get Datapath ID to identify OpenFlow switches, and the MAC table of
+        # the switch (created for its first PacketIn)
         dpid = datapath.id
-        self.mac_to_port.setdefault(dpid, {})
+        table = self.mac_to_port.get(dpid)
+        if table is None:
+            table = self.mac_to_port[dpid] = mactable.MACTable(
+                idle_timeout=CONF.learning.mac_idle_timeout,
+                max_entries=CONF.learning.mac_max_entries,
+                max_per_port=CONF.learning.mac_max_per_port)
 
         # Log
-        self.logger.info(
-            "PacketIn:\n\tSwitch: {0:16d}\n\tSrc: {1}; Dest: {2}\n\tIn port: {3}".
-            format(dpid, src_MAC, dst_MAC, in_port))
+        # The message is only formatted if the record is not suppressed by
+        # sampling (the arguments are passed to the logger, not formatted here)
+        self.event_log.count('PacketIns', dpid)
+        self.event_log.log(
+            'PacketIn', logging.INFO,
+            "PacketIn:\n\tSwitch: %16d\n\tSrc: %s; Dest: %s\n\tIn port: %s",
+            dpid, src_MAC, dst_MAC, in_port)
 
         # Learn the MAC to avoid flooding next time
-        # The next line associates a source MAC (src_MAC) to a port (in_port)
-        # for the switch the PacketIn came from.
-        self.mac_to_port[dpid][src_MAC] = in_port
+        # The next line associates a source MAC (src) to a port (in_port) for
+        # the switch the PacketIn came from. A table or port already full does
+        # not learn it (the MAC is flooded to until there is room).
+        table.learn(src, in_port)
 
         # If the controller already has the destination MAC address in its table
-        # (mac_to_port dictionary), it takes the out port from there. If not, it
-        # sets all ports as the out port.
-        if dst_MAC in self.mac_to_port[dpid]:
-            out_port = self.mac_to_port[dpid][dst_MAC]
-        else:
+        # (mac_to_port), it takes the out port from there. If not, it sets all
+        # ports as the out port.
+        out_port = table.lookup(classifier.eth_dst(msg.data))
+        if out_port is None:
             out_port = ofproto.OFPP_FLOOD
 
-        # Create the action list. Set out port as the only action for matching
-        # packets.
-        actions = [parser.OFPActionOutput(out_port)]
-
         # If controller knows the destination MAC, it installs a flow entry to
         # process new packets with the same source and destination MAC.
+        # Learned entries all have the same shape, so instead of building
+        # them with add_flow() they are packed from a pre-encoded template
+        # (see sd_ixp.template), which costs a fraction of it.
         if out_port != ofproto.OFPP_FLOOD:
-            match = parser.OFPMatch(
-                in_port=in_port, eth_dst=dst_MAC, eth_src=src_MAC)
+            learned = Flow(0, 1, {'in_port': in_port, 'eth_dst': dst_MAC,
+                                  'eth_src': src_MAC},
+                           [output(out_port)],
+                           cookie=cookies.make(cookies.LEARNED))
+
+            # The switch applies the entry to the packet it buffered, if any
+            # (OFP_NO_BUFFER otherwise)
+            datapath.send_msg(template.flow_mod(
+                datapath, learned, ofproto.OFPFC_ADD,
+                buffer_id=msg.buffer_id))
 
             # Check if buffer_id is valid.
             # If the message has a valid buffer_id, it means the switch kept the
             # original packet so that controller does not need to send a
             # PacketOut (function returns after installing the flow_mod)
-            if msg.buffer_id != ofproto.OFP_NO_BUFFER:
-                self.add_flow(datapath, 1, match, actions, msg.buffer_id)
-                return
             # If there is no a valid buffer_id, the switch does not have the
             # original packet, and the controller must send a PakectOut in order
             # the switch can forward the original packet sent to the controller.
-            else:
-                self.add_flow(datapath, 1, match, actions)
+            if msg.buffer_id != ofproto.OFP_NO_BUFFER:
+                return
 
         data = None
         if msg.buffer_id == ofproto.OFP_NO_BUFFER:
@@ -242,12 +333,8 @@ class LearningSwitch(app_manager.RyuApp):
         # through a PacketOut message. If the destination MAC is known, the
         # switch sends the packet through the port where the destination MAC
         # comes; else the switch floods the packet to all ports.
-        out = parser.OFPPacketOut(
-            datapath=datapath,
-            buffer_id=msg.buffer_id,
-            in_port=in_port,
-            actions=actions,
-            data=data)
+        out = template.packet_out(datapath, msg.buffer_id, in_port,
+                                  [(OUTPUT, out_port)], data)
 
         # send packet out
         datapath.send_msg(out)
@@ -13,20 +13,140 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import logging
+import os
+
+from ryu import cfg
+from ryu.app.wsgi import WSGIApplication
 from ryu.base import app_manager
 from ryu.controller import ofp_event
-from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER
+from ryu.controller.handler import CONFIG_DISPATCHER, DEAD_DISPATCHER
+from ryu.controller.handler import MAIN_DISPATCHER
 from ryu.controller.handler import set_ev_cls
-from ryu.ofproto import ofproto_v1_3
-from ryu.lib.packet import packet
-from ryu.lib.packet import ethernet
-from ryu.lib.packet import ether_types
-from ryu.lib.packet import icmpv6
+from ryu.lib import hub
+from ryu.ofproto import ofproto_v1_3, ofproto_v1_4, ofproto_v1_5
 
+from sd_ixp.ixp import IXP
+from sd_ixp.member import load_members, save_registry
 from sd_ixp.switch import Switch
+from sd_ixp import allowlist
+from sd_ixp import api
+from sd_ixp import classifier
+from sd_ixp import compiler
+from sd_ixp import cluster
+from sd_ixp import jobs
+from sd_ixp import lifecycle
+from sd_ixp import log
 from sd_ixp import neighbor
+from sd_ixp import mactable
+from sd_ixp import metrics
+from sd_ixp import outbound
+from sd_ixp import ratelimit
+from sd_ixp import snapshot
+from sd_ixp import topology
+from sd_ixp import vlan
+
+CONF = cfg.CONF
+CONF.register_opts([
+    cfg.StrOpt('members',
+               default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                    'members.json'),
+               help='member registry (JSON) file'),
+    cfg.IntOpt('packet-in-rate', default=ratelimit.DEFAULT_RATE,
+               help='PacketIns per second allowed per switch port'),
+    cfg.IntOpt('packet-in-burst', default=ratelimit.DEFAULT_BURST,
+               help='PacketIn burst allowed per switch port'),
+    cfg.IntOpt('source-block-duration',
+               default=allowlist.DEFAULT_BLOCK_DURATION,
+               help='seconds the frames of a source MAC a member port does '
+               'not accept are dropped by the switch'),
+    cfg.IntOpt('storm-guard-rate', default=0,
+               help='PacketIns per second a meter lets through on ports over '
+               'their budget (0 drops that traffic instead)'),
+    cfg.StrOpt('snapshot', default='/var/lib/rsix/rsix.snapshot',
+               help='file the learned state is saved to, and restored from '
+               'on restart (its directory is created if needed)'),
+    cfg.IntOpt('snapshot-interval', default=30,
+               help='seconds between snapshots of the learned state (0 '
+               'disables snapshots)'),
+    cfg.ListOpt('pipeline', default=[],
+                help='tables of the pipeline stages, as stage=table (stages: '
+                'vlan, forward, egress, account; the filter is table 0)'),
+    cfg.BoolOpt('traffic-matrix', default=False,
+                help='count the traffic between every pair of members in an '
+                'accounting table, for the AS-to-AS traffic matrix'),
+    cfg.StrOpt('cluster-node', default='',
+               help='id of this controller node in a cluster (empty runs a '
+               'standalone controller)'),
+    cfg.ListOpt('cluster-nodes', default=[],
+                help='nodes of the cluster, as id=host:port (this node '
+                'listens on its own address)'),
+    cfg.StrOpt('cluster-secret', default='', secret=True,
+               help='secret shared by the nodes of the cluster, which sign '
+               'their messages and the LLDP frames of their switches with '
+               'it (required in a cluster)'),
+    cfg.IntOpt('flap-half-life', default=lifecycle.DEFAULT_HALF_LIFE,
+               help='seconds the reconnection penalty of a switch takes to '
+               'halve; a switch that keeps reconnecting waits longer and '
+               'longer to be programmed (0 programs it right away)'),
+    cfg.IntOpt('departed-switches', default=lifecycle.DEFAULT_MAX_DEPARTED,
+               help='switches whose learned MACs are kept after they '
+               'disconnect, so they get them back if they reconnect'),
+    cfg.BoolOpt('api', default=False,
+                help='serve the northbound REST API (registry changes as '
+                'jobs) on the Ryu WSGI server (see --wsapi-host and '
+                '--wsapi-port); it also needs an api-token'),
+    cfg.StrOpt('api-token', default='', secret=True,
+               help='token the REST API requests that change the registry '
+               'must carry in the X-Auth-Token header (the API is not '
+               'served without one)'),
+    cfg.BoolOpt('api-save-registry', default=True,
+                help='write the member registry file after every change '
+                'committed through the REST API, so it survives restarts'),
+    cfg.StrOpt('metrics-host', default='127.0.0.1',
+               help='address the metrics and profiler endpoint listens on '
+               '(it has no authentication: keep it local)'),
+    cfg.IntOpt('metrics-port', default=8081,
+               help='port of the metrics and profiler endpoint (0 disables '
+               'it)'),
+    cfg.BoolOpt('profiler', default=True,
+                help='allow starting the sampling profiler through the '
+                'metrics endpoint'),
+    cfg.IntOpt('log-interval', default=log.DEFAULT_INTERVAL,
+               help='seconds between PacketIn counter reports in the log'),
+    cfg.IntOpt('log-cap', default=log.DEFAULT_CAP,
+               help='records logged per PacketIn event type and interval'),
+    cfg.IntOpt('log-queue-size', default=log.DEFAULT_QUEUE_SIZE,
+               help='log records waiting to be written by the log writer '
+               'thread (0 writes them from the event loop)'),
+], group='rsix')
+
+# Interval (in seconds) between aging rounds of the learning tables
+AGING_INTERVAL = 1
 
-import array
+# Interval (in seconds) between checks of which switches are due a stats poll
+# (each switch has an adaptive polling interval, see sd_ixp.stats)
+STATS_TICK = 1
+
+# PacketIns received, dropped over their budget and dropped for a source MAC
+# the port does not accept, per switch port, and PacketIns dropped while their
+# switch is congested
+PACKET_INS = metrics.REGISTRY.counter(
+    'rsix_packet_ins_total', 'PacketIns received', ('dpid', 'port'))
+PACKET_INS_DROPPED = metrics.REGISTRY.counter(
+    'rsix_packet_ins_dropped_total', 'PacketIns dropped over the budget of '
+    'their port', ('dpid', 'port'))
+SOURCE_VIOLATIONS = metrics.REGISTRY.counter(
+    'rsix_source_violations_total', 'PacketIns dropped for a source MAC '
+    'their member port does not accept', ('dpid', 'port'))
+PACKET_INS_SHED = metrics.REGISTRY.counter(
+    'rsix_packet_ins_shed_total', 'PacketIns dropped while their switch was '
+    'congested', ('dpid', ))
+
+# Frame kinds handled by the neighbor discovery subsystem (ARP, and ICMPv6
+# Neighbor Solicitation and Advertisement)
+_NEIGHBOR_DISCOVERY = frozenset(
+    (classifier.ARP, classifier.ND_NS, classifier.ND_NA))
 
 
 class SD_RSiX(app_manager.RyuApp):
@@ -38,31 +158,504 @@ class SD_RSiX(app_manager.RyuApp):
 
     # A list of supported OpenFlow versions for this RyuApp. The default is all
     # versions supported by the framework.
-    OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
+    # OpenFlow 1.4+ switches get FlowMods in atomic bundles.
+    OFP_VERSIONS = [
+        ofproto_v1_3.OFP_VERSION, ofproto_v1_4.OFP_VERSION,
+        ofproto_v1_5.OFP_VERSION
+    ]
+
+    # The northbound REST API is served by Ryu's WSGI server
+    _CONTEXTS = {'wsgi': WSGIApplication}
 
     def __init__(self, *args, **kwargs):
         super(SD_RSiX, self).__init__(*args, **kwargs)
 
-        # Initiates a dictionary to store switch objects
+        # Write the log from a thread of its own, and sample the per-packet
+        # records
+        if CONF.rsix.log_queue_size > 0:
+            log.start_queue_logging(CONF.rsix.log_queue_size)
+        self.event_log = log.EventLog(self.logger, CONF.rsix.log_interval,
+                                      CONF.rsix.log_cap)
+
+        # The nodes of a cluster sign LLDP with the same key, since a link
+        # may join switches owned by different nodes
+        lldp_key = None
+        if CONF.rsix.cluster_node:
+            if not CONF.rsix.cluster_secret:
+                raise ValueError('a cluster node needs a cluster-secret')
+            lldp_key = cluster.derive_key(CONF.rsix.cluster_secret.encode(),
+                                          b'lldp')
+
+        # The IXP holds the member registry and programs the switches from it
+        self.ixp = IXP(self._load_members(CONF.rsix.members),
+                       accounting=CONF.rsix.traffic_matrix,
+                       pipeline=compiler.Pipeline.parse(CONF.rsix.pipeline),
+                       vlans=self._load_vlans(CONF.rsix.members),
+                       block_duration=CONF.rsix.source_block_duration,
+                       lldp_key=lldp_key)
+
+        # Dictionary to store switch objects (owned by the IXP)
         # Structure:
         #       { datapath_id, Switch }
-        self.switches = {}
+        self.switches = self.ixp.switches
+
+        # ARP/ND table used to answer neighbor discovery requests on behalf of
+        # the members
+        self.neighbors = neighbor.NeighborTable(
+            allowed=self.ixp.neighbor_allowed)
+
+        # PacketIn budget per (datapath_id, in_port)
+        self.limiter = ratelimit.PacketInLimiter(
+            CONF.rsix.packet_in_rate, CONF.rsix.packet_in_burst)
+
+        # State learned before a restart: neighbors are restored now, and each
+        # switch gets its MACs and shadow flows back when it connects
+        self.snapshot = None
+        if CONF.rsix.snapshot_interval > 0:
+            self.snapshot = self._load_snapshot(CONF.rsix.snapshot)
+            self.threads.append(hub.spawn(self._snapshot_loop))
+
+        # Switches shared with other controller nodes: each node is the master
+        # of part of them and replicates what it learns to the others
+        self.cluster = None
+        if CONF.rsix.cluster_node:
+            self.cluster = self._start_cluster(CONF.rsix.cluster_node,
+                                               CONF.rsix.cluster_nodes)
+            self.neighbors.listener = self.cluster.replicate_neighbor
+            self.threads.append(hub.spawn(self._cluster_loop))
+
+        # Switches that disconnected: what they learned is kept for a while,
+        # and those that keep reconnecting are programmed less often
+        self.departed = lifecycle.DepartedSwitches(
+            CONF.rsix.departed_switches)
+        self.damper = None
+        if CONF.rsix.flap_half_life > 0:
+            self.damper = lifecycle.FlapDamper(CONF.rsix.flap_half_life)
+
+        # Switches held back by the damper, and the threads that release them
+        # Structure: { datapath_id, (Switch, green thread) }
+        self._held = {}
+
+        # Northbound REST API: registry changes are queued as jobs and sent
+        # to all the switches at once (see sd_ixp.api). Ryu's WSGI server
+        # listens on every address, so the API is never served without a
+        # token.
+        self.jobs = None
+        wsgi = kwargs.get('wsgi')
+        if CONF.rsix.api and not CONF.rsix.api_token:
+            self.logger.error("The REST API needs an api-token: not serving "
+                              "it")
+        elif CONF.rsix.api and wsgi is not None:
+            self.jobs = jobs.JobQueue(self.ixp,
+                                      on_commit=self._change_committed,
+                                      logger=self.logger)
+            wsgi.register(api.RegistryController, {
+                'ixp': self.ixp,
+                'jobs': self.jobs,
+                'token': CONF.rsix.api_token,
+            })
+
+        # Handler timings, counters and queue depths, and the sampling
+        # profiler, served on a local endpoint (see sd_ixp.metrics)
+        self.profiler = None
+        self._register_metrics()
+        if CONF.rsix.metrics_port > 0:
+            if CONF.rsix.profiler:
+                self.profiler = metrics.SamplingProfiler()
+            self.threads.append(metrics.serve(
+                CONF.rsix.metrics_host, CONF.rsix.metrics_port,
+                profiler=self.profiler))
+
+        # Ages the learned MACs and neighbor bindings
+        self.threads.append(hub.spawn(self._aging_loop))
+
+        # Polls the port and flow counters of the switches
+        self.threads.append(hub.spawn(self._stats_loop))
+
+        # Discovers the links between the switches
+        self.threads.append(hub.spawn(self._lldp_loop))
+
+    def _register_metrics(self):
+        """Register the metrics read from the application when scraped"""
+
+        registry = metrics.REGISTRY
+
+        registry.gauge(
+            'rsix_event_queue_depth', 'Events waiting to be handled',
+            ('queue', ), self._queue_depths)
+        registry.gauge(
+            'rsix_send_backlog', 'Messages on their way to a switch: '
+            'FlowMods batched (batch), messages in its outbound buffer '
+            '(buffer), writes in its connection (socket), and barriers '
+            'waiting for a reply (barrier)', ('dpid', 'stage'),
+            self._send_backlog)
+        registry.gauge(
+            'rsix_outbound_bytes', 'Bytes in the outbound buffer of a switch',
+            ('dpid', ), lambda: {(dpid, ): switch.outbound.bytes for
+                                 dpid, switch in list(self.switches.items())})
+        registry.counters(
+            'rsix_outbound_shed_total', 'Messages to a switch shed while its '
+            'outbound buffer was full', ('dpid', 'lane'), self._shed)
+        registry.counters(
+            'rsix_outbound_stalls_total', 'Times changes to a switch waited, '
+            'or were deferred, for room in its outbound buffer', ('dpid', ),
+            lambda: {(dpid, ): switch.outbound.stalls for
+                     dpid, switch in list(self.switches.items())})
+        registry.counters(
+            'rsix_mac_table_total', 'MACs of a switch learned, moved to '
+            'another port, expired, and not learned because the switch '
+            '(rejected_switch_full) or the port (rejected_port_full) was '
+            'full', ('dpid', 'counter'), self._mac_counters)
+        registry.counters(
+            'rsix_packet_in_budget_total', 'PacketIns of a switch port within '
+            'its budget (allowed) and over it (dropped), and times the port '
+            'went over it (trips)', ('dpid', 'port', 'counter'),
+            self._packet_in_budget)
+        registry.gauge(
+            'rsix_switches', 'Switches connected', (),
+            lambda: {(): len(self.switches)})
+
+        if self.jobs is not None:
+            registry.counters(
+                'rsix_jobs_total', 'Registry change jobs submitted, refused '
+                'and finished in each state', ('state', ),
+                lambda: {(key, ): value
+                         for key, value in self.jobs.counters.items()})
+
+    def _queue_depths(self):
+        """Events waiting in the queues of the application
+
+        Ryu queues the events of the switches to the application event
+        thread.
+        """
+
+        depths = {('events', ): self.events.qsize()}
+        if self.jobs is not None:
+            depths[('jobs', )] = len(self.jobs)
+        return depths
+
+    def _send_backlog(self):
+        backlog = {}
+        for dpid, switch in list(self.switches.items()):
+            for stage, size in zip(('batch', 'buffer', 'socket', 'barrier'),
+                                   switch.backlog()):
+                backlog[(dpid, stage)] = size
+        return backlog
+
+    def _shed(self):
+        shed = {}
+        for dpid, switch in list(self.switches.items()):
+            for lane, count in zip(outbound.LANES, switch.outbound.shed):
+                shed[(dpid, lane)] = count
+        return shed
+
+    def _mac_counters(self):
+        return {(dpid, name): value
+                for dpid, switch in list(self.switches.items())
+                for name, value in switch.macs.counters.items()}
+
+    def _packet_in_budget(self):
+        return {(dpid, port, name): value
+                for (dpid, port), counters in self.limiter.counters().items()
+                for name, value in counters.items()}
+
+    def _aging_loop(self):
+        """Expire learned MACs (every second), neighbor bindings and the state
+        kept of the switches that disconnected"""
+
+        while True:
+            hub.sleep(AGING_INTERVAL)
+
+            for switch in list(self.switches.values()):
+                switch.expire_macs()
+
+            self.neighbors.purge()
+
+            self.departed.purge()
+            if self.damper is not None:
+                self.damper.purge()
+
+    def _stats_loop(self):
+        """Poll the counters of the switches that are due a poll"""
+
+        while True:
+            hub.sleep(STATS_TICK)
+
+            for switch in list(self.switches.values()):
+                if switch.stats.due():
+                    switch.request_stats()
+
+    def _lldp_loop(self):
+        """Send LLDP frames through every switch port and expire the links
+        that stopped sending them"""
+
+        while True:
+            hub.sleep(topology.LLDP_INTERVAL)
+            self.ixp.expire_links()
+            self.ixp.send_lldp()
+
+    def _cluster_loop(self):
+        """Send heartbeats and rebalance the switches over the nodes alive"""
+
+        while True:
+            hub.sleep(cluster.HEARTBEAT_INTERVAL)
+            self.cluster.tick()
+
+    def _start_cluster(self, node, nodes):
+        """Join the cluster, given "id=host:port" node addresses"""
+
+        addresses = {}
+        for entry in nodes:
+            name, _, address = entry.partition('=')
+            host, _, port = address.rpartition(':')
+            addresses[name] = (host, int(port))
+
+        if node not in addresses:
+            raise ValueError('cluster node %s is not in cluster-nodes' % node)
+
+        backend = cluster.UDPBackend(
+            addresses[node],
+            {name: address for name, address in addresses.items()
+             if name != node},
+            CONF.rsix.cluster_secret.encode(), logger=self.logger)
+
+        return cluster.Cluster(node, addresses, backend,
+                               on_promote=self.ixp.resync,
+                               on_message=self._replicated,
+                               logger=self.logger)
+
+    def _replicated(self, message):
+        """Apply what another controller node learned"""
+
+        kind = message['type']
+
+        if kind == cluster.NEIGHBOR:
+            self.neighbors.learn(message['ip'], message['mac'],
+                                 message['dpid'], message['port'],
+                                 message['vlan'], notify=False,
+                                 router=message['router'])
+            return
+
+        switch = self.switches.get(message['dpid'])
+        if switch is not None:
+            switch.apply_replicated(kind, message['mac'], message['vlan'],
+                                    message['port'])
+
+    def _snapshot_loop(self):
+        """Save the learned state periodically"""
+
+        while True:
+            hub.sleep(CONF.rsix.snapshot_interval)
+            self._save_snapshot()
+
+    def _save_snapshot(self):
+        try:
+            snapshot.save(CONF.rsix.snapshot, list(self.switches.values()),
+                          self.neighbors)
+        except (OSError, ValueError) as e:
+            self.logger.warning("Could not save the snapshot: %s", e)
+
+    def _load_snapshot(self, path):
+        """Load the snapshot of the learned state, if there is a recent one"""
+
+        try:
+            state = snapshot.load(path,
+                                  max_age=mactable.DEFAULT_HARD_TIMEOUT)
+        except (OSError, ValueError) as e:
+            self.logger.warning("Ignoring the snapshot: %s", e)
+            return None
+
+        if state is None:
+            return None
+
+        for neighbor in state.neighbors:
+            self.neighbors.restore(*neighbor)
+
+        self.logger.info(
+            "Restored a snapshot from %s: %d MACs on %d switches, %d neighbors",
+            path, sum(len(macs) for macs in state.macs.values()),
+            len(state.macs), len(state.neighbors))
+
+        return state
+
+    def close(self):
+        """Save the learned state when the controller stops"""
+
+        if CONF.rsix.snapshot_interval > 0:
+            self._save_snapshot()
+
+        if self.cluster is not None:
+            self.cluster.close()
+
+        if self.jobs is not None:
+            self.jobs.stop()
+
+        if self.profiler is not None:
+            self.profiler.stop()
+
+    def _change_committed(self, job):
+        """Save the registry changed by a REST API job"""
+
+        self.logger.info("Registry change %d committed: %s", job.id,
+                         job.change.summary())
+
+        if not CONF.rsix.api_save_registry:
+            return
+
+        try:
+            save_registry(CONF.rsix.members, self.ixp.members.values(),
+                          self.ixp.vlans.values())
+        except (OSError, ValueError) as e:
+            self.logger.warning("Could not save the member registry: %s", e)
+
+    def _load_members(self, path):
+        """Load the member registry, if there is one"""
+
+        if not os.path.exists(path):
+            self.logger.info("No member registry at %s", path)
+            return []
+
+        members = load_members(path)
+        self.logger.info("Loaded %d members from %s", len(members), path)
+
+        return members
+
+    def _load_vlans(self, path):
+        """Load the VLANs provisioned in the member registry"""
+
+        if not os.path.exists(path):
+            return []
+
+        vlans = vlan.load_vlans(path)
+        if vlans:
+            self.logger.info("Loaded %d VLANs from %s", len(vlans), path)
+
+        return vlans
 
     @set_ev_cls(ofp_event.EventOFPSwitchFeatures, CONFIG_DISPATCHER)
+    @metrics.timed
     def switch_up(self, ev):
-        """Install table-miss flow entry
+        """Install table-miss and member flow entries
 
         When a switch connects, the controller requests the switch features; the
         features reply triggers this function, so the controller installs the
-        table-miss entry the switch will use to send PacketIn messages.
+        table-miss entry the switch will use to send PacketIn messages and the
+        flow entries compiled from the member registry.
+
+        A switch the controller knew before a restart, or before it
+        disconnected, gets back the MACs it had learned, so its learned entries
+        are kept.
+
+        In a cluster only the node owning the switch programs it; the others
+        become slaves of the switch.
+
+        A switch that keeps reconnecting (see sd_ixp.lifecycle) is held back
+        with only its table-miss entry until it has been connected long
+        enough.
 
         Args:
             ev (ev): instance of the OpenFlow event handler class
         """
 
-        self.switches[ev.msg.datapath.id] = Switch(ev.msg.datapath)
+        dpid = ev.msg.datapath.id
+        master = self.cluster is None or self.cluster.owns(dpid)
+
+        # The switch reconnected before its old connection was closed
+        old = self._connected(dpid)
+        if old is not None:
+            self._teardown(old)
+
+        switch = Switch(ev.msg.datapath, master=master,
+                        pipeline=self.ixp.pipeline)
+
+        macs = self.departed.pop(dpid)
+        if self.snapshot is not None:
+            restored, flows = self.snapshot.pop_switch(dpid)
+            switch.restore(macs or restored, flows)
+        else:
+            switch.restore(macs, [])
+
+        delay = 0
+        if self.damper is not None:
+            delay = self.damper.connected(dpid)
+
+        if delay:
+            self.logger.warning("Switch %s is flapping: holding it back for "
+                                "%.0f seconds", dpid, delay)
+            self._held[dpid] = (switch,
+                                hub.spawn_after(delay, self._release, switch))
+            return
+
+        self._add_switch(switch)
+
+    def _add_switch(self, switch):
+        """Add a switch to the IXP (and the cluster), programming it"""
+
+        if self.cluster is not None:
+            self.cluster.connect(switch)
+
+        self.ixp.add_switch(switch, program=switch.master)
+
+    def _release(self, switch):
+        """Add a switch held back by the damper to the IXP"""
+
+        held = self._held.get(switch.dpid)
+        if held is not None and held[0] is switch:
+            del self._held[switch.dpid]
+            self._add_switch(switch)
+
+    def _connected(self, dpid):
+        """Switch connected with a datapath id (held back or not), or None"""
+
+        held = self._held.get(dpid)
+        if held is not None:
+            return held[0]
+        return self.switches.get(dpid)
+
+    @set_ev_cls(ofp_event.EventOFPStateChange, DEAD_DISPATCHER)
+    @metrics.timed
+    def switch_down(self, ev):
+        """Release everything held for a switch that disconnected
+
+        Args:
+            ev (ev): instance of the OpenFlow event handler class
+        """
+
+        datapath = ev.datapath
+
+        # A connection closed before the features reply has no switch, and
+        # one replaced by a reconnection was torn down already
+        switch = self._connected(datapath.id)
+        if switch is None or switch.datapath is not datapath:
+            return
+
+        self.logger.info("Switch %s disconnected", datapath.id)
+        self._teardown(switch)
+
+    def _teardown(self, switch):
+        """Remove a switch from the IXP and the per-switch state
+
+        The MACs it learned are kept in case it reconnects.
+        """
+
+        dpid = switch.dpid
+
+        held = self._held.pop(dpid, None)
+        if held is not None:
+            hub.kill(held[1])
+        else:
+            self.ixp.remove_switch(dpid)
+            if self.cluster is not None:
+                self.cluster.disconnect(dpid)
+
+        self.limiter.forget(dpid)
+        self.ixp.allowlist.forget(dpid)
+
+        self.departed.store(dpid, switch.learned_state()[0])
+        switch.close()
 
     @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
+    @metrics.timed
     def _packet_in_handler(self, ev):
         """PacketIn handler
 
@@ -73,20 +666,228 @@ class SD_RSiX(app_manager.RyuApp):
             ev (ev): instance of the OpenFlow event handler class
         """
 
+        self.event_log.count('PacketIns', ev.msg.datapath.id)
+
+        port = (ev.msg.datapath.id, ev.msg.match['in_port'])
+        PACKET_INS.inc(port)
+
+        # Drop PacketIns of ports over their budget before any processing; the
+        # first drop pushes a storm guard to the switch
+        verdict = self.limiter.check(*port)
+        if verdict != ratelimit.ALLOW:
+            self.event_log.count('PacketIns dropped', ev.msg.datapath.id)
+            PACKET_INS_DROPPED.inc(port)
+            if verdict == ratelimit.TRIP:
+                self._storm_guard(*port)
+            return
+
+        # Frames from sources their member port does not accept are neither
+        # forwarded, learned nor flooded; the first of a source gets it
+        # dropped by the switch
+        src = classifier.eth_src(ev.msg.data)
+        verdict = self.ixp.allowlist.check(port[0], port[1], src)
+        if verdict != allowlist.ALLOW:
+            SOURCE_VIOLATIONS.inc(port)
+            if verdict == allowlist.BLOCK:
+                self._block_source(port[0], port[1], src)
+            return
+
         # If you hit this you might want to increase
         # the "miss_send_length" of your switch
         if ev.msg.msg_len < ev.msg.total_len:
-            self.logger.debug("packet truncated: only %s of %s bytes",
-                              ev.msg.msg_len, ev.msg.total_len)
+            self.event_log.log('truncated', logging.DEBUG,
+                               "packet truncated: only %s of %s bytes",
+                               ev.msg.msg_len, ev.msg.total_len)
+
+        # Classify the frame reading only the headers needed to dispatch it;
+        # handlers build a packet.Packet themselves when they need the decoded
+        # protocols.
+        kind, vlan_id, offset = classifier.classify(ev.msg.data)
+
+        # A switch that does not keep up with what it is sent would only get
+        # its PacketOuts shed; its FlowMods go first (see sd_ixp.outbound).
+        # ARP and ND still teach the neighbor table, and their replies go
+        # whenever there is room.
+        switch = self.switches.get(ev.msg.datapath.id)
+        if (switch is not None and switch.congested() and
+                kind not in _NEIGHBOR_DISCOVERY):
+            self.event_log.count('PacketIns shed', ev.msg.datapath.id)
+            PACKET_INS_SHED.inc(port[:1])
+            return
+
+        if kind in _NEIGHBOR_DISCOVERY:
+            if switch is None:
+                self.neighbors.discovery_handler(ev.msg)
+            else:
+                self.neighbors.discovery_handler(ev.msg, flood=switch.flood,
+                                                 send_msg=switch.send_msg)
+            return
+
+        if kind == classifier.LLDP:
+            self.ixp.lldp_received(port[0], port[1], ev.msg.data, offset)
+            return
+
+        if kind == classifier.IGNORE:
+            return
+
+        if switch is not None:
+            switch.l2_learning(ev.msg, vlan_id)
+
+    def _storm_guard(self, dpid, port):
+        """Guard a port that went over its PacketIn budget"""
+
+        self.event_log.log('storm', logging.WARNING,
+                           "PacketIn storm on switch %s port %s: guarding "
+                           "the port", dpid, port)
+
+        switch = self.switches.get(dpid)
+        if switch is not None:
+            switch.guard_port(port, rate=CONF.rsix.storm_guard_rate)
+
+    def _block_source(self, dpid, port, mac):
+        """Drop the frames of a source MAC a member port does not accept"""
+
+        mac = mactable.int_to_mac(mac)
+        self.event_log.log('source', logging.WARNING,
+                           "Source %s is not registered on switch %s port %s: "
+                           "dropping its frames", mac, dpid, port)
+
+        switch = self.switches.get(dpid)
+        if switch is not None:
+            switch.block_source(port, mac, CONF.rsix.source_block_duration)
+
+    @set_ev_cls(ofp_event.EventOFPBarrierReply,
+                [CONFIG_DISPATCHER, MAIN_DISPATCHER])
+    @metrics.timed
+    def _barrier_reply_handler(self, ev):
+        """Barrier reply handler
+
+        Resolves the completion of the batch of flow mods the barrier followed.
+
+        Args:
+            ev (ev): instance of the OpenFlow event handler class
+        """
+
+        switch = self.switches.get(ev.msg.datapath.id)
+        if switch is not None:
+            switch.barrier_reply(ev.msg)
+
+    @set_ev_cls(ofp_event.EventOFPErrorMsg,
+                [CONFIG_DISPATCHER, MAIN_DISPATCHER])
+    @metrics.timed
+    def _error_msg_handler(self, ev):
+        """OpenFlow error handler
+
+        Args:
+            ev (ev): instance of the OpenFlow event handler class
+        """
+
+        msg = ev.msg
+        self.logger.warning("OpenFlow error from switch %s: type=%s code=%s",
+                            msg.datapath.id, msg.type, msg.code)
+
+        if (self.cluster is not None and
+                msg.type == msg.datapath.ofproto.OFPET_ROLE_REQUEST_FAILED):
+            self.cluster.role_error(msg)
+            return
+
+        switch = self.switches.get(msg.datapath.id)
+        if switch is not None:
+            switch.error(msg)
+
+    @set_ev_cls(ofp_event.EventOFPRoleReply, MAIN_DISPATCHER)
+    @metrics.timed
+    def _role_reply_handler(self, ev):
+        """Role reply handler
+
+        A switch confirmed the role this controller node asked for.
+
+        Args:
+            ev (ev): instance of the OpenFlow event handler class
+        """
+
+        if self.cluster is not None:
+            self.cluster.role_reply(ev.msg)
 
-        #pkt = packet.Packet(ev.msg.data)
-        eth = packet.Packet(ev.msg.data).get_protocols(ethernet.ethernet)[0]
+    @set_ev_cls([ofp_event.EventOFPFlowStatsReply,
+                 ofp_event.EventOFPFlowDescStatsReply], MAIN_DISPATCHER)
+    @metrics.timed
+    def _flow_stats_reply_handler(self, ev):
+        """Flow stats reply handler
 
-        if eth.ethertype == ether_types.ETH_TYPE_ARP:
-            neighbor.discovery_handler(ev.msg)
+        Loads the flow entries a switch reports into its shadow table, or
+        records their counters when the reply is for a stats poll.
+
+        Args:
+            ev (ev): instance of the OpenFlow event handler class
+        """
+
+        switch = self.switches.get(ev.msg.datapath.id)
+        if switch is not None:
+            switch.flow_stats_reply(ev.msg)
+
+    @set_ev_cls(ofp_event.EventOFPGroupDescStatsReply, MAIN_DISPATCHER)
+    @metrics.timed
+    def _group_desc_reply_handler(self, ev):
+        """Group desc reply handler
+
+        Loads the groups a switch reports, before it is programmed.
+
+        Args:
+            ev (ev): instance of the OpenFlow event handler class
+        """
+
+        switch = self.switches.get(ev.msg.datapath.id)
+        if switch is not None:
+            switch.group_desc_reply(ev.msg)
+
+    @set_ev_cls(ofp_event.EventOFPPortStatsReply, MAIN_DISPATCHER)
+    @metrics.timed
+    def _port_stats_reply_handler(self, ev):
+        """Port stats reply handler
+
+        Records the port counters of a stats poll.
+
+        Args:
+            ev (ev): instance of the OpenFlow event handler class
+        """
+
+        switch = self.switches.get(ev.msg.datapath.id)
+        if switch is not None:
+            switch.port_stats_reply(ev.msg)
+
+    @set_ev_cls(ofp_event.EventOFPPortStatus, MAIN_DISPATCHER)
+    @metrics.timed
+    def _port_status_handler(self, ev):
+        """Port status handler
+
+        A port that goes down takes its links with it, so the paths through
+        it are recomputed right away instead of when its LLDP frames time out.
+
+        Args:
+            ev (ev): instance of the OpenFlow event handler class
+        """
+
+        msg = ev.msg
+        ofproto = msg.datapath.ofproto
+
+        if (msg.reason == ofproto.OFPPR_DELETE or
+                msg.desc.state & ofproto.OFPPS_LINK_DOWN or
+                msg.desc.config & ofproto.OFPPC_PORT_DOWN):
+            self.ixp.port_down(msg.datapath.id, msg.desc.port_no)
+
+    @set_ev_cls(ofp_event.EventOFPFlowRemoved, MAIN_DISPATCHER)
+    @metrics.timed
+    def _flow_removed_handler(self, ev):
+        """Flow removed handler
+
+        Switches notify the removal of entries that expired by themselves, e.g.
+        the idle timeout of a learned MAC.
+
+        Args:
+            ev (ev): instance of the OpenFlow event handler class
+        """
 
-        if eth.ethertype == ether_types.ETH_TYPE_IPV6:
-            for p in pkt.protocols:
-                if p.protocol_name == 'icmpv6' and (p.type_ == 135 or
-                                                    p.type_ == 136):
-                    neighbor.discovery_handler(ev.msg)
+        switch = self.switches.get(ev.msg.datapath.id)
+        if switch is not None:
+            switch.flow_removed(ev.msg)
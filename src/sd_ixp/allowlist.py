@@ -0,0 +1,149 @@
+# Copyright (C) 2018 [SD]RSiX Project
+#
+# Licensed under the Apache License, Version 2.0 (the “License”);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an “AS IS” BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Source MAC allowlist of the member ports
+
+A member port only accepts frames from the MACs its member registered. The
+filter table of the switches passes those (see sd_ixp.compiler); any other
+source misses it and reaches the controller, which must not forward it, learn
+it or flood it. The allowlist is checked first thing in the PacketIn pipeline:
+a dictionary lookup of the port and a set lookup of the source MAC (a 48-bit
+integer), with a single frozenset of MACs shared by all the ports of a member.
+
+The first frame of an unregistered (port, source MAC) pair makes the
+application install a drop entry for it (see compiler.compile_blocked), so the
+frames that follow never leave the switch: an unauthorized MAC costs one
+PacketIn. Drop entries expire after block_duration seconds; at most
+max_per_port pairs of a port are blocked at a time, so random source MACs
+can not fill the flow table (the PacketIn budget of the port, see
+sd_ixp.ratelimit, handles that traffic).
+
+Ports without a registered member (and trunks) accept any source.
+"""
+
+import collections
+import time
+
+from sd_ixp import mactable
+
+# Results of MACAllowlist.check()
+ALLOW = 0
+DENY = 1
+BLOCK = 2
+
+# Default seconds a (port, source MAC) pair stays blocked
+DEFAULT_BLOCK_DURATION = 300
+
+# Default number of pairs blocked at a time per port
+DEFAULT_MAX_PER_PORT = 32
+
+
+class MACAllowlist:
+    """MACs allowed on each member port, and the pairs blocked
+
+    Attributes:
+        block_duration (int): seconds a pair stays blocked
+        max_per_port (int): pairs blocked at a time per port
+        _ports (dictionary): allowed MACs (frozenset of 48-bit integers) by
+            (datapath id, port)
+        _blocked (dictionary): blocked MACs of each port, oldest first
+        denied (int): PacketIns denied
+        blocked (int): pairs blocked
+    """
+
+    def __init__(self, block_duration=DEFAULT_BLOCK_DURATION,
+                 max_per_port=DEFAULT_MAX_PER_PORT):
+        self.block_duration = block_duration
+        self.max_per_port = max_per_port
+
+        # Structure: { (datapath_id, port), frozenset of MACs }
+        self._ports = {}
+
+        # Structure: { (datapath_id, port), OrderedDict { MAC, expiry } }
+        self._blocked = {}
+
+        self.denied = 0
+        self.blocked = 0
+
+    def __len__(self):
+        """Number of member ports"""
+        return len(self._ports)
+
+    def add_member(self, member):
+        """Restrict the ports of a member to its MACs"""
+
+        macs = frozenset(mactable.mac_to_int(mac) for mac in member.macs)
+        for port in member.ports:
+            self._ports[port] = macs
+            self._blocked.pop(port, None)
+
+    def remove_member(self, member):
+        """Lift the restriction of the ports of a member"""
+
+        for port in member.ports:
+            self._ports.pop(port, None)
+            self._blocked.pop(port, None)
+
+    def allowed(self, dpid, port, mac):
+        """Whether a port accepts a source MAC (48-bit integer)"""
+
+        macs = self._ports.get((dpid, port))
+        return macs is None or mac in macs
+
+    def check(self, dpid, port, mac, now=None):
+        """Check the source MAC of a PacketIn
+
+        Args:
+            dpid (int): datapath id of the switch that sent the PacketIn
+            port (int): in_port of the PacketIn
+            mac (int): source MAC (48-bit integer)
+            now (float): monotonic time (defaults to the current time)
+
+        Returns:
+            int: ALLOW; BLOCK for the first frame of a pair the port does not
+                accept, whose drop entry must be installed; DENY for the
+                frames sent before the entry was installed, and for the pairs
+                over max_per_port
+        """
+
+        macs = self._ports.get((dpid, port))
+        if macs is None or mac in macs:
+            return ALLOW
+
+        self.denied += 1
+
+        if now is None:
+            now = time.monotonic()
+
+        blocked = self._blocked.get((dpid, port))
+        if blocked is None:
+            blocked = self._blocked[(dpid, port)] = collections.OrderedDict()
+
+        # Every pair is blocked for the same duration, so the oldest expire
+        # first
+        while blocked and next(iter(blocked.values())) <= now:
+            blocked.popitem(last=False)
+
+        if mac in blocked or len(blocked) >= self.max_per_port:
+            return DENY
+
+        blocked[mac] = now + self.block_duration
+        self.blocked += 1
+        return BLOCK
+
+    def forget(self, dpid):
+        """Forget the pairs blocked on a switch (e.g. it disconnected)"""
+
+        for key in [key for key in self._blocked if key[0] == dpid]:
+            del self._blocked[key]
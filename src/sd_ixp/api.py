@@ -0,0 +1,132 @@
+# Copyright (C) 2018 [SD]RSiX Project
+#
+# Licensed under the Apache License, Version 2.0 (the “License”);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an “AS IS” BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Northbound REST API
+
+The member registry is read and changed over HTTP with JSON bodies, served by
+Ryu's WSGI server (--wsapi-host and --wsapi-port, 0.0.0.0:8080 by default):
+
+    GET  /rsix/members          registered members (registry format)
+    GET  /rsix/members/<asn>    a registered member
+    GET  /rsix/vlans            VLANs provisioned between members
+    POST /rsix/jobs             submit a Change (see sd_ixp.jobs)
+    GET  /rsix/jobs             Jobs waiting, running and recently finished
+    GET  /rsix/jobs/<id>        a Job
+
+A Change is checked against the registry when it is submitted (400 Bad Request
+if it is invalid) and replied with 202 Accepted and its Job, whose URL is in
+the Location header; the Job is polled until it is committed, rolled back or
+failed. As the Jobs queued before it may change the registry, the Change is
+checked again when it runs.
+
+POST requests must carry the configured token in the X-Auth-Token header;
+without a token configured they are all refused.
+"""
+
+import hmac
+import json
+
+from ryu.app.wsgi import ControllerBase, Response, route
+
+from sd_ixp import jobs
+
+PREFIX = '/rsix'
+
+# Largest request body accepted
+MAX_BODY = 16 * 1024 * 1024
+
+_ROUTE = 'rsix'
+
+
+class RegistryController(ControllerBase):
+    """REST controller of the member registry and its change Jobs
+
+    Attributes:
+        ixp (IXP): the IXP holding the registry
+        jobs (JobQueue): queue the Changes are submitted to
+        token (str): token POST requests must carry (empty refuses them
+            all)
+    """
+
+    def __init__(self, req, link, data, **config):
+        super(RegistryController, self).__init__(req, link, data, **config)
+        self.ixp = data['ixp']
+        self.jobs = data['jobs']
+        self.token = data.get('token', '')
+
+    @route(_ROUTE, PREFIX + '/members', methods=['GET'])
+    def list_members(self, req, **kwargs):
+        return _reply([member.to_dict() for _, member in
+                       sorted(self.ixp.members.items())])
+
+    @route(_ROUTE, PREFIX + '/members/{asn}', methods=['GET'],
+           requirements={'asn': r'\d+'})
+    def get_member(self, req, asn, **kwargs):
+        member = self.ixp.members.get(int(asn))
+        if member is None:
+            return _error(404, 'AS%s is not a member' % asn)
+
+        return _reply(member.to_dict())
+
+    @route(_ROUTE, PREFIX + '/vlans', methods=['GET'])
+    def list_vlans(self, req, **kwargs):
+        return _reply([vlan.to_dict() for _, vlan in
+                       sorted(self.ixp.vlans.items())])
+
+    @route(_ROUTE, PREFIX + '/jobs', methods=['GET'])
+    def list_jobs(self, req, **kwargs):
+        return _reply([job.to_dict() for job in self.jobs.jobs()])
+
+    @route(_ROUTE, PREFIX + '/jobs/{job_id}', methods=['GET'],
+           requirements={'job_id': r'\d+'})
+    def get_job(self, req, job_id, **kwargs):
+        job = self.jobs.get(int(job_id))
+        if job is None:
+            return _error(404, 'no job %s' % job_id)
+
+        return _reply(job.to_dict())
+
+    @route(_ROUTE, PREFIX + '/jobs', methods=['POST'])
+    def submit_job(self, req, **kwargs):
+        if not self.token or not hmac.compare_digest(
+                req.headers.get('X-Auth-Token', ''), self.token):
+            return _error(401, 'invalid or missing X-Auth-Token')
+
+        if req.content_length is not None and req.content_length > MAX_BODY:
+            return _error(413, 'request body over %d bytes' % MAX_BODY)
+
+        try:
+            change = jobs.Change.from_dict(json.loads(req.text))
+            if not len(change):
+                raise ValueError('the change is empty')
+            change.validate(self.ixp)
+        except ValueError as e:
+            return _error(400, str(e))
+
+        job = self.jobs.submit(change)
+        if job is None:
+            return _error(503, 'too many jobs queued, retry later')
+
+        response = _reply(job.to_dict(), status=202)
+        response.location = '%s/jobs/%d' % (PREFIX, job.id)
+        return response
+
+
+def _reply(data, status=200):
+    return Response(status=status, content_type='application/json',
+                    text=json.dumps(data))
+
+
+def _error(status, message):
+    return _reply({'error': message}, status)
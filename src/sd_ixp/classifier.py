@@ -0,0 +1,121 @@
+# Copyright (C) 2018 [SD]RSiX Project
+#
+# Licensed under the Apache License, Version 2.0 (the “License”);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an “AS IS” BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""PacketIn pre-classifier
+
+Building a ryu packet.Packet object is expensive: it decodes every header of the
+frame into protocol objects. Most PacketIns only need the ethertype (and the
+ICMPv6 type for Neighbor Discovery) to decide what to do with them, so this
+module reads those fields straight from the PacketIn data buffer using
+struct.unpack_from, which does not copy the buffer.
+"""
+
+import struct
+
+from ryu.lib.packet import ether_types
+
+# Frame kinds returned by classify()
+IGNORE = 0
+ARP = 1
+ND_NS = 2
+ND_NA = 3
+IPV4 = 4
+IPV6 = 5
+LLDP = 6
+OTHER = 7
+
+# Ethernet header: destination MAC (6 bytes), source MAC (6 bytes) and
+# ethertype (2 bytes)
+ETH_HEADER_LEN = 14
+
+# VLAN tag: TPID (2 bytes, read as the ethertype) and TCI (2 bytes)
+VLAN_TAG_LEN = 4
+
+# IPv6 fixed header length and offset of its Next Header field
+IPV6_HEADER_LEN = 40
+IPV6_NEXT_HEADER = 6
+
+IPPROTO_ICMPV6 = 58
+
+# ICMPv6 Neighbor Solicitation and Neighbor Advertisement types
+ICMPV6_NS = 135
+ICMPV6_NA = 136
+
+_VLAN_TPIDS = (ether_types.ETH_TYPE_8021Q, ether_types.ETH_TYPE_8021AD)
+
+_ETHERTYPE_KINDS = {
+    ether_types.ETH_TYPE_ARP: ARP,
+    ether_types.ETH_TYPE_IP: IPV4,
+    ether_types.ETH_TYPE_LLDP: LLDP,
+}
+
+_ND_KINDS = {ICMPV6_NS: ND_NS, ICMPV6_NA: ND_NA}
+
+_unpack_short = struct.Struct('!H').unpack_from
+_unpack_byte = struct.Struct('!B').unpack_from
+_unpack_tag = struct.Struct('!HH').unpack_from
+
+
+def classify(data):
+    """Classify a frame without decoding it
+
+    Args:
+        data (bytes or bytearray): the Ethernet frame from a PacketIn
+
+    Returns:
+        A (kind, vlan_id, l3_offset) tuple. kind is one of the constants of
+        this module, vlan_id is the VID of the outermost VLAN tag (None for
+        untagged frames) and l3_offset is where the payload of the Ethernet
+        frame starts. Frames too short to be classified are IGNORE.
+    """
+
+    length = len(data)
+    if length < ETH_HEADER_LEN:
+        return IGNORE, None, 0
+
+    ethertype, = _unpack_short(data, 12)
+    offset = ETH_HEADER_LEN
+    vlan_id = None
+
+    # Skip VLAN tags (802.1Q and QinQ), keeping the outermost VID
+    while ethertype in _VLAN_TPIDS:
+        if length < offset + VLAN_TAG_LEN:
+            return IGNORE, None, 0
+        tci, ethertype = _unpack_tag(data, offset)
+        if vlan_id is None:
+            vlan_id = tci & 0x0fff
+        offset += VLAN_TAG_LEN
+
+    if ethertype != ether_types.ETH_TYPE_IPV6:
+        return _ETHERTYPE_KINDS.get(ethertype, OTHER), vlan_id, offset
+
+    # Neighbor Discovery messages are ICMPv6 right after the IPv6 header
+    if length < offset + IPV6_HEADER_LEN + 1:
+        return IPV6, vlan_id, offset
+    next_header, = _unpack_byte(data, offset + IPV6_NEXT_HEADER)
+    if next_header != IPPROTO_ICMPV6:
+        return IPV6, vlan_id, offset
+    icmp_type, = _unpack_byte(data, offset + IPV6_HEADER_LEN)
+
+    return _ND_KINDS.get(icmp_type, IPV6), vlan_id, offset
+
+
+def eth_dst(data):
+    """Destination MAC address of a frame as a 48-bit integer"""
+    return int.from_bytes(memoryview(data)[0:6], 'big')
+
+
+def eth_src(data):
+    """Source MAC address of a frame as a 48-bit integer"""
+    return int.from_bytes(memoryview(data)[6:12], 'big')
@@ -0,0 +1,453 @@
+# Copyright (C) 2018 [SD]RSiX Project
+#
+# Licensed under the Apache License, Version 2.0 (the “License”);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an “AS IS” BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Controller clustering
+
+Several controller instances (nodes) share the switches of the fabric. Every
+switch connects to all the nodes; each switch is owned by one node, chosen by
+consistent hashing of its datapath id over the nodes that are alive, and that
+node asks the switch for the MASTER role while the others ask for SLAVE. Only
+the master programs the switch and receives its PacketIns.
+
+The nodes exchange heartbeats and replicate what they learn (MACs per switch
+and neighbor bindings) through a backend, so every node knows the learned
+state of every switch. When a node stops sending heartbeats its switches are
+spread over the remaining nodes: the new owner asks for the MASTER role and
+reconciles the switch with its flow dump, which already holds the entries the
+former master installed, so nothing is reinstalled.
+
+Role requests carry a generation id taken from the wall clock (in
+milliseconds), so the clocks of the nodes must be synchronized (NTP) for a new
+master to be accepted by the switches.
+
+What a node hears from the others decides who programs the switches and
+what the proxy ARP/ND replies, so the UDP backend only accepts the datagrams
+of the configured peer addresses, signed with the secret the nodes share
+(HMAC-SHA256) by the node the address belongs to, and sent less than
+MAX_SKEW seconds ago. Messages of an unexpected shape are dropped before they
+reach the application.
+"""
+
+import bisect
+import hashlib
+import hmac
+import ipaddress
+import json
+import socket
+import time
+
+from ryu.lib import hub
+
+# Seconds between heartbeats, and without heartbeats after which a node is
+# considered dead
+HEARTBEAT_INTERVAL = 1
+HEARTBEAT_TIMEOUT = 3
+
+# Points of each node on the hash ring
+REPLICAS = 64
+
+# Seconds a datagram is accepted for after it was sent (replays of older ones
+# are dropped)
+MAX_SKEW = 5
+
+# Message types
+HEARTBEAT = 'heartbeat'
+LEARN = 'learn'
+FORGET = 'forget'
+NEIGHBOR = 'neighbor'
+
+# Roles (OFPCR_ROLE_MASTER and OFPCR_ROLE_SLAVE, the same on OpenFlow 1.3+)
+MASTER = 2
+SLAVE = 3
+
+# Size of the HMAC-SHA256 tag leading every datagram
+TAG_SIZE = 32
+
+_INT = (int, )
+_OPTIONAL_INT = (int, type(None))
+
+# Fields (and their types) of each message type
+_FIELDS = {
+    HEARTBEAT: {},
+    LEARN: {'dpid': _INT, 'mac': _INT, 'vlan': _OPTIONAL_INT, 'port': _INT},
+    FORGET: {'dpid': _INT, 'mac': _INT, 'vlan': _OPTIONAL_INT,
+             'port': _INT},
+    NEIGHBOR: {'ip': (str, ), 'mac': (str, ), 'dpid': _INT, 'port': _INT,
+               'vlan': _OPTIONAL_INT, 'router': (bool, )},
+}
+
+
+def _hash(value):
+    # Python's hash() of strings differs between processes
+    return int.from_bytes(
+        hashlib.md5(str(value).encode()).digest()[:8], 'big')
+
+
+def derive_key(secret, purpose):
+    """Key for a purpose (e.g. b'lldp') derived from the cluster secret
+
+    Every node derives the same key, so what one node signs (e.g. the LLDP
+    frames of its switches) the others can check.
+    """
+    return hmac.new(secret, b'rsix-' + purpose, hashlib.sha256).digest()
+
+
+def valid(message, nodes):
+    """Whether a message has the shape of its type
+
+    Args:
+        message: the decoded message
+        nodes (collection): ids of the nodes of the cluster
+
+    Returns:
+        bool: whether the message is a dictionary of a known type, sent by a
+            node of the cluster, with the fields of its type
+    """
+
+    if not isinstance(message, dict):
+        return False
+
+    fields = _FIELDS.get(message.get('type'))
+    if fields is None or message.get('node') not in nodes:
+        return False
+
+    for name, types in fields.items():
+        value = message.get(name)
+        # bool is an int, but only a bool field takes one
+        if not isinstance(value, types) or (isinstance(value, bool) and
+                                            bool not in types):
+            return False
+
+    if message['type'] == NEIGHBOR:
+        try:
+            ipaddress.ip_address(message['ip'])
+        except ValueError:
+            return False
+
+    return True
+
+
+class HashRing:
+    """Consistent hashing of datapath ids over nodes
+
+    Removing a node only moves the switches it owned; the others keep their
+    owner.
+    """
+
+    def __init__(self, nodes, replicas=REPLICAS):
+        points = sorted((_hash('%s-%d' % (node, i)), node)
+                        for node in nodes for i in range(replicas))
+        self._hashes = [point[0] for point in points]
+        self._nodes = [point[1] for point in points]
+
+    def owner(self, dpid):
+        """Node owning a switch (None if there are no nodes)"""
+
+        if not self._nodes:
+            return None
+
+        i = bisect.bisect(self._hashes, _hash(dpid)) % len(self._hashes)
+        return self._nodes[i]
+
+
+class LocalBackend:
+    """In-process backend: the nodes attached to it get each other's messages
+
+    Meant for tests and benchmarks running several Cluster objects in one
+    process. Messages are delivered synchronously.
+    """
+
+    def __init__(self):
+        # Structure: { node, receive callback }
+        self._nodes = {}
+
+    def attach(self, node, receive):
+        self._nodes[node] = receive
+
+    def send(self, sender, message):
+        for node, receive in list(self._nodes.items()):
+            if node != sender:
+                receive(message)
+
+    def close(self):
+        self._nodes.clear()
+
+
+class UDPBackend:
+    """Signed JSON datagrams between the nodes
+
+    A datagram is the HMAC-SHA256 tag of its body followed by the body, the
+    JSON of the message and the wall clock time it was sent.
+
+    Args:
+        address (tuple): (host, port) this node listens on
+        peers (dictionary): (host, port) of each of the other nodes
+        secret (bytes): secret shared by the nodes
+        logger: logger of the application
+
+    Attributes:
+        dropped (int): datagrams dropped (unknown sender, bad tag or message,
+            too old)
+    """
+
+    # Largest datagram received
+    MAX_SIZE = 65507
+
+    def __init__(self, address, peers, secret, logger=None):
+        if not secret:
+            raise ValueError('the cluster needs a shared secret')
+
+        self._secret = secret
+        self._logger = logger
+
+        # Datagrams come from the address the peer listens on
+        # Structure: { (IP, port), node }
+        self._peers = {(socket.gethostbyname(host), port): node
+                       for node, (host, port) in peers.items()}
+
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.bind(address)
+        self._thread = None
+        self.dropped = 0
+
+    def attach(self, node, receive):
+        self._thread = hub.spawn(self._receive_loop, receive)
+
+    def send(self, sender, message):
+        body = json.dumps([message, time.time()]).encode()
+        data = hmac.new(self._secret, body, hashlib.sha256).digest() + body
+        for peer in self._peers:
+            try:
+                self._socket.sendto(data, peer)
+            except OSError:
+                # A peer that is down is detected by the missing heartbeats
+                pass
+
+    def close(self):
+        if self._thread is not None:
+            hub.kill(self._thread)
+        self._socket.close()
+
+    def _receive_loop(self, receive):
+        while True:
+            data, address = self._socket.recvfrom(self.MAX_SIZE)
+            message = self._open(data, address)
+            if message is None:
+                self.dropped += 1
+                continue
+
+            try:
+                receive(message)
+            except Exception:
+                # A bad message must not stop the replication
+                if self._logger is not None:
+                    self._logger.exception(
+                        "Failed to apply a message of cluster node %s",
+                        message.get('node'))
+
+    def _open(self, data, address):
+        """Message of a datagram, or None if it is not to be trusted"""
+
+        node = self._peers.get(address)
+        if node is None:
+            return None
+
+        tag, body = data[:TAG_SIZE], data[TAG_SIZE:]
+        if not hmac.compare_digest(
+                tag, hmac.new(self._secret, body, hashlib.sha256).digest()):
+            return None
+
+        try:
+            message, sent = json.loads(body.decode())
+            # (also false for a NaN time)
+            if not abs(time.time() - sent) <= MAX_SKEW:
+                return None
+        except (ValueError, TypeError):
+            return None
+
+        # A node only speaks for itself
+        if not isinstance(message, dict) or message.get('node') != node:
+            return None
+
+        return message
+
+
+class Cluster:
+    """Membership, switch ownership and replication of a node
+
+    Attributes:
+        node (str): id of this node
+        on_promote (callable): called with a Switch once this node is its
+            confirmed master
+        on_message (callable): called with the replication messages of the
+            other nodes
+        _backend: LocalBackend or UDPBackend
+        _seen (dictionary): monotonic time each node was last heard of
+        _ring (HashRing): ownership over the nodes alive
+        _switches (dictionary): switches connected to this node
+        _generation (int): generation id of the last role request
+    """
+
+    def __init__(self, node, nodes, backend, on_promote=None,
+                 on_message=None, logger=None):
+        self.node = node
+        self.on_promote = on_promote
+        self.on_message = on_message
+        self._logger = logger
+        self._backend = backend
+
+        # Only the configured nodes are members of the cluster
+        self._nodes = frozenset(nodes) | {node}
+
+        # Nodes are given the time of a heartbeat to show up
+        now = time.monotonic()
+
+        # Structure: { node, monotonic time }
+        self._seen = {n: now for n in self._nodes}
+        self._ring = HashRing(self._seen)
+
+        # Structure: { datapath_id, Switch }
+        self._switches = {}
+
+        self._generation = 0
+
+        backend.attach(node, self._receive)
+
+    def alive(self, now=None):
+        """Nodes alive (this one included)"""
+
+        if now is None:
+            now = time.monotonic()
+
+        return sorted(node for node, seen in self._seen.items()
+                      if node == self.node or now - seen < HEARTBEAT_TIMEOUT)
+
+    def owner(self, dpid):
+        """Node owning a switch"""
+        return self._ring.owner(dpid)
+
+    def owns(self, dpid):
+        """Whether this node owns (must be the master of) a switch"""
+        return self._ring.owner(dpid) == self.node
+
+    def connect(self, switch):
+        """Ask a switch that connected for the role of this node
+
+        The MACs the switch learns and forgets are replicated to the other
+        nodes from now on.
+        """
+
+        self._switches[switch.dpid] = switch
+        switch.replicator = self._replicate_mac
+        self._request_role(switch, MASTER if self.owns(switch.dpid)
+                           else SLAVE)
+
+    def disconnect(self, dpid):
+        """Forget a switch that disconnected"""
+
+        switch = self._switches.pop(dpid, None)
+        if switch is not None:
+            switch.replicator = None
+
+    def tick(self, now=None):
+        """Send a heartbeat and rebalance the switches if nodes came or went
+
+        Called every HEARTBEAT_INTERVAL.
+        """
+
+        if now is None:
+            now = time.monotonic()
+
+        self._backend.send(self.node, {'type': HEARTBEAT, 'node': self.node})
+
+        alive = self.alive(now)
+        ring = HashRing(alive)
+        changed = [dpid for dpid in self._switches
+                   if ring.owner(dpid) != self._ring.owner(dpid)]
+        self._ring = ring
+
+        if changed and self._logger is not None:
+            self._logger.info("Cluster nodes alive: %s; %d switches change "
+                              "owner", ', '.join(alive), len(changed))
+
+        for dpid in changed:
+            switch = self._switches[dpid]
+            if self.owns(dpid):
+                self._request_role(switch, MASTER)
+            elif switch.master:
+                self._request_role(switch, SLAVE)
+
+    def role_reply(self, msg):
+        """Handle a role reply: a confirmed MASTER role is a promotion"""
+
+        switch = self._switches.get(msg.datapath.id)
+        if switch is None:
+            return
+
+        self._generation = max(self._generation, msg.generation_id)
+
+        if msg.role == MASTER and not switch.master:
+            switch.set_master(True)
+            if self.on_promote is not None:
+                self.on_promote(switch)
+
+    def role_error(self, msg):
+        """Handle a failed role request (a stale generation id is retried)"""
+
+        switch = self._switches.get(msg.datapath.id)
+        if switch is None:
+            return
+
+        ofproto = msg.datapath.ofproto
+        if msg.code == ofproto.OFPRRFC_STALE:
+            self._request_role(switch, MASTER if self.owns(switch.dpid)
+                               else SLAVE)
+        elif self._logger is not None:
+            self._logger.error("Switch %s refused role request: code=%s",
+                               switch.dpid, msg.code)
+
+    def replicate_neighbor(self, neighbor):
+        """Send a neighbor binding learned by this node to the others"""
+
+        self._backend.send(self.node, {
+            'type': NEIGHBOR, 'node': self.node, 'ip': neighbor.ip,
+            'mac': neighbor.mac, 'dpid': neighbor.dpid, 'port': neighbor.port,
+            'vlan': neighbor.vlan, 'router': neighbor.router})
+
+    def close(self):
+        self._backend.close()
+
+    def _replicate_mac(self, kind, dpid, mac, vlan, port):
+        self._backend.send(self.node, {
+            'type': kind, 'node': self.node, 'dpid': dpid, 'mac': mac,
+            'vlan': vlan, 'port': port})
+
+    def _request_role(self, switch, role):
+        # A SLAVE request takes effect right away; MASTER once confirmed
+        if role == SLAVE:
+            switch.set_master(False)
+
+        self._generation = max(self._generation + 1, int(time.time() * 1000))
+        switch.request_role(role, self._generation)
+
+    def _receive(self, message):
+        if not valid(message, self._nodes) or message['node'] == self.node:
+            if self._logger is not None:
+                self._logger.debug("Dropped cluster message: %r", message)
+            return
+
+        if message['type'] == HEARTBEAT:
+            self._seen[message['node']] = time.monotonic()
+        elif self.on_message is not None:
+            self.on_message(message)
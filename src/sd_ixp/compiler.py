@@ -0,0 +1,575 @@
+# Copyright (C) 2018 [SD]RSiX Project
+#
+# Licensed under the Apache License, Version 2.0 (the “License”);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an “AS IS” BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Proactive flow compiler
+
+Turns the member registry into the flow entries of a switch, so a switch is
+fully programmed as soon as it connects and member traffic never needs a
+PacketIn. The rules go through a pipeline of tables, each stage matching only
+what it decides on and passing its result to the next ones in the metadata:
+
+    FILTER_TABLE    (in_port, eth_src) of every member MAC -> VLAN
+    VLAN_TABLE      (in_port, VLAN) of every member port and VLAN ->
+                    metadata:VLAN, FORWARD
+    FORWARD_TABLE   (metadata:VLAN, eth_dst) of every member MAC ->
+                    metadata:port, EGRESS
+    EGRESS_TABLE    (metadata:port) of every member port -> output:port
+
+which is O(MACs + ports x VLANs) entries, instead of the O(N²) (in_port,
+eth_src, eth_dst) entries a learning switch installs, or the MACs x VLANs
+filter entries of matching the VLAN along with the source. Frames that match
+no entry (unknown sources, broadcasts and multicasts) go to the controller;
+frames of a member on a VLAN that is not its own are dropped.
+
+Switches of a fabric are linked by trunk ports (see sd_ixp.topology). Frames
+from a trunk were filtered by the switch they entered the fabric through, so a
+trunk port passes every source and VLAN in use. Members connected to other
+switches get forwarding entries like the local ones, whose port is the next
+hop towards the member's switch:
+
+    FILTER_TABLE    (in_port) of every trunk port -> VLAN
+    VLAN_TABLE      (in_port, VLAN) of every trunk port and VLAN in use ->
+                    metadata:VLAN, FORWARD
+    FORWARD_TABLE   (metadata:VLAN, eth_dst) of every remote member MAC ->
+                    metadata:next hop port, EGRESS
+    EGRESS_TABLE    (metadata:port) of every trunk port -> output:port
+
+Broadcasts, multicasts and unknown unicast are replicated by the switch with
+a flood group (an OpenFlow ALL group) per VLAN, holding the member ports of the
+VLAN and the trunk ports of the spanning tree of the fabric, so they reach
+every member once without going through the controller. Only ARP and Neighbor
+Discovery go to the controller, which answers them on behalf of the members
+(see sd_ixp.neighbor); the ones that come through a trunk were already seen at
+the switch they entered the fabric through, and are flooded:
+
+    FORWARD_TABLE   (metadata:VLAN, from a trunk) -> group:VLAN flood group
+                    ARP, NS and NA -> controller
+                    (metadata:VLAN) -> group:VLAN flood group
+
+MACs learned on ports without a registered member skip the stages they do not
+need: their filter entry classifies the VLAN itself, and their forwarding entry
+outputs the frame.
+
+With traffic accounting, frames leaving through a member or trunk port continue
+to a last table that only counts them:
+
+    ACCOUNT_TABLE   (eth_src, eth_dst) of every local member MAC and every
+                    member MAC -> (counted)
+
+The entries are installed on the switch the source member is connected to, so
+each frame is counted once, by the switch it entered the fabric through. Its
+counters make the AS-to-AS traffic matrix (see sd_ixp.matrix), at the cost of
+O(local MACs x N) entries.
+
+VLANs provisioned between members (see sd_ixp.vlan) only add VLAN and
+forwarding entries for the member ports and MACs of the VLAN, so the other
+members never see its traffic.
+
+Every entry carries a cookie naming its feature and, for the entries of a
+member, the member and its registry generation (see sd_ixp.cookie), so all the
+entries of a member are deleted from a switch with a single flow mod.
+
+The table ids of the stages can be changed (see Pipeline), e.g. to the tables
+a hardware switch dedicates to each kind of match.
+"""
+
+from ryu.lib.packet import ether_types
+from ryu.lib.packet import icmpv6
+from ryu.lib.packet import in_proto
+from ryu.ofproto import ofproto_v1_3
+
+from sd_ixp import cookie as cookies
+from sd_ixp.flow import Flow, drop, goto, group, output, write_metadata
+
+FILTER_TABLE = 0
+VLAN_TABLE = 1
+FORWARD_TABLE = 2
+EGRESS_TABLE = 3
+ACCOUNT_TABLE = 4
+
+# LLDP frames (see sd_ixp.topology) go to the controller from any port
+LLDP_PRIORITY = 200
+
+FILTER_PRIORITY = 100
+VLAN_PRIORITY = 100
+FORWARD_PRIORITY = 100
+EGRESS_PRIORITY = 100
+ACCOUNT_PRIORITY = 100
+
+# MACs learned on ports without a registered member
+LEARNED_PRIORITY = 50
+
+# Flooding of frames without a forwarding entry, and the ARP/ND frames sent to
+# the controller instead
+FLOOD_PRIORITY = 2
+NEIGHBOR_PRIORITY = 3
+TRUNK_FLOOD_PRIORITY = 4
+
+# Storm guards of ports over their PacketIn budget: just above the table-miss,
+# flood and ARP/ND entries, so they only catch the traffic that would go to the
+# controller or be flooded
+GUARD_PRIORITY = 5
+
+# Source MACs a member port does not accept (see sd_ixp.allowlist): over the
+# storm guards, under the member MACs and the learned ones they never overlap
+BLOCKED_PRIORITY = 10
+
+# Metadata fields: the VLAN classification writes the VLAN (as the vlan_vid
+# OXM value, so untagged frames have a VLAN of their own) to bits 32-44 and
+# whether the frame came through a trunk to bit 45, and the forwarding stage
+# the output port to bits 0-31
+METADATA_VLAN_SHIFT = 32
+METADATA_VLAN_MASK = 0x1fff << METADATA_VLAN_SHIFT
+METADATA_TRUNK = 1 << 45
+METADATA_PORT_MASK = 0xffffffff
+
+# Flood groups are numbered FLOOD_GROUP + the vlan_vid match value of their
+# VLAN
+FLOOD_GROUP = 0x10000
+
+# ARP, Neighbor Solicitation and Neighbor Advertisement
+_NEIGHBOR_MATCHES = (
+    {'eth_type': ether_types.ETH_TYPE_ARP},
+    {'eth_type': ether_types.ETH_TYPE_IPV6, 'ip_proto': in_proto.IPPROTO_ICMPV6,
+     'icmpv6_type': icmpv6.ND_NEIGHBOR_SOLICIT},
+    {'eth_type': ether_types.ETH_TYPE_IPV6, 'ip_proto': in_proto.IPPROTO_ICMPV6,
+     'icmpv6_type': icmpv6.ND_NEIGHBOR_ADVERT},
+)
+
+
+class Pipeline:
+    """Table ids of the pipeline stages
+
+    The filter stage is table 0, where the switch starts processing frames.
+    The other stages can be placed at any table, in order: goto table
+    instructions can only go forward.
+
+    Attributes:
+        filter (int): source MAC filter table
+        vlan (int): VLAN classification table
+        forward (int): L2 forwarding table
+        egress (int): output port table
+        account (int): traffic accounting table
+    """
+
+    STAGES = ('filter', 'vlan', 'forward', 'egress', 'account')
+
+    def __init__(self, vlan=VLAN_TABLE, forward=FORWARD_TABLE,
+                 egress=EGRESS_TABLE, account=ACCOUNT_TABLE):
+        self.filter = FILTER_TABLE
+        self.vlan = vlan
+        self.forward = forward
+        self.egress = egress
+        self.account = account
+
+        tables = [getattr(self, stage) for stage in self.STAGES]
+        if (any(a >= b for a, b in zip(tables, tables[1:])) or
+                tables[-1] >= ofproto_v1_3.OFPTT_MAX):
+            raise ValueError('pipeline tables must increase along the '
+                             'pipeline: %s' % self)
+
+    @classmethod
+    def parse(cls, spec):
+        """Build a pipeline from "stage=table" strings
+
+        Stages not given keep their default table.
+
+        Raises:
+            ValueError: unknown stage, or tables out of order
+        """
+
+        tables = {}
+        for entry in spec:
+            stage, _, table = entry.partition('=')
+            stage = stage.strip()
+            if stage not in cls.STAGES[1:]:
+                raise ValueError('unknown pipeline stage: %s' % stage)
+            tables[stage] = int(table)
+
+        return cls(**tables)
+
+    def __repr__(self):
+        return ', '.join('%s=%d' % (stage, getattr(self, stage))
+                         for stage in self.STAGES)
+
+
+# The default table layout
+PIPELINE = Pipeline()
+
+
+def compile_switch(dpid, members, accounting=False, pipeline=PIPELINE,
+                   vlans=None, trunks=(), paths=None, tree=()):
+    """Compile the flow entries of a switch
+
+    Args:
+        dpid (int): datapath id of the switch
+        members (iterable): Member objects of the IXP
+        accounting (bool): whether to count the traffic between members
+        pipeline (Pipeline): table ids of the stages
+        vlans (dictionary): { ASN, [ VLAN id ] } of the VLANs provisioned
+            between members
+        trunks (iterable): ports linked to other switches of the fabric
+        paths (dictionary): { dpid, next hop port } of the switches this one
+            reaches through its trunks
+        tree (iterable): trunk ports of the spanning tree of the fabric
+
+    Returns:
+        list: Flow objects the switch must have (the flood groups they use are
+            compiled by compile_flood_groups())
+    """
+
+    members = list(members)
+    vlans = vlans or {}
+    paths = paths or {}
+
+    flows = [Flow(pipeline.filter, LLDP_PRIORITY,
+                  {'eth_type': ether_types.ETH_TYPE_LLDP},
+                  [output(ofproto_v1_3.OFPP_CONTROLLER)])]
+
+    for member in members:
+        member_vlans = vlans.get(member.asn, ())
+
+        ports = member.ports_on(dpid)
+        for port in ports:
+            flows.extend(compile_member_port(member, port, accounting,
+                                             pipeline, member_vlans))
+
+        # Members of other switches are reached through the trunk towards the
+        # nearest of their switches
+        if not ports:
+            hops = [paths[port_dpid] for port_dpid, _ in member.ports
+                    if port_dpid in paths]
+            if hops:
+                flows.extend(_forward_entries(member, hops[0], pipeline,
+                                              member_vlans))
+
+    if trunks:
+        vlans_in_use = set()
+        for member in members:
+            vlans_in_use.update(
+                match['vlan_vid'] for match in
+                _vlan_matches(member, vlans.get(member.asn, ())))
+
+        for port in sorted(trunks):
+            flows.extend(compile_trunk(port, vlans_in_use, accounting,
+                                       pipeline))
+
+    groups = compile_flood_groups(dpid, members, vlans, tree)
+    if groups:
+        for match in _NEIGHBOR_MATCHES:
+            flows.append(Flow(pipeline.forward, NEIGHBOR_PRIORITY, match,
+                              [output(ofproto_v1_3.OFPP_CONTROLLER)]))
+
+    flood = cookies.make(cookies.FLOOD)
+    for group_id in sorted(groups):
+        vlan = _vlan_metadata(group_id - FLOOD_GROUP)
+
+        flows.append(Flow(pipeline.forward, FLOOD_PRIORITY,
+                          {'metadata': vlan}, [group(group_id)],
+                          cookie=flood))
+        if trunks:
+            flows.append(Flow(
+                pipeline.forward, TRUNK_FLOOD_PRIORITY,
+                {'metadata': (vlan[0] | METADATA_TRUNK,
+                              vlan[1] | METADATA_TRUNK)},
+                [group(group_id)], cookie=flood))
+
+    # Member MACs on VLANs the member does not use are dropped
+    flows.append(Flow(pipeline.vlan, 0, {}, [drop()]))
+
+    # Table-miss of the forwarding table: unknown destinations (broadcasts and
+    # multicasts included) are sent to the controller
+    flows.append(Flow(pipeline.forward, 0, {},
+                      [output(ofproto_v1_3.OFPP_CONTROLLER)]))
+
+    flows.append(Flow(pipeline.egress, 0, {}, [drop()]))
+
+    if accounting:
+        flows.extend(compile_accounting(dpid, members, pipeline))
+
+    return flows
+
+
+def compile_flood_groups(dpid, members, vlans=None, tree=()):
+    """Compile the flood groups of a switch
+
+    Each VLAN used by a member of the switch (or by any member, when the
+    switch has spanning tree ports) gets a group replicating frames to its
+    member ports and to the tree ports. The switch does not send a frame back
+    through the port it came in.
+
+    Args:
+        dpid (int): datapath id of the switch
+        members (iterable): Member objects of the IXP
+        vlans (dictionary): { ASN, [ VLAN id ] } of the VLANs provisioned
+            between members
+        tree (iterable): trunk ports of the spanning tree of the fabric
+
+    Returns:
+        dictionary: { group id, tuple of ports }
+    """
+
+    vlans = vlans or {}
+    tree = sorted(tree)
+
+    ports = {}
+    for member in members:
+        member_ports = member.ports_on(dpid)
+        if not member_ports and not tree:
+            continue
+
+        for match in _vlan_matches(member, vlans.get(member.asn, ())):
+            ports.setdefault(match['vlan_vid'], set()).update(member_ports)
+
+    return {flood_group_id(vlan_vid): tuple(sorted(vlan_ports)) + tuple(tree)
+            for vlan_vid, vlan_ports in ports.items()}
+
+
+def flood_group_id(vlan_vid):
+    """Group id of the flood group of a VLAN (vlan_vid match value)"""
+    return FLOOD_GROUP + vlan_vid
+
+
+def compile_member_port(member, port, accounting=False, pipeline=PIPELINE,
+                        vlans=()):
+    """Compile the filter, VLAN, forwarding and egress entries of a member port
+
+    Args:
+        member (Member): the member connected to the port
+        port (int): the port number
+        accounting (bool): whether forwarded frames go on to the accounting
+            table
+        pipeline (Pipeline): table ids of the stages
+        vlans (iterable): VLAN ids provisioned for the member, tagged on the
+            port besides its own VLANs
+
+    Returns:
+        list: Flow objects
+    """
+
+    cookie = member_cookie(member)
+
+    flows = []
+    for mac in member.macs:
+        flows.append(Flow(
+            pipeline.filter, FILTER_PRIORITY,
+            {'in_port': port, 'eth_src': mac},
+            [goto(pipeline.vlan)], cookie=cookie))
+
+    for vlan_match in _vlan_matches(member, vlans):
+        flows.append(_vlan_entry(port, vlan_match['vlan_vid'], pipeline,
+                                 cookie))
+
+    flows.extend(_forward_entries(member, port, pipeline, vlans))
+    flows.append(_egress_entry(port, accounting, pipeline, cookie))
+
+    return flows
+
+
+def member_cookie(member, feature=cookies.MEMBER):
+    """Cookie of the entries of a member (see sd_ixp.cookie)"""
+    return cookies.make(feature, member.asn, member.generation)
+
+
+def compile_trunk(port, vlan_vids, accounting=False, pipeline=PIPELINE):
+    """Compile the filter, VLAN and egress entries of a trunk port
+
+    Args:
+        port (int): the port number
+        vlan_vids (iterable): vlan_vid match values of the VLANs in use
+        accounting (bool): whether frames leaving through the trunk go on to
+            the accounting table
+        pipeline (Pipeline): table ids of the stages
+
+    Returns:
+        list: Flow objects
+    """
+
+    cookie = cookies.make(cookies.TRUNK)
+
+    flows = [Flow(pipeline.filter, FILTER_PRIORITY, {'in_port': port},
+                  [goto(pipeline.vlan)], cookie=cookie)]
+
+    for vlan_vid in sorted(vlan_vids):
+        flows.append(_vlan_entry(port, vlan_vid, pipeline, cookie,
+                                 trunk=True))
+
+    flows.append(_egress_entry(port, accounting, pipeline, cookie))
+
+    return flows
+
+
+def _vlan_entry(port, vlan_vid, pipeline, cookie, trunk=False):
+    """VLAN classification entry of a port and VLAN"""
+
+    value, mask = _vlan_metadata(vlan_vid)
+    if trunk:
+        value, mask = value | METADATA_TRUNK, mask | METADATA_TRUNK
+
+    return Flow(pipeline.vlan, VLAN_PRIORITY,
+                {'in_port': port, 'vlan_vid': vlan_vid},
+                [write_metadata(value, mask), goto(pipeline.forward)],
+                cookie=cookie)
+
+
+def _forward_entries(member, port, pipeline, vlans=()):
+    """Forwarding entries of the MACs of a member reached through a port"""
+
+    cookie = member_cookie(member)
+
+    flows = []
+    for vlan_match in _vlan_matches(member, vlans):
+        vlan = _vlan_metadata(vlan_match['vlan_vid'])
+
+        for mac in member.macs:
+            flows.append(Flow(
+                pipeline.forward, FORWARD_PRIORITY,
+                {'metadata': vlan, 'eth_dst': mac},
+                [write_metadata(port, METADATA_PORT_MASK),
+                 goto(pipeline.egress)], cookie=cookie))
+
+    return flows
+
+
+def _egress_entry(port, accounting, pipeline, cookie):
+    """Egress entry of a port"""
+
+    egress = [output(port)]
+    if accounting:
+        egress.append(goto(pipeline.account))
+
+    return Flow(pipeline.egress, EGRESS_PRIORITY,
+                {'metadata': (port, METADATA_PORT_MASK)}, egress,
+                cookie=cookie)
+
+
+def compile_accounting(dpid, members, pipeline=PIPELINE):
+    """Compile the counting entries of the members connected to a switch
+
+    Args:
+        dpid (int): datapath id of the switch
+        members (list): Member objects of the IXP
+        pipeline (Pipeline): table ids of the stages
+
+    Returns:
+        list: Flow objects
+    """
+
+    flows = []
+    for member in members:
+        if not member.ports_on(dpid):
+            continue
+
+        cookie = member_cookie(member, cookies.ACCOUNT)
+        for peer in members:
+            if peer is member:
+                continue
+
+            for src in member.macs:
+                for dst in peer.macs:
+                    # No instructions: the frame was already forwarded
+                    flows.append(Flow(pipeline.account, ACCOUNT_PRIORITY,
+                                      {'eth_src': src, 'eth_dst': dst}, [],
+                                      cookie=cookie))
+
+    # Frames between MACs without a counting entry end here as well (some
+    # switches send table misses to the controller)
+    flows.append(Flow(pipeline.account, 0, {}, []))
+
+    return flows
+
+
+def compile_learned(mac, port, vlan_id=None, idle_timeout=0,
+                    pipeline=PIPELINE):
+    """Compile the filter and forwarding entries of a learned MAC
+
+    The filter entry carries the idle timeout: when the MAC stops sending, the
+    switch removes it and notifies the controller, which then removes the
+    forwarding entry as well.
+
+    Args:
+        mac (str): the learned MAC address
+        port (int): port the MAC was learned on
+        vlan_id (int): VLAN id the MAC was learned on (None if untagged)
+        idle_timeout (int): idle timeout of the filter entry
+        pipeline (Pipeline): table ids of the stages
+
+    Returns:
+        list: the filter and the forwarding Flow
+    """
+
+    vlan_match = _vlan_match(vlan_id)
+    vlan = _vlan_metadata(vlan_match['vlan_vid'])
+    cookie = cookies.make(cookies.LEARNED)
+
+    return [
+        Flow(pipeline.filter, LEARNED_PRIORITY,
+             dict(vlan_match, in_port=port, eth_src=mac),
+             [write_metadata(vlan[0], vlan[1]), goto(pipeline.forward)],
+             idle_timeout, cookie=cookie),
+        Flow(pipeline.forward, LEARNED_PRIORITY,
+             {'metadata': vlan, 'eth_dst': mac},
+             [output(port)], cookie=cookie),
+    ]
+
+
+def compile_blocked(port, mac, hard_timeout, pipeline=PIPELINE):
+    """Compile the entry dropping the frames of a source MAC on a port
+
+    Args:
+        port (int): the member port
+        mac (str): the source MAC the port does not accept
+        hard_timeout (int): seconds the source stays blocked
+        pipeline (Pipeline): table ids of the stages
+
+    Returns:
+        Flow: the drop entry, in the filter table
+    """
+
+    return Flow(pipeline.filter, BLOCKED_PRIORITY,
+                {'in_port': port, 'eth_src': mac}, [drop()],
+                hard_timeout=hard_timeout,
+                cookie=cookies.make(cookies.BLOCKED))
+
+
+def vlan_vid_of(vlan_id):
+    """vlan_vid match value of a VLAN id (None for untagged frames)"""
+
+    if vlan_id is None:
+        return ofproto_v1_3.OFPVID_NONE
+
+    return vlan_id | ofproto_v1_3.OFPVID_PRESENT
+
+
+def _vlan_match(vlan_id):
+    """VLAN match field of a VLAN id (None matches untagged frames)"""
+    return {'vlan_vid': vlan_vid_of(vlan_id)}
+
+
+def _vlan_metadata(vlan_vid):
+    """(value, mask) of the VLAN metadata field of a vlan_vid match value"""
+    return vlan_vid << METADATA_VLAN_SHIFT, METADATA_VLAN_MASK
+
+
+def _vlan_matches(member, vlans=()):
+    """VLAN match fields for the VLANs a member uses"""
+
+    # Untagged ports match frames without a VLAN tag, and the tagged frames
+    # of the provisioned VLANs only. A VLAN both of the member and
+    # provisioned is matched once: the same match twice would make two
+    # entries with the same key, one replacing the other.
+    vids = list(dict.fromkeys(member.vlans or [None]))
+    vids.extend(vid for vid in sorted(set(vlans)) if vid not in vids)
+
+    return [_vlan_match(vid) for vid in vids]
@@ -0,0 +1,141 @@
+# Copyright (C) 2018 [SD]RSiX Project
+#
+# Licensed under the Apache License, Version 2.0 (the “License”);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an “AS IS” BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Flow entry cookies
+
+Every entry the controller installs carries a cookie telling who it belongs
+to:
+
+     63      56 55      48 47                      16 15          0
+    +----------+----------+--------------------------+-------------+
+    |  owner   | feature  |          member          | generation  |
+    +----------+----------+--------------------------+-------------+
+
+- owner: OWNER for every entry of the controller, so the entries left on a
+  switch by anything else can be told apart (and deleted with a flow mod per
+  bit of the owner, see foreign())
+- feature: what the entry is for (BASE, MEMBER, TRUNK, FLOOD, LEARNED, GUARD,
+  ACCOUNT or BLOCKED)
+- member: AS number of the member the entry belongs to (0 for the entries of
+  no member)
+- generation: registry generation of the member (see IXP.add_member()), so the
+  entries of a previous registration of a member are told apart from the
+  current ones
+
+OpenFlow deletes (and reports) the entries whose cookie matches a value under
+a mask, so a single flow mod removes every entry of a member, of a feature or
+of a generation from all the tables of a switch (see match()).
+"""
+
+# Owner of the entries of the controller
+OWNER = 0x5d << 56
+OWNER_MASK = 0xff << 56
+
+# Features
+BASE = 0
+MEMBER = 1
+TRUNK = 2
+FLOOD = 3
+LEARNED = 4
+GUARD = 5
+ACCOUNT = 6
+BLOCKED = 7
+
+_FEATURE_SHIFT = 48
+_MEMBER_SHIFT = 16
+
+FEATURE_MASK = 0xff << _FEATURE_SHIFT
+MEMBER_MASK = 0xffffffff << _MEMBER_SHIFT
+GENERATION_MASK = 0xffff
+
+# Every bit: matches a single cookie
+FULL_MASK = 0xffffffffffffffff
+
+
+def make(feature=BASE, member=0, generation=0):
+    """Cookie of an entry of the controller
+
+    Args:
+        feature (int): what the entry is for
+        member (int): AS number of the member it belongs to
+        generation (int): registry generation of the member (wraps at 16 bits)
+
+    Returns:
+        int: the cookie
+    """
+
+    return (OWNER | feature << _FEATURE_SHIFT | member << _MEMBER_SHIFT |
+            generation & GENERATION_MASK)
+
+
+def parse(cookie):
+    """Feature, member and generation of a cookie
+
+    Returns:
+        tuple: (feature, member, generation), or None if the entry is not of
+            the controller
+    """
+
+    if cookie & OWNER_MASK != OWNER:
+        return None
+
+    return ((cookie & FEATURE_MASK) >> _FEATURE_SHIFT,
+            (cookie & MEMBER_MASK) >> _MEMBER_SHIFT,
+            cookie & GENERATION_MASK)
+
+
+def match(feature=None, member=None, generation=None):
+    """Cookie and mask of the entries of the controller with the given fields
+
+    The fields left to None match any value, e.g. match(member=65001) matches
+    every entry of AS65001 and match(MEMBER, 65001, 3) only its member entries
+    of generation 3.
+
+    Returns:
+        tuple: (cookie, cookie_mask)
+    """
+
+    cookie, mask = OWNER, OWNER_MASK
+
+    if feature is not None:
+        cookie |= feature << _FEATURE_SHIFT
+        mask |= FEATURE_MASK
+    if member is not None:
+        cookie |= member << _MEMBER_SHIFT
+        mask |= MEMBER_MASK
+    if generation is not None:
+        cookie |= generation & GENERATION_MASK
+        mask |= GENERATION_MASK
+
+    return cookie, mask
+
+
+def foreign():
+    """Cookies and masks of the entries that are not of the controller
+
+    A flow mod matches the cookies equal to a value under a mask, not those
+    that differ from it, so the owners other than OWNER are covered by one
+    (cookie, mask) pair per bit of the owner byte: the owners that share the
+    bits of OWNER above that bit and differ from it in that bit.
+
+    Returns:
+        list: (cookie, cookie_mask) tuples
+    """
+
+    pairs = []
+    for bit in range(63, 55, -1):
+        mask = OWNER_MASK & ~((1 << bit) - 1)
+        pairs.append(((OWNER ^ 1 << bit) & mask, mask))
+
+    return pairs
@@ -0,0 +1,253 @@
+# Copyright (C) 2018 [SD]RSiX Project
+#
+# Licensed under the Apache License, Version 2.0 (the “License”);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an “AS IS” BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""OpenFlow version independent flow entries
+
+The controller computes the rules each switch must have as Flow objects. A
+Flow only holds plain Python values (tuples, ints and strings), so flows can be
+compared, hashed and stored without a datapath; the Switch renders them into
+OFPFlowMod messages of the OpenFlow version it speaks.
+
+Instructions are tuples whose first element names the instruction:
+    ('apply', actions)          apply the action list right away
+    ('goto', table_id)          continue processing at another table
+    ('meter', meter_id)         apply a meter (rate limit) to the packet
+    ('metadata', value, mask)   write the bits of mask of the metadata, which
+                                the entries of the next tables can match
+
+Actions are tuples as well:
+    ('output', port)            send the packet through a port
+    ('group', group_id)         process the packet with a group (e.g. copy it
+                                to the ports of a flood group)
+
+The cookie of a Flow tells what it belongs to (see sd_ixp.cookie).
+"""
+
+from sd_ixp import cookie as cookies
+
+# Instruction names
+APPLY = 'apply'
+GOTO = 'goto'
+METER = 'meter'
+METADATA = 'metadata'
+
+# Action names
+OUTPUT = 'output'
+GROUP = 'group'
+
+
+class Flow:
+    """A flow entry the controller wants installed on a switch
+
+    Attributes:
+        table_id (int): table the entry belongs to
+        priority (int): priority of the entry
+        match (tuple): sorted (OXM field name, value) pairs
+        instructions (tuple): instruction tuples (see the module docstring)
+        idle_timeout (int): seconds without traffic after which the switch
+            removes the entry and notifies the controller (0 disables it)
+        hard_timeout (int): seconds after which the switch removes the entry
+            and notifies the controller (0 disables it)
+        cookie (int): owner, feature, member and generation of the entry (see
+            sd_ixp.cookie)
+    """
+
+    __slots__ = ('table_id', 'priority', 'match', 'instructions',
+                 'idle_timeout', 'hard_timeout', 'cookie')
+
+    def __init__(self, table_id, priority, match, instructions,
+                 idle_timeout=0, hard_timeout=0, cookie=cookies.OWNER):
+        self.table_id = table_id
+        self.priority = priority
+        self.match = tuple(sorted(match.items()))
+        self.instructions = tuple(instructions)
+        self.idle_timeout = idle_timeout
+        self.hard_timeout = hard_timeout
+        self.cookie = cookie
+
+    @property
+    def key(self):
+        """(table_id, priority, match): identifies the entry on the switch"""
+        return self.table_id, self.priority, self.match
+
+    def __eq__(self, other):
+        return (isinstance(other, Flow) and self.key == other.key and
+                self.instructions == other.instructions and
+                self.idle_timeout == other.idle_timeout and
+                self.hard_timeout == other.hard_timeout and
+                self.cookie == other.cookie)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.key, self.instructions, self.idle_timeout,
+                     self.hard_timeout, self.cookie))
+
+    def __repr__(self):
+        return 'Flow(table_id=%d, priority=%d, match=%r, instructions=%r)' % (
+            self.table_id, self.priority, dict(self.match), self.instructions)
+
+
+def output(port):
+    """('apply', [output:port]) instruction"""
+    return APPLY, ((OUTPUT, port),)
+
+
+def goto(table_id):
+    """('goto', table_id) instruction"""
+    return GOTO, table_id
+
+
+def group(group_id):
+    """('apply', [group:group_id]) instruction"""
+    return APPLY, ((GROUP, group_id),)
+
+
+def write_metadata(value, mask):
+    """('metadata', value, mask) instruction"""
+    return METADATA, value, mask
+
+
+def drop():
+    """('apply', []) instruction: an empty action list drops the packet"""
+    return APPLY, ()
+
+
+def meter(meter_id):
+    """('meter', meter_id) instruction"""
+    return METER, meter_id
+
+
+def render_match(datapath, flow):
+    """Build the OFPMatch of a flow"""
+    return datapath.ofproto_parser.OFPMatch(**dict(flow.match))
+
+
+def render_instructions(datapath, flow):
+    """Build the OFPInstruction list of a flow"""
+
+    ofproto = datapath.ofproto
+    parser = datapath.ofproto_parser
+
+    # OpenFlow 1.5 replaced the meter instruction with an action, which must
+    # go first in the (single) apply actions instruction
+    meter_action = not hasattr(parser, 'OFPInstructionMeter')
+    meter_actions = []
+    for instruction in flow.instructions:
+        if meter_action and instruction[0] == METER:
+            meter_actions.append(parser.OFPActionMeter(instruction[1]))
+
+    instructions = []
+    for instruction in flow.instructions:
+        name = instruction[0]
+
+        if name == APPLY:
+            actions = meter_actions + [_render_action(parser, action)
+                                       for action in instruction[1]]
+            meter_actions = []
+            instructions.append(parser.OFPInstructionActions(
+                ofproto.OFPIT_APPLY_ACTIONS, actions))
+
+        elif name == GOTO:
+            instructions.append(parser.OFPInstructionGotoTable(instruction[1]))
+
+        elif name == METADATA:
+            instructions.append(parser.OFPInstructionWriteMetadata(
+                instruction[1], instruction[2]))
+
+        elif name == METER:
+            if not meter_action:
+                instructions.append(
+                    parser.OFPInstructionMeter(instruction[1]))
+
+        else:
+            raise ValueError('unknown instruction: %r' % (instruction, ))
+
+    # Meter actions of a flow without actions of its own
+    if meter_actions:
+        instructions.append(parser.OFPInstructionActions(
+            ofproto.OFPIT_APPLY_ACTIONS, meter_actions))
+
+    return instructions
+
+
+def render_actions(datapath, actions):
+    """Build the OFPAction list of action tuples"""
+
+    parser = datapath.ofproto_parser
+    return [_render_action(parser, action) for action in actions]
+
+
+def parse_instructions(ofproto, instructions):
+    """Convert OFPInstruction objects (e.g. from a flow stats reply) back to
+    instruction tuples
+
+    Instructions and actions this module does not know are kept as
+    ('unknown', repr) tuples, so they never compare equal to a Flow the
+    controller builds.
+    """
+
+    parsed = []
+    for instruction in instructions:
+        if (instruction.type == ofproto.OFPIT_APPLY_ACTIONS and
+                hasattr(instruction, 'actions')):
+            parsed.append((APPLY, tuple(
+                _parse_action(ofproto, action)
+                for action in instruction.actions)))
+
+        elif instruction.type == ofproto.OFPIT_GOTO_TABLE:
+            parsed.append((GOTO, instruction.table_id))
+
+        elif instruction.type == ofproto.OFPIT_WRITE_METADATA:
+            parsed.append((METADATA, instruction.metadata,
+                           instruction.metadata_mask))
+
+        elif instruction.type == getattr(ofproto, 'OFPIT_METER', None):
+            parsed.append((METER, instruction.meter_id))
+
+        else:
+            parsed.append(('unknown', repr(instruction)))
+
+    return tuple(parsed)
+
+
+def from_stats(ofproto, stats):
+    """Build a Flow from an entry of a flow stats (or flow desc) reply"""
+
+    return Flow(stats.table_id, stats.priority, dict(stats.match.items()),
+                parse_instructions(ofproto, stats.instructions),
+                stats.idle_timeout, stats.hard_timeout, stats.cookie)
+
+
+def _parse_action(ofproto, action):
+    if action.type == ofproto.OFPAT_OUTPUT:
+        return OUTPUT, action.port
+
+    if action.type == ofproto.OFPAT_GROUP:
+        return GROUP, action.group_id
+
+    return 'unknown', repr(action)
+
+
+def _render_action(parser, action):
+    name = action[0]
+
+    if name == OUTPUT:
+        return parser.OFPActionOutput(action[1])
+
+    if name == GROUP:
+        return parser.OFPActionGroup(action[1])
+
+    raise ValueError('unknown action: %r' % (action, ))
@@ -0,0 +1,363 @@
+# Copyright (C) 2018 [SD]RSiX Project
+#
+# Licensed under the Apache License, Version 2.0 (the “License”);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an “AS IS” BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Batched FlowMod pipeline
+
+Provisioning a member or replaying the state of a switch that reconnects
+generates thousands of FlowMods. Instead of writing each of them to the switch
+as soon as it is built, the FlowQueue of a switch collects them in batches that
+are flushed when they reach a maximum size or age. Every batch is followed by
+a single OFPBarrierRequest; the barrier reply tells the controller the switch
+has applied the whole batch.
+
+On OpenFlow 1.4 and later the batch is sent as an atomic bundle, so the switch
+applies all of its messages or none of them.
+
+A batch that reaches its maximum size is sent with a Completion of its own,
+and the messages put after it get the Completion of the next batch. Callers
+that put more messages than a batch holds gather() the Completions they got,
+so that the errors of every batch reach them.
+"""
+
+from ryu.lib import hub
+from ryu.ofproto import ofproto_v1_4
+
+# Default maximum number of messages in a batch
+DEFAULT_MAX_BATCH = 256
+
+# Default time (in seconds) a message waits in the queue before the batch is
+# flushed
+DEFAULT_MAX_DELAY = 0.01
+
+
+class Completion:
+    """Completion of messages sent to a switch (a future)
+
+    A Completion resolves when the barrier that follows the messages is
+    replied. OpenFlow errors the switch sends for any of the messages are
+    collected, so after resolving the Completion tells whether all the messages
+    were applied. A Completion whose switch disconnects before replying is
+    cancelled.
+    """
+
+    def __init__(self):
+        self._event = hub.Event()
+        self._errors = []
+        self._callbacks = []
+        self._cancelled = False
+
+    def done(self):
+        """Whether the switch has replied the barrier"""
+        return self._event.is_set()
+
+    @property
+    def ok(self):
+        """Whether the switch has applied all messages without errors"""
+        return self.done() and not self._errors and not self._cancelled
+
+    @property
+    def cancelled(self):
+        """Whether the switch disconnected before replying the barrier"""
+        return self._cancelled
+
+    @property
+    def errors(self):
+        """OFPErrorMsg messages the switch replied to the messages"""
+        return self._errors
+
+    def wait(self, timeout=None):
+        """Wait until the Completion resolves
+
+        Args:
+            timeout (float): maximum time to wait in seconds (None waits
+                forever)
+
+        Returns:
+            bool: True if it resolved, False if the timeout expired
+        """
+        return self._event.wait(timeout)
+
+    def add_done_callback(self, callback):
+        """Call callback(completion) when the Completion resolves"""
+
+        if self.done():
+            callback(self)
+        else:
+            self._callbacks.append(callback)
+
+    def follow(self, completion):
+        """Resolve as another Completion does, with its errors (cancelled if
+        it is)"""
+
+        def resolved(other):
+            self._errors.extend(other.errors)
+            if other.cancelled:
+                self._cancelled = True
+            self._resolve()
+
+        completion.add_done_callback(resolved)
+
+    def _add_error(self, msg):
+        self._errors.append(msg)
+
+    def _cancel(self):
+        self._cancelled = True
+        self._resolve()
+
+    def _resolve(self):
+        self._event.set()
+
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+
+def gather(completions):
+    """Completion of several Completions
+
+    Resolves when all of them have resolved, with the errors of all of them;
+    it is cancelled if any of them is.
+
+    Args:
+        completions (iterable): Completions (repeated ones count once)
+
+    Returns:
+        Completion: the Completion gathering them
+    """
+
+    completions = list(dict.fromkeys(completions))
+    if len(completions) == 1:
+        return completions[0]
+
+    gathered = Completion()
+    pending = [len(completions)]
+
+    def resolved(completion):
+        gathered._errors.extend(completion.errors)
+        if completion.cancelled:
+            gathered._cancelled = True
+
+        pending[0] -= 1
+        if not pending[0]:
+            gathered._resolve()
+
+    if not completions:
+        gathered._resolve()
+
+    for completion in completions:
+        completion.add_done_callback(resolved)
+
+    return gathered
+
+
+class FlowQueue:
+    """Outbound queue of FlowMod messages of a switch
+
+    Attributes:
+        _datapath (ev.msg.datapath): connection to the switch
+        _send_msg (callable): sends a message (Datapath.send_msg by default)
+        _max_batch (int): number of messages that triggers a flush
+        _max_delay (float): seconds a batch waits before it is flushed
+        _bundles (bool): whether batches are sent as OpenFlow bundles
+        _batch (list): messages waiting to be sent
+        _completion (Completion): Completion of the current batch
+        _timer: green thread that flushes the current batch when it is too old
+        _barriers (dictionary): Completions waiting for barrier replies
+        _xids (dictionary): Completions of the messages already sent
+    """
+
+    def __init__(self, datapath, max_batch=DEFAULT_MAX_BATCH,
+                 max_delay=DEFAULT_MAX_DELAY, send_msg=None):
+
+        self._datapath = datapath
+        self._send_msg = send_msg or datapath.send_msg
+        self._max_batch = max_batch
+        self._max_delay = max_delay
+
+        # Bundles were introduced in OpenFlow 1.4
+        self._bundles = (
+            datapath.ofproto.OFP_VERSION >= ofproto_v1_4.OFP_VERSION)
+        self._bundle_id = 0
+
+        self._batch = []
+        self._completion = None
+        self._timer = None
+
+        # Structure: { barrier xid, (Completion, [ xid of the batch ]) }
+        self._barriers = {}
+
+        # Structure: { xid, Completion }
+        self._xids = {}
+
+    def __len__(self):
+        return len(self._batch)
+
+    def pending(self):
+        """Number of batches sent whose barrier has not been replied"""
+        return len(self._barriers)
+
+    def put(self, msg):
+        """Queue a message to be sent in the current batch
+
+        Args:
+            msg: OpenFlow message (usually an OFPFlowMod)
+
+        Returns:
+            Completion: resolves when the switch has applied the batch
+        """
+
+        if not self._batch:
+            self._completion = Completion()
+            self._timer = hub.spawn_after(self._max_delay, self._timeout)
+
+        self._batch.append(msg)
+        completion = self._completion
+
+        if len(self._batch) >= self._max_batch:
+            self.flush()
+
+        return completion
+
+    def flush(self):
+        """Send the current batch followed by a barrier
+
+        With an empty batch only the barrier is sent, so the Completion
+        resolves when every message sent before has been applied.
+
+        Returns:
+            Completion: resolves when the switch replies the barrier
+        """
+
+        if self._timer is not None:
+            hub.kill(self._timer)
+            self._timer = None
+
+        batch, self._batch = self._batch, []
+        completion, self._completion = self._completion, None
+        if completion is None:
+            completion = Completion()
+
+        if self._bundles and batch:
+            xids = self._send_bundle(batch)
+        else:
+            xids = [self._send(msg) for msg in batch]
+
+        for xid in xids:
+            self._xids[xid] = completion
+
+        barrier = self._datapath.ofproto_parser.OFPBarrierRequest(
+            self._datapath)
+        self._barriers[self._send(barrier)] = (completion, xids)
+
+        return completion
+
+    def barrier_reply(self, msg):
+        """Resolve the Completion a barrier reply belongs to
+
+        Args:
+            msg (OFPBarrierReply): the barrier reply
+
+        Returns:
+            bool: whether the reply belongs to this queue
+        """
+
+        entry = self._barriers.pop(msg.xid, None)
+        if entry is None:
+            return False
+
+        completion, xids = entry
+        for xid in xids:
+            self._xids.pop(xid, None)
+        completion._resolve()
+
+        return True
+
+    def error(self, msg):
+        """Record an OpenFlow error in the Completion of the failed message
+
+        Args:
+            msg (OFPErrorMsg): the error message
+
+        Returns:
+            bool: whether the error refers to a message of this queue
+        """
+
+        completion = self._xids.get(msg.xid)
+        if completion is None:
+            return False
+
+        completion._add_error(msg)
+
+        return True
+
+    def close(self):
+        """Discard the queued messages and cancel the pending Completions
+
+        Called when the switch disconnects: the barriers will never be
+        replied.
+        """
+
+        if self._timer is not None:
+            hub.kill(self._timer)
+            self._timer = None
+
+        self._batch = []
+        pending = [entry[0] for entry in self._barriers.values()]
+        if self._completion is not None:
+            pending.append(self._completion)
+
+        self._completion = None
+        self._barriers.clear()
+        self._xids.clear()
+
+        for completion in pending:
+            if not completion.done():
+                completion._cancel()
+
+    def _timeout(self):
+        # Called by the timer thread: it must not kill itself in flush()
+        self._timer = None
+        if self._batch:
+            self.flush()
+
+    def _send(self, msg):
+        """Send a message and return its xid"""
+
+        self._datapath.set_xid(msg)
+        self._send_msg(msg)
+
+        return msg.xid
+
+    def _send_bundle(self, batch):
+        """Send a batch as an atomic bundle and return the xids it used"""
+
+        ofproto = self._datapath.ofproto
+        parser = self._datapath.ofproto_parser
+
+        self._bundle_id = (self._bundle_id + 1) & 0xffffffff
+        flags = ofproto.OFPBF_ATOMIC | ofproto.OFPBF_ORDERED
+
+        xids = [self._send(parser.OFPBundleCtrlMsg(
+            self._datapath, self._bundle_id, ofproto.OFPBCT_OPEN_REQUEST,
+            flags, []))]
+
+        for msg in batch:
+            xids.append(self._send(parser.OFPBundleAddMsg(
+                self._datapath, self._bundle_id, flags, msg, [])))
+
+        xids.append(self._send(parser.OFPBundleCtrlMsg(
+            self._datapath, self._bundle_id, ofproto.OFPBCT_COMMIT_REQUEST,
+            flags, [])))
+
+        return xids
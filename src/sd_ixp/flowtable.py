@@ -0,0 +1,125 @@
+# Copyright (C) 2018 [SD]RSiX Project
+#
+# Licensed under the Apache License, Version 2.0 (the “License”);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an “AS IS” BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Controller-side shadow of a switch flow table
+
+The shadow table holds the Flow objects the controller believes are installed
+on a switch, indexed by (table_id, priority, match), which is what identifies
+an entry on the switch. Comparing the desired flows against the shadow yields
+the minimal set of FlowMods that brings the switch to the desired state.
+"""
+
+
+class FlowDiff:
+    """FlowMods needed to turn one set of flows into another
+
+    Attributes:
+        add (list): flows that are not installed, or installed with another
+            cookie or other timeouts (an add replaces the entry, cookie and
+            timeouts included, which a modify keeps)
+        modify (list): installed flows whose instructions changed
+        delete (list): installed flows that are no longer desired
+    """
+
+    __slots__ = ('add', 'modify', 'delete')
+
+    def __init__(self, add=(), modify=(), delete=()):
+        self.add = list(add)
+        self.modify = list(modify)
+        self.delete = list(delete)
+
+    def __len__(self):
+        return len(self.add) + len(self.modify) + len(self.delete)
+
+    def __repr__(self):
+        return 'FlowDiff(add=%d, modify=%d, delete=%d)' % (
+            len(self.add), len(self.modify), len(self.delete))
+
+
+class FlowTable:
+    """Shadow flow table of a switch
+
+    Attributes:
+        _entries (dictionary): installed flows indexed by their key
+    """
+
+    def __init__(self, flows=()):
+
+        # Structure: { (table_id, priority, match), Flow }
+        self._entries = {}
+
+        for flow in flows:
+            self.add(flow)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        return iter(self._entries.values())
+
+    def __contains__(self, flow):
+        return self._entries.get(flow.key) == flow
+
+    def get(self, key):
+        """Return the flow installed with the given key, or None"""
+        return self._entries.get(key)
+
+    def add(self, flow):
+        """Record a flow as installed (replacing one with the same key)"""
+        self._entries[flow.key] = flow
+
+    def remove(self, flow):
+        """Record a flow as removed"""
+        self._entries.pop(flow.key, None)
+
+    def replace(self, flows):
+        """Replace the whole content (e.g. with a flow stats reply)"""
+
+        self._entries = {}
+        for flow in flows:
+            self.add(flow)
+
+    def clear(self):
+        self._entries = {}
+
+    def diff(self, desired):
+        """Compare the desired flows against the installed ones
+
+        Args:
+            desired (iterable): Flow objects the switch must have
+
+        Returns:
+            FlowDiff: flows to add, modify and delete
+        """
+
+        entries = self._entries
+        result = FlowDiff()
+        seen = set()
+
+        for flow in desired:
+            key = flow.key
+            seen.add(key)
+
+            installed = entries.get(key)
+            if (installed is None or installed.cookie != flow.cookie or
+                    installed.idle_timeout != flow.idle_timeout or
+                    installed.hard_timeout != flow.hard_timeout):
+                result.add.append(flow)
+            elif installed.instructions != flow.instructions:
+                result.modify.append(flow)
+
+        result.delete = [flow for key, flow in entries.items()
+                         if key not in seen]
+
+        return result
@@ -12,17 +12,601 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import switch
+import functools
+
+import numpy as np
+
+from sd_ixp import allowlist
+from sd_ixp import compiler
+from sd_ixp import cookie
+from sd_ixp import stats
+from sd_ixp import topology
+from sd_ixp import transaction
+from sd_ixp.matrix import TrafficMatrix
+
 
 class IXP:
-    """docstring for IXP.
+    """Internet Exchange Point abstraction
 
+    Holds the member registry and the switches of the IXP fabric. Switches are
+    programmed proactively from the registry as soon as they connect.
 
+    Attributes:
+        _members (dictionary): registered members indexed by AS number
+        _member_ports (dictionary): members indexed by (datapath id, port)
+        _member_macs (dictionary): members indexed by MAC
+        _switches (dictionary): connected switches indexed by datapath id
+        _vlans (dictionary): VLANs provisioned between members, by VLAN id
+        _topology (Topology): links between the switches
+        _lldp_key (bytes): key the LLDP frames of the controller are tagged
+            with (see topology.lldp_frame())
+        _matrix (TrafficMatrix): AS-to-AS traffic (None without accounting)
+        _generation (int): registry generation of the last member registered
+        _allowlist (MACAllowlist): source MACs the member ports accept
+        pipeline (Pipeline): table ids the switches are programmed with
     """
 
-    def __init__(self, arg):
-        self.arg = arg
+    def __init__(self, members=(), accounting=False,
+                 pipeline=compiler.PIPELINE, vlans=(),
+                 block_duration=allowlist.DEFAULT_BLOCK_DURATION,
+                 lldp_key=None):
+
+        self.pipeline = pipeline
+
+        # Dictionary that stores the member registry
+        # Structure: { ASN, Member }
+        self._members = {}
+
+        # Structure: { (datapath_id, port), Member }
+        self._member_ports = {}
+
+        # Structure: { MAC, Member }
+        self._member_macs = {}
 
         # Dictionary that stores all connected switches
         # Structure: { datapath_id, Switch }
         self._switches = {}
+
+        # Switches count the traffic between members in an accounting table
+        # (see sd_ixp.compiler), from which the matrix is built
+        self._matrix = None
+        if accounting:
+            self._matrix = TrafficMatrix(table_id=pipeline.account)
+
+        # Structure: { VLAN id, VLAN }
+        self._vlans = {}
+
+        # Every registration of a member gets a generation, carried by the
+        # cookies of its entries (see sd_ixp.cookie)
+        self._generation = 0
+
+        # Links between the switches, discovered with LLDP
+        self._topology = topology.Topology()
+        self._lldp_key = lldp_key or topology.new_key()
+
+        # Member ports only accept the MACs of their member; PacketIns of
+        # other sources are dropped before any processing
+        self._allowlist = allowlist.MACAllowlist(block_duration)
+
+        # The registry loaded is checked as a change to an empty one
+        members = list(members)
+        self._vlans, _ = self.validate_change(members=members,
+                                              create_vlans=vlans)
+        for member in members:
+            self.add_member(member)
+
+    @property
+    def switches(self):
+        """Connected switches: { datapath_id, Switch }"""
+        return self._switches
+
+    @property
+    def members(self):
+        """Registered members: { ASN, Member }"""
+        return self._members
+
+    @property
+    def vlans(self):
+        """Provisioned VLANs: { VLAN id, VLAN }"""
+        return self._vlans
+
+    @property
+    def topology(self):
+        """Links between the switches (Topology)"""
+        return self._topology
+
+    @property
+    def allowlist(self):
+        """Source MACs the member ports accept (MACAllowlist)"""
+        return self._allowlist
+
+    @property
+    def traffic_matrix(self):
+        """AS-to-AS TrafficMatrix (None without accounting)"""
+        return self._matrix
+
+    def add_member(self, member):
+        """Register a member (replacing a previous registration of its AS)
+
+        Switches already connected are not reprogrammed; call program() on
+        them to apply the change.
+
+        A registration that changes the member gets a new generation: its
+        entries are then installed again with the cookie of the new generation,
+        and those left of the previous one deleted. A registration identical to
+        the current one keeps its generation, so it changes nothing.
+
+        Links seen through the ports of the member are forgotten: a member
+        port is never a trunk.
+        """
+
+        current = self._members.get(member.asn)
+        if current is not None and current.to_dict() == member.to_dict():
+            member.generation = current.generation
+        else:
+            self._generation = (self._generation + 1) & cookie.GENERATION_MASK
+            member.generation = self._generation
+
+        self.remove_member(member.asn)
+
+        self._members[member.asn] = member
+        for port in member.ports:
+            self._member_ports[port] = member
+            self._topology.port_down(*port)
+        for mac in member.macs:
+            self._member_macs[mac] = member
+        self._allowlist.add_member(member)
+
+        if self._matrix is not None:
+            self._matrix.add_member(member)
+
+    def remove_member(self, asn):
+        """Unregister a member and return it (None if it was not registered)
+
+        Programming a switch afterwards deletes all the entries of the member
+        with a single flow mod (see Switch.sync()).
+        """
+
+        member = self._members.pop(asn, None)
+        if member is not None:
+            for port in member.ports:
+                self._member_ports.pop(port, None)
+            for mac in member.macs:
+                self._member_macs.pop(mac, None)
+            self._allowlist.remove_member(member)
+
+            if self._matrix is not None:
+                self._matrix.remove_member(asn)
+
+        return member
+
+    def member_at(self, dpid, port):
+        """Return the member connected to a switch port, or None"""
+        return self._member_ports.get((dpid, port))
+
+    def neighbor_allowed(self, mac, dpid, port):
+        """Whether an ARP/ND binding to a MAC may be learned from a port
+
+        The MAC of a member is only accepted from the ports of the member,
+        and a member port only announces the MACs of its member; MACs that
+        belong to no member are accepted from ports without a member.
+        """
+
+        owner = self._member_macs.get(mac.lower())
+        return owner is self._member_ports.get((dpid, port))
+
+    def add_switch(self, switch, program=True):
+        """Add a connected switch to the fabric and program it
+
+        The switch is asked for the flow entries it already has (e.g. from
+        before a reconnection), so that programming it only sends the
+        difference to the compiled entries.
+
+        Args:
+            switch (Switch): the switch
+            program (bool): whether to program it (not when another
+                controller node is its master, see resync())
+        """
+
+        self._switches[switch.dpid] = switch
+
+        if self._matrix is not None:
+            switch.stats.add_callback(
+                functools.partial(self._account, switch.dpid))
+
+        if program:
+            switch.request_flow_entries(self.program)
+
+    def resync(self, switch):
+        """Program a switch this controller just became the master of
+
+        Its flow entries are dumped first, so only what the former master
+        left different from the compiled entries is sent.
+        """
+        switch.request_flow_entries(self.program)
+
+    def remove_switch(self, dpid):
+        """Remove a switch from the fabric and return it"""
+
+        if self._matrix is not None:
+            self._matrix.forget_switch(dpid)
+
+        switch = self._switches.pop(dpid, None)
+
+        if self._topology.remove_switch(dpid):
+            self._topology_changed()
+
+        return switch
+
+    def send_lldp(self):
+        """Send an LLDP frame through every port of every switch
+
+        Returns:
+            int: number of frames sent
+        """
+
+        sent = 0
+        for switch in self._switches.values():
+            if switch.master:
+                sent += switch.send_lldp(self._lldp_key)
+
+        return sent
+
+    def lldp_received(self, dpid, port, data, offset):
+        """Record the link an LLDP frame came through
+
+        Args:
+            dpid (int): datapath id of the switch that received the frame
+            port (int): port that received it
+            data (bytes): the frame
+            offset (int): offset of the LLDP payload
+
+        Returns:
+            bool: whether the frame was sent by the controller (frames
+                received on, or naming, member ports never are)
+        """
+
+        if (dpid, port) in self._member_ports:
+            return False
+
+        source = topology.parse_lldp(data, self._lldp_key, offset)
+        if (source is None or source[0] not in self._switches or
+                source in self._member_ports):
+            return False
+
+        if self._topology.link_seen(source[0], source[1], dpid, port):
+            self._topology_changed()
+
+        return True
+
+    def port_down(self, dpid, port):
+        """Forget the links of a port that went down"""
+
+        if self._topology.port_down(dpid, port):
+            self._topology_changed()
+
+    def expire_links(self):
+        """Forget the links whose LLDP frames stopped arriving"""
+
+        if self._topology.expire():
+            self._topology_changed()
+
+    def _topology_changed(self):
+        """Reprogram the switches with the new paths
+
+        Only the entries of the paths that changed are sent (see
+        Switch.sync()).
+        """
+
+        for switch in self._switches.values():
+            if switch.master:
+                self.program(switch)
+
+    def program(self, switch, wait=False):
+        """Bring a switch to the flow entries compiled from the registry
+
+        Args:
+            switch (Switch): the switch
+            wait (bool): wait for room to send the changes instead of
+                deferring them (see Switch.sync()); never from the Ryu event
+                thread
+
+        Returns:
+            Completion: resolves when the switch has applied the changes
+        """
+
+        members = self._members.values()
+
+        switch.set_ports({port: member.asn for member in members
+                          for port in member.ports_on(switch.dpid)})
+
+        trunks = self._topology.trunk_ports(switch.dpid)
+        switch.set_trunks(trunks)
+
+        # Sources blocked before they were registered pass again
+        switch.unblock_sources(
+            functools.partial(self._allowlist.allowed, switch.dpid))
+
+        vlans = self._member_vlans()
+        tree = self._topology.tree_ports(switch.dpid)
+
+        return switch.sync(
+            compiler.compile_switch(
+                switch.dpid, members, accounting=self._matrix is not None,
+                pipeline=self.pipeline, vlans=vlans, trunks=trunks,
+                paths=self._topology.paths(switch.dpid), tree=tree),
+            groups=compiler.compile_flood_groups(switch.dpid, members, vlans,
+                                                 tree),
+            wait=wait)
+
+    def create_vlan(self, vlan, timeout=transaction.DEFAULT_TIMEOUT):
+        """Provision a VLAN between members (see provision())"""
+        return self.provision(create=[vlan], timeout=timeout)
+
+    def remove_vlan(self, vid, timeout=transaction.DEFAULT_TIMEOUT):
+        """Remove a provisioned VLAN (see provision())"""
+        return self.provision(remove=[vid], timeout=timeout)
+
+    def provision(self, create=(), remove=(),
+                  timeout=transaction.DEFAULT_TIMEOUT):
+        """Create and remove VLANs in a single change
+
+        The registry changes right away and the switches with ports of the
+        members involved are reprogrammed, all at once. The change commits
+        when all of them have applied it; if any fails or does not reply in
+        time, the VLANs are restored and the switches reprogrammed back.
+
+        Args:
+            create (iterable): VLAN objects to provision
+            remove (iterable): ids of the VLANs to remove
+            timeout (float): seconds the switches have to apply the change
+
+        Returns:
+            Transaction: resolves when the change commits or rolls back
+
+        Raises:
+            ValueError: the change is invalid (nothing is changed)
+        """
+        return self.change(create_vlans=create, remove_vlans=remove,
+                           timeout=timeout)
+
+    def change(self, members=(), remove_members=(), create_vlans=(),
+               remove_vlans=(), timeout=transaction.DEFAULT_TIMEOUT,
+               wait=False):
+        """Register and unregister members and VLANs in a single change
+
+        As provision(), but members may change as well: a change that
+        registers or unregisters members reprograms every switch, since all
+        of them forward to the members. The registrations the change replaced
+        are restored if it rolls back.
+
+        Args:
+            members (iterable): Member objects to register (replacing the
+                current registration of their AS)
+            remove_members (iterable): AS numbers of the members to unregister
+            create_vlans (iterable): VLAN objects to provision
+            remove_vlans (iterable): ids of the VLANs to remove
+            timeout (float): seconds the switches have to apply the change
+            wait (bool): wait for room to send the changes to each switch
+                (see program())
+
+        Returns:
+            Transaction: resolves when the change commits or rolls back
+
+        Raises:
+            ValueError: the change is invalid (nothing is changed)
+        """
+
+        members = list(members)
+        remove_members = list(remove_members)
+        create_vlans = list(create_vlans)
+
+        vlans, removed = self.validate_change(members, remove_members,
+                                              create_vlans, remove_vlans)
+
+        # Registrations replaced, to restore them on rollback
+        asns = remove_members + [member.asn for member in members]
+        previous = {asn: self._members.get(asn) for asn in asns}
+
+        for asn in remove_members:
+            self.remove_member(asn)
+        for member in members:
+            self.add_member(member)
+
+        self._vlans = vlans
+
+        if members or remove_members:
+            dpids = set(self._switches)
+        else:
+            dpids = self._vlan_switches(create_vlans + removed)
+
+        description = []
+        if members or remove_members:
+            description.append('members registered: %s, unregistered: %s' % (
+                [member.asn for member in members], remove_members))
+        if create_vlans or removed:
+            description.append('VLANs created: %s, removed: %s' % (
+                [vlan.vid for vlan in create_vlans],
+                [vlan.vid for vlan in removed]))
+
+        txn = transaction.Transaction(
+            '; '.join(description),
+            functools.partial(self._undo_change, previous, members,
+                              create_vlans, removed, dpids),
+            timeout)
+
+        for dpid in sorted(dpids):
+            switch = self._switches.get(dpid)
+
+            # The master of the switch programs it (see sd_ixp.cluster)
+            if switch is not None and switch.master:
+                txn.add(dpid, self.program(switch, wait=wait))
+
+        return txn.start()
+
+    def validate_change(self, members=(), remove_members=(), create_vlans=(),
+                        remove_vlans=()):
+        """Check a change (see change()) against the registry
+
+        Returns:
+            tuple: the VLANs after the change ({ VLAN id, VLAN }) and the VLAN
+                objects it removes
+
+        Raises:
+            ValueError: the change is invalid
+        """
+
+        registry = dict(self._members)
+        for asn in remove_members:
+            if asn not in registry:
+                raise ValueError('AS%d is not a member' % asn)
+            del registry[asn]
+
+        asns = set()
+        for member in members:
+            if member.asn in asns:
+                raise ValueError('AS%d is listed twice' % member.asn)
+            asns.add(member.asn)
+            registry[member.asn] = member
+
+        # The ports and MACs of the members registered must be theirs only
+        owners = {}
+        for member in registry.values():
+            for item in member.ports + member.macs:
+                owners.setdefault(item, []).append(member.asn)
+        for member in members:
+            for item in member.ports + member.macs:
+                if len(owners[item]) > 1:
+                    raise ValueError('%s is registered to AS%s' % (
+                        _describe(item),
+                        ', AS'.join(str(asn) for asn in owners[item])))
+
+        vlans = dict(self._vlans)
+        removed = []
+        for vid in remove_vlans:
+            if vid not in vlans:
+                raise ValueError('VLAN %d is not provisioned' % vid)
+            removed.append(vlans.pop(vid))
+
+        for vlan in create_vlans:
+            self._check_vlan(vlan, vlans, registry)
+            vlans[vlan.vid] = vlan
+
+        # The VLANs left must not lose their members either
+        for vlan in vlans.values():
+            for asn in vlan.asns:
+                if asn not in registry:
+                    raise ValueError('VLAN %d: AS%d is not a member' % (
+                        vlan.vid, asn))
+        for member in members:
+            for vid in member.vlans:
+                if vid in vlans:
+                    raise ValueError('VLAN %d of AS%d is provisioned between '
+                                     'members' % (vid, member.asn))
+
+        return vlans, removed
+
+    def _undo_change(self, previous, members, created, removed, dpids):
+        """Rollback of change(): only its own registrations are restored, so
+        the changes made since are kept"""
+
+        for member in members:
+            if self._members.get(member.asn) is member:
+                self.remove_member(member.asn)
+        for asn, member in previous.items():
+            if member is not None and asn not in self._members:
+                self.add_member(member)
+
+        for vlan in created:
+            if self._vlans.get(vlan.vid) is vlan:
+                del self._vlans[vlan.vid]
+        for vlan in removed:
+            self._vlans.setdefault(vlan.vid, vlan)
+
+        for dpid in dpids:
+            switch = self._switches.get(dpid)
+            if switch is not None and switch.master:
+                self.program(switch)
+
+    def _check_vlan(self, vlan, vlans, members=None):
+        """Raise ValueError if a VLAN can not be provisioned among members
+        (the registered ones by default)"""
+
+        if members is None:
+            members = self._members
+
+        if vlan.vid in vlans:
+            raise ValueError('VLAN %d already exists' % vlan.vid)
+
+        for asn in vlan.asns:
+            if asn not in members:
+                raise ValueError('VLAN %d: AS%d is not a member' % (vlan.vid,
+                                                                    asn))
+
+        for member in members.values():
+            if vlan.vid in member.vlans:
+                raise ValueError('VLAN %d is a VLAN of AS%d' % (vlan.vid,
+                                                                member.asn))
+
+    def _vlan_switches(self, vlans):
+        """Datapath ids of the switches the members of VLANs are connected to"""
+
+        return {dpid for vlan in vlans for asn in vlan.asns
+                for dpid, _ in getattr(self._members.get(asn), 'ports', ())}
+
+    def _member_vlans(self):
+        """Provisioned VLAN ids of each member: { ASN, [ VLAN id ] }"""
+
+        vlans = {}
+        for vlan in self._vlans.values():
+            for asn in vlan.asns:
+                vlans.setdefault(asn, []).append(vlan.vid)
+
+        return vlans
+
+    def _account(self, dpid, collector, kind):
+        """Add a flow stats sample of a switch to the traffic matrix"""
+
+        if kind == stats.FLOW_STATS:
+            self._matrix.update(dpid, collector)
+
+    def member_rates(self):
+        """Traffic rates of the members, summed over their ports
+
+        Computed from the port rates of the last polling interval of every
+        switch (see sd_ixp.stats). Ports are seen from the switch: rx is the
+        traffic the member sends to the IXP and tx what it receives.
+
+        Returns:
+            tuple: list of AS numbers and numpy.ndarray of shape
+                (len(stats.PORT_FIELDS), members) with their rates per second
+        """
+
+        asns = list(self._members)
+        index = {asn: i for i, asn in enumerate(asns)}
+        totals = np.zeros((len(stats.PORT_FIELDS), len(asns)))
+
+        for dpid, switch in self._switches.items():
+            series = switch.stats.ports
+            rates = series.rates
+
+            owners = np.array(
+                [index.get(getattr(self._member_ports.get((dpid, port)),
+                                   'asn', None), -1)
+                 for port in series.keys[:rates.shape[1]]], np.intp)
+            member_ports = owners >= 0
+
+            for field in range(len(stats.PORT_FIELDS)):
+                totals[field] += np.bincount(
+                    owners[member_ports], rates[field][member_ports],
+                    minlength=len(asns))
+
+        return asns, totals
+
+
+def _describe(item):
+    """Name of a member port ((datapath id, port) pair) or MAC"""
+
+    if isinstance(item, tuple):
+        return 'port %d of switch %d' % (item[1], item[0])
+    return 'MAC %s' % item
@@ -0,0 +1,392 @@
+# Copyright (C) 2018 [SD]RSiX Project
+#
+# Licensed under the Apache License, Version 2.0 (the “License”);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an “AS IS” BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Asynchronous registry change jobs
+
+A Change adds and removes members, member MACs and VLANs in bulk. It is
+described in JSON as:
+
+    {
+        "members": {"add": [{"asn": 65003, ...}], "remove": [65004]},
+        "macs": {
+            "add": [{"asn": 65001, "mac": "00:00:5e:00:53:02"}],
+            "remove": [{"asn": 65002, "mac": "00:00:5e:00:53:10"}]
+        },
+        "vlans": {"create": [{"vid": 3001, ...}], "remove": [3002]}
+    }
+
+with members and VLANs in their registry format (see sd_ixp.member and
+sd_ixp.vlan); every section is optional.
+
+The northbound API (see sd_ixp.api) does not apply a Change while the client
+waits: it becomes a Job, queued to a JobQueue whose worker runs the Jobs one
+after the other. Each Change is validated against the registry when its Job
+runs and sent to all the switches at once as a single Transaction (see
+IXP.change()), which commits or rolls back as a whole. Clients poll the Job for
+its state.
+"""
+
+import collections
+import itertools
+import time
+
+from ryu.lib import hub
+
+from sd_ixp import transaction
+from sd_ixp.member import Member, normalize_mac
+from sd_ixp.vlan import VLAN
+
+# States (besides transaction.COMMITTED and transaction.ROLLED_BACK)
+QUEUED = 'queued'
+RUNNING = 'running'
+FAILED = 'failed'
+
+# Default number of Jobs waiting to run; more are refused
+DEFAULT_MAX_PENDING = 64
+
+# Default number of finished Jobs kept for polling
+DEFAULT_HISTORY = 256
+
+
+class Change:
+    """Members, member MACs and VLANs to add and remove at once
+
+    Attributes:
+        members (list): Member objects to register (replacing the current
+            registration of their AS)
+        remove_members (list): AS numbers of the members to unregister
+        add_macs (list): (ASN, MAC) pairs of MACs to add to members
+        remove_macs (list): (ASN, MAC) pairs of MACs to remove from members
+        create_vlans (list): VLAN objects to provision
+        remove_vlans (list): ids of the VLANs to remove
+    """
+
+    def __init__(self, members=(), remove_members=(), add_macs=(),
+                 remove_macs=(), create_vlans=(), remove_vlans=()):
+        self.members = list(members)
+        self.remove_members = [int(asn) for asn in remove_members]
+        self.add_macs = [(int(asn), normalize_mac(mac))
+                         for asn, mac in add_macs]
+        self.remove_macs = [(int(asn), normalize_mac(mac))
+                            for asn, mac in remove_macs]
+        self.create_vlans = list(create_vlans)
+        self.remove_vlans = [int(vid) for vid in remove_vlans]
+
+    def __len__(self):
+        """Number of operations of the Change"""
+        return (len(self.members) + len(self.remove_members) +
+                len(self.add_macs) + len(self.remove_macs) +
+                len(self.create_vlans) + len(self.remove_vlans))
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build a Change from its JSON representation"""
+
+        if not isinstance(data, dict):
+            raise ValueError('a change must be an object, not %r' % (data, ))
+
+        unknown = set(data) - {'members', 'macs', 'vlans'}
+        if unknown:
+            raise ValueError('unknown sections: %s' % ', '.join(
+                sorted(unknown)))
+
+        members = _section(data, 'members', ('add', 'remove'))
+        macs = _section(data, 'macs', ('add', 'remove'))
+        vlans = _section(data, 'vlans', ('create', 'remove'))
+
+        try:
+            return cls(
+                members=[Member.from_dict(member)
+                         for member in members['add']],
+                remove_members=members['remove'],
+                add_macs=[(entry['asn'], entry['mac'])
+                          for entry in macs['add']],
+                remove_macs=[(entry['asn'], entry['mac'])
+                             for entry in macs['remove']],
+                create_vlans=[VLAN.from_dict(vlan)
+                              for vlan in vlans['create']],
+                remove_vlans=vlans['remove'])
+        except (KeyError, TypeError, AttributeError) as e:
+            raise ValueError('invalid change: %s' % (e, ))
+
+    def summary(self):
+        """Number of operations of each kind"""
+
+        return {
+            'members': {'add': len(self.members),
+                        'remove': len(self.remove_members)},
+            'macs': {'add': len(self.add_macs),
+                     'remove': len(self.remove_macs)},
+            'vlans': {'create': len(self.create_vlans),
+                      'remove': len(self.remove_vlans)},
+        }
+
+    def resolve(self, registry):
+        """Member objects to register, with the MAC changes applied
+
+        The MACs are added to or removed from the member the Change
+        registers, if any, and from its current registration otherwise.
+
+        Args:
+            registry (dictionary): registered members by AS number
+
+        Raises:
+            ValueError: a MAC change of an AS that is not a member, or of a
+                MAC the member does not have
+        """
+
+        members = collections.OrderedDict(
+            (member.asn, member) for member in self.members)
+        removed = set(self.remove_members) - set(members)
+
+        # Structure: { ASN, [ MAC ] }
+        macs = collections.OrderedDict()
+
+        def member_macs(asn):
+            if asn not in macs:
+                base = members.get(asn)
+                if base is None and asn not in removed:
+                    base = registry.get(asn)
+                if base is None:
+                    raise ValueError('AS%d is not a member' % asn)
+                macs[asn] = list(base.macs)
+            return macs[asn]
+
+        for asn, mac in self.add_macs:
+            current = member_macs(asn)
+            if mac not in current:
+                current.append(mac)
+
+        for asn, mac in self.remove_macs:
+            current = member_macs(asn)
+            if mac not in current:
+                raise ValueError('%s is not a MAC of AS%d' % (mac, asn))
+            current.remove(mac)
+
+        for asn, edited in macs.items():
+            base = members.get(asn) or registry[asn]
+            members[asn] = Member(asn, base.name, base.ports, edited,
+                                  base.vlans)
+
+        return list(members.values())
+
+    def validate(self, ixp):
+        """Raise ValueError if the Change can not be applied to the IXP now"""
+
+        ixp.validate_change(self.resolve(ixp.members), self.remove_members,
+                            self.create_vlans, self.remove_vlans)
+
+    def apply(self, ixp, timeout=transaction.DEFAULT_TIMEOUT, wait=False):
+        """Apply the Change to the IXP (see IXP.change())
+
+        Returns:
+            Transaction: resolves when the change commits or rolls back
+
+        Raises:
+            ValueError: the Change is invalid (nothing is changed)
+        """
+
+        return ixp.change(self.resolve(ixp.members), self.remove_members,
+                          self.create_vlans, self.remove_vlans, timeout,
+                          wait)
+
+
+def _section(data, name, operations):
+    """Lists of the operations of a section of a Change: { operation, list }"""
+
+    section = data.get(name, {})
+    if not isinstance(section, dict):
+        raise ValueError('%s must be an object' % name)
+
+    unknown = set(section) - set(operations)
+    if unknown:
+        raise ValueError('unknown %s operations: %s' % (
+            name, ', '.join(sorted(unknown))))
+
+    lists = {}
+    for operation in operations:
+        lists[operation] = section.get(operation, [])
+        if not isinstance(lists[operation], list):
+            raise ValueError('%s %s must be a list' % (name, operation))
+
+    return lists
+
+
+class Job:
+    """A Change queued to be applied
+
+    Attributes:
+        id (int): job id
+        change (Change): the change
+        state (str): QUEUED, RUNNING, FAILED (the Change was invalid and
+            nothing changed), transaction.COMMITTED or transaction.ROLLED_BACK
+        error (str): why the Job failed or rolled back
+        errors (dictionary): { datapath_id, [ (error type, code) ] } of the
+            switches that failed to apply the Change (an empty list means the
+            switch did not reply in time)
+        submitted, started, finished (float): wall clock times (None until
+            then)
+    """
+
+    def __init__(self, job_id, change):
+        self.id = job_id
+        self.change = change
+        self.state = QUEUED
+        self.error = None
+        self.errors = {}
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+
+    def done(self):
+        """Whether the Job finished (in any way)"""
+        return self.state not in (QUEUED, RUNNING)
+
+    def to_dict(self):
+        """JSON representation of the Job"""
+
+        return {
+            'id': self.id,
+            'state': self.state,
+            'error': self.error,
+            'errors': {str(dpid): [list(error) for error in errors]
+                       for dpid, errors in self.errors.items()},
+            'change': self.change.summary(),
+            'submitted': self.submitted,
+            'started': self.started,
+            'finished': self.finished,
+        }
+
+
+class JobQueue:
+    """Runs the Jobs submitted, one at a time, in a worker thread
+
+    Attributes:
+        _ixp (IXP): the IXP the Changes are applied to
+        _timeout (float): seconds the switches have to apply a Change
+        _queue (hub.Queue): Jobs waiting to run
+        _jobs (OrderedDict): the Jobs waiting, running and the last ones
+            finished, by id
+        _on_commit (callable): called with each Job that commits
+        counters (dictionary): Jobs submitted, refused (queue full) and
+            finished in each state
+    """
+
+    def __init__(self, ixp, timeout=transaction.DEFAULT_TIMEOUT,
+                 max_pending=DEFAULT_MAX_PENDING, history=DEFAULT_HISTORY,
+                 on_commit=None, logger=None):
+        self._ixp = ixp
+        self._timeout = timeout
+        self._history = history
+        self._on_commit = on_commit
+        self._logger = logger
+
+        self._ids = itertools.count(1)
+        self._queue = hub.Queue(max_pending)
+
+        # Structure: { job id, Job }
+        self._jobs = collections.OrderedDict()
+
+        self.counters = collections.Counter()
+
+        self._thread = hub.spawn(self._worker)
+
+    def __len__(self):
+        """Number of Jobs waiting to run"""
+        return self._queue.qsize()
+
+    def submit(self, change):
+        """Queue a Change
+
+        Returns:
+            Job: the Job of the Change, or None if the queue is full
+        """
+
+        if self._queue.full():
+            self.counters['refused'] += 1
+            return None
+
+        job = Job(next(self._ids), change)
+        self._jobs[job.id] = job
+        self._queue.put_nowait(job)
+        self.counters['submitted'] += 1
+
+        return job
+
+    def get(self, job_id):
+        """Job with an id (None if it is unknown or was forgotten)"""
+        return self._jobs.get(job_id)
+
+    def jobs(self):
+        """The Jobs known, oldest first"""
+        return list(self._jobs.values())
+
+    def stop(self):
+        """Stop the worker (queued Jobs do not run)"""
+
+        if self._thread is not None:
+            hub.kill(self._thread)
+            self._thread = None
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+
+            try:
+                self._run(job)
+            except Exception as e:
+                # A bad Job must not stop the ones behind it
+                job.state, job.error = FAILED, str(e)
+                if self._logger is not None:
+                    self._logger.exception("Job %d failed", job.id)
+
+            job.finished = time.time()
+            self.counters[job.state] += 1
+            self._forget()
+
+    def _run(self, job):
+        job.state = RUNNING
+        job.started = time.time()
+
+        try:
+            # Off the event thread: the Job waits for room in the buffers of
+            # slow switches rather than deferring its changes
+            txn = job.change.apply(self._ixp, self._timeout, wait=True)
+        except ValueError as e:
+            job.state, job.error = FAILED, str(e)
+            return
+
+        # The barrier replies resolve the Transaction in the event thread
+        txn.wait()
+
+        job.state = txn.state
+        job.errors = {
+            dpid: [(error.type, error.code) for error in errors]
+            for dpid, errors in txn.errors.items()}
+
+        if not txn.ok:
+            job.error = 'switches failed to apply the change: %s' % (
+                ', '.join(str(dpid) for dpid in sorted(txn.errors)))
+            return
+
+        if self._on_commit is not None:
+            self._on_commit(job)
+
+    def _forget(self):
+        """Drop the oldest finished Jobs beyond the history"""
+
+        finished = [job_id for job_id, job in self._jobs.items()
+                    if job.done()]
+        for job_id in finished[:max(0, len(finished) - self._history)]:
+            del self._jobs[job_id]
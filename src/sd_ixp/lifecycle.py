@@ -0,0 +1,207 @@
+# Copyright (C) 2018 [SD]RSiX Project
+#
+# Licensed under the Apache License, Version 2.0 (the “License”);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an “AS IS” BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Switch connection lifecycle
+
+Switches come and go, sometimes many times in a row while they are worked on
+in a maintenance window. Everything the controller keeps for a switch is
+released when it disconnects; what it learned survives the disconnection for
+a while, and a switch that keeps reconnecting is programmed less and less
+often:
+
+- DepartedSwitches keeps the learned MACs of the switches that disconnected,
+  for a limited time and a limited number of switches, so a switch that comes
+  back gets them again instead of relearning them (and flooding meanwhile).
+
+- FlapDamper gives a switch a penalty every time it connects. The penalty
+  decays exponentially (it halves every half life); while it is over the
+  suppress threshold the switch is not programmed until it decays below the
+  reuse threshold, as BGP route flap damping does. A switch that connects
+  once is programmed right away.
+"""
+
+import collections
+import math
+import time
+
+from sd_ixp import mactable
+
+# Penalty of a connection, and the penalties over which a switch is
+# suppressed and under which it is programmed again
+FLAP_PENALTY = 1.0
+SUPPRESS_THRESHOLD = 3.0
+REUSE_THRESHOLD = 1.5
+
+# Seconds the penalty takes to halve, and longest a switch waits to be
+# programmed
+DEFAULT_HALF_LIFE = 60
+MAX_DELAY = 300
+
+# Switches whose learned MACs are kept after they disconnect, and for how long
+# (the switch removes the entries of a learned MAC after its idle timeout)
+DEFAULT_MAX_DEPARTED = 1024
+DEFAULT_DEPARTED_TIMEOUT = mactable.DEFAULT_IDLE_TIMEOUT
+
+
+class FlapDamper:
+    """Exponentially decaying reconnection penalty per switch
+
+    Attributes:
+        half_life (float): seconds the penalty takes to halve
+        _penalties (dictionary): (penalty, monotonic time it was computed) per
+            datapath id
+    """
+
+    def __init__(self, half_life=DEFAULT_HALF_LIFE):
+        self.half_life = half_life
+
+        # Structure: { datapath_id, (penalty, monotonic time) }
+        self._penalties = {}
+
+    def __len__(self):
+        return len(self._penalties)
+
+    def penalty(self, dpid, now=None):
+        """Current penalty of a switch"""
+
+        if now is None:
+            now = time.monotonic()
+
+        entry = self._penalties.get(dpid)
+        if entry is None:
+            return 0.0
+
+        penalty, last = entry
+        return penalty * 0.5 ** ((now - last) / self.half_life)
+
+    def connected(self, dpid, now=None):
+        """Record a connection of a switch
+
+        Returns:
+            float: seconds to wait before programming the switch (0 if it is
+                not suppressed)
+        """
+
+        if now is None:
+            now = time.monotonic()
+
+        penalty = self.penalty(dpid, now) + FLAP_PENALTY
+        self._penalties[dpid] = (penalty, now)
+
+        if penalty <= SUPPRESS_THRESHOLD:
+            return 0
+
+        return min(MAX_DELAY,
+                   self.half_life * math.log2(penalty / REUSE_THRESHOLD))
+
+    def purge(self, now=None):
+        """Forget the switches whose penalty has decayed away
+
+        Returns:
+            int: number of switches forgotten
+        """
+
+        if now is None:
+            now = time.monotonic()
+
+        # A penalty under 1% of a connection no longer changes anything
+        stale = [dpid for dpid in self._penalties
+                 if self.penalty(dpid, now) < FLAP_PENALTY / 100]
+        for dpid in stale:
+            del self._penalties[dpid]
+
+        return len(stale)
+
+
+class DepartedSwitches:
+    """Learned MACs of the switches that disconnected recently
+
+    Attributes:
+        max_switches (int): switches kept (the oldest departure goes first)
+        timeout (float): seconds a departed switch is kept
+        _switches (OrderedDict): departure time and MACs per datapath id, in
+            the order the switches departed
+    """
+
+    def __init__(self, max_switches=DEFAULT_MAX_DEPARTED,
+                 timeout=DEFAULT_DEPARTED_TIMEOUT):
+        self.max_switches = max_switches
+        self.timeout = timeout
+
+        # Structure: { datapath_id, (monotonic time,
+        #                            [ (mac, vlan, port, learned, seen) ]) }
+        self._switches = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._switches)
+
+    def __contains__(self, dpid):
+        return dpid in self._switches
+
+    def store(self, dpid, macs, now=None):
+        """Keep the learned MACs of a switch that disconnected
+
+        Args:
+            dpid (int): datapath id
+            macs (iterable): MACEntry objects
+        """
+
+        if now is None:
+            now = time.monotonic()
+
+        self._switches.pop(dpid, None)
+        self._switches[dpid] = (now, [
+            (entry.mac, entry.vlan, entry.port, entry.learned, entry.seen)
+            for entry in macs])
+
+        while len(self._switches) > self.max_switches:
+            self._switches.popitem(last=False)
+
+    def pop(self, dpid, now=None):
+        """Learned MACs of a switch that reconnects (used only once)
+
+        Returns:
+            list: (mac, vlan, port, learned, seen) tuples (see
+                Switch.restore())
+        """
+
+        if now is None:
+            now = time.monotonic()
+
+        entry = self._switches.pop(dpid, None)
+        if entry is None or now - entry[0] > self.timeout:
+            return []
+
+        return entry[1]
+
+    def purge(self, now=None):
+        """Forget the switches that departed too long ago
+
+        Returns:
+            int: number of switches forgotten
+        """
+
+        if now is None:
+            now = time.monotonic()
+
+        purged = 0
+        while self._switches:
+            dpid, (departed, _) = next(iter(self._switches.items()))
+            if now - departed <= self.timeout:
+                break
+
+            del self._switches[dpid]
+            purged += 1
+
+        return purged
@@ -0,0 +1,243 @@
+# Copyright (C) 2018 [SD]RSiX Project
+#
+# Licensed under the Apache License, Version 2.0 (the “License”);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an “AS IS” BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Logging for the PacketIn path
+
+A log line per PacketIn costs more than the forwarding decision itself under
+load, and a storm turns the log into noise. EventLog logs per-packet events
+sampled: at most a number of records per event type and interval, with the
+suppressed ones summed up at the end of the interval, along with counters such
+as "N PacketIns from dpid X in the last 10s". Messages are formatted lazily by
+the logging module, only for records that are actually emitted.
+
+start_queue_logging() moves the handlers of the root logger (the ones Ryu
+configures) behind a bounded queue served by an OS thread, so writing the log
+never blocks the event loop; records are dropped, and counted, when the queue
+is full.
+"""
+
+import logging
+import logging.handlers
+import time
+
+try:
+    # Ryu monkey patches threading and queue with eventlet's green versions;
+    # the log writer must be a real thread
+    from eventlet import patcher
+    _threading = patcher.original('threading')
+    _queue = patcher.original('queue')
+except ImportError:
+    import threading as _threading
+    import queue as _queue
+
+# Default interval (in seconds) of samples and counter reports
+DEFAULT_INTERVAL = 10
+
+# Default number of records per event type and interval
+DEFAULT_CAP = 10
+
+# Default number of records waiting to be written
+DEFAULT_QUEUE_SIZE = 10000
+
+# Counters reported per event type (the busiest keys)
+REPORT_KEYS = 10
+
+# The running log writer (one per process)
+_listener = None
+
+
+class EventLog:
+    """Sampled logging and counters of per-packet events
+
+    Attributes:
+        interval (float): seconds of a sampling and counting interval
+        cap (int): records logged per event type and interval
+        _logger (Logger): logger records go to
+        _next (float): monotonic time the current interval ends
+        _logged (dictionary): records logged per event type in the interval
+        _suppressed (dictionary): records suppressed per event type in the
+            interval
+        _counts (dictionary): event counts in the interval
+    """
+
+    def __init__(self, logger, interval=DEFAULT_INTERVAL, cap=DEFAULT_CAP):
+        self.interval = interval
+        self.cap = cap
+        self._logger = logger
+        self._next = time.monotonic() + interval
+
+        # Structure: { event, number of records }
+        self._logged = {}
+        self._suppressed = {}
+
+        # Structure: { event, { key, count } }
+        self._counts = {}
+
+    def log(self, event, level, msg, *args):
+        """Log a record of an event type, unless the cap has been reached
+
+        Args:
+            event (str): event type the cap applies to
+            level (int): logging level
+            msg (str): message, formatted with args only if it is emitted
+        """
+
+        if not self._logger.isEnabledFor(level):
+            return
+
+        self._tick()
+
+        logged = self._logged.get(event, 0)
+        if logged >= self.cap:
+            self._suppressed[event] = self._suppressed.get(event, 0) + 1
+            return
+
+        self._logged[event] = logged + 1
+        self._logger.log(level, msg, *args)
+
+    def count(self, event, key):
+        """Count an event, reported once per interval
+
+        Args:
+            event (str): what is counted (e.g. 'PacketIns')
+            key: what it is counted by (e.g. a datapath id)
+        """
+
+        self._tick()
+
+        counts = self._counts.get(event)
+        if counts is None:
+            counts = self._counts[event] = {}
+        counts[key] = counts.get(key, 0) + 1
+
+    def report(self):
+        """Log the counters and suppressed records, and start an interval"""
+
+        self._next = time.monotonic() + self.interval
+
+        for event, counts in self._counts.items():
+            busiest = sorted(counts.items(), key=lambda item: -item[1])
+            self._logger.info(
+                "%d %s in the last %ss: %s", sum(counts.values()), event,
+                self.interval, ', '.join(
+                    "%s from dpid %s" % (n, key)
+                    for key, n in busiest[:REPORT_KEYS]))
+
+        for event, suppressed in self._suppressed.items():
+            self._logger.info("%d '%s' records suppressed in the last %ss",
+                              suppressed, event, self.interval)
+
+        self._logged.clear()
+        self._suppressed.clear()
+        self._counts.clear()
+
+    def _tick(self):
+        if time.monotonic() >= self._next:
+            self.report()
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that drops records when the queue is full"""
+
+    def __init__(self, queue):
+        super(_QueueHandler, self).__init__(queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Only tracebacks must be rendered here, the rest is formatted by the
+        # writer thread
+        if record.exc_info:
+            return super(_QueueHandler, self).prepare(record)
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except _queue.Full:
+            self.dropped += 1
+
+
+class _Listener:
+    """OS thread writing the queued records to the original handlers"""
+
+    def __init__(self, queue, handlers):
+        self.queue = queue
+        self.handlers = handlers
+        self._thread = _threading.Thread(target=self._run,
+                                         name='log-writer', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                return
+
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+    def stop(self):
+        self.queue.put(None)
+        self._thread.join()
+
+
+def start_queue_logging(queue_size=DEFAULT_QUEUE_SIZE):
+    """Write the records of the root logger from a queue
+
+    The handlers of the root logger are replaced by a queue handler and moved
+    to a writer thread. Calling it again does nothing.
+
+    Args:
+        queue_size (int): records waiting to be written; more are dropped
+
+    Returns:
+        _QueueHandler: the queue handler (its dropped attribute counts the
+            dropped records)
+    """
+
+    global _listener
+
+    root = logging.getLogger()
+
+    if _listener is None:
+        queue = _queue.Queue(queue_size)
+        handlers = root.handlers[:]
+        for handler in handlers:
+            root.removeHandler(handler)
+
+        root.addHandler(_QueueHandler(queue))
+        _listener = _Listener(queue, handlers)
+
+    return next(handler for handler in root.handlers
+                if isinstance(handler, _QueueHandler))
+
+
+def stop_queue_logging():
+    """Write the queued records and give the handlers back to the root logger"""
+
+    global _listener
+
+    if _listener is None:
+        return
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        if isinstance(handler, _QueueHandler):
+            root.removeHandler(handler)
+
+    _listener.stop()
+    for handler in _listener.handlers:
+        root.addHandler(handler)
+    _listener = None
@@ -0,0 +1,321 @@
+# Copyright (C) 2018 [SD]RSiX Project
+#
+# Licensed under the Apache License, Version 2.0 (the “License”);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an “AS IS” BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""MAC learning table
+
+A compact learning table for one switch. Entries are indexed by a single
+integer that packs the VLAN id and the 48-bit MAC address, and are stored as
+__slots__ objects. The table has idle and hard aging, expired through a timer
+wheel, and capacity limits per switch and per port, so a member spraying
+random source MACs cannot make it grow without bound.
+"""
+
+import time
+
+# Results of MACTable.learn()
+NEW = 1
+REFRESHED = 2
+MOVED = 3
+REJECTED = 4
+
+# Defaults: aging in seconds (0 disables it) and capacity limits
+DEFAULT_IDLE_TIMEOUT = 300
+DEFAULT_HARD_TIMEOUT = 3600
+DEFAULT_MAX_ENTRIES = 8192
+DEFAULT_MAX_PER_PORT = 64
+
+# Number of one-second slots of the timer wheel
+WHEEL_SIZE = 256
+
+
+def mac_to_int(mac):
+    """Convert a colon separated MAC address to a 48-bit integer"""
+    return int(mac.replace(':', ''), 16)
+
+
+def int_to_mac(value):
+    """Convert a 48-bit integer to a colon separated MAC address"""
+
+    raw = '%012x' % value
+    return ':'.join(raw[i:i + 2] for i in range(0, 12, 2))
+
+
+def _key(mac, vlan_id):
+    # VLAN 0 stands for untagged frames
+    return (vlan_id or 0) << 48 | mac
+
+
+class MACEntry:
+    """A learned MAC address
+
+    Attributes:
+        mac (int): the MAC address as a 48-bit integer
+        vlan (int): VLAN id (None if untagged)
+        port (int): port the MAC was learned on
+        learned (float): monotonic time the entry was created
+        seen (float): monotonic time the MAC was last seen
+    """
+
+    __slots__ = ('mac', 'vlan', 'port', 'learned', 'seen')
+
+    def __init__(self, mac, vlan, port, now):
+        self.mac = mac
+        self.vlan = vlan
+        self.port = port
+        self.learned = now
+        self.seen = now
+
+
+class MACTable:
+    """MAC learning table of a switch
+
+    Attributes:
+        _entries (dictionary): entries indexed by (VLAN << 48 | MAC)
+        _port_count (dictionary): number of entries per port
+        _wheel (list): timer wheel; each slot holds the keys that may expire
+            in that second
+        _tick (int): last second the wheel was advanced to
+        counters (dictionary): learning and aging counters
+    """
+
+    def __init__(self, idle_timeout=DEFAULT_IDLE_TIMEOUT,
+                 hard_timeout=DEFAULT_HARD_TIMEOUT,
+                 max_entries=DEFAULT_MAX_ENTRIES,
+                 max_per_port=DEFAULT_MAX_PER_PORT):
+
+        self.idle_timeout = idle_timeout
+        self.hard_timeout = hard_timeout
+        self.max_entries = max_entries
+        self.max_per_port = max_per_port
+
+        # Structure: { VLAN << 48 | MAC, MACEntry }
+        self._entries = {}
+
+        # Structure: { port, number of entries }
+        self._port_count = {}
+
+        self._wheel = [set() for _ in range(WHEEL_SIZE)]
+        self._tick = int(time.monotonic())
+
+        self.counters = {
+            'learned': 0,
+            'moved': 0,
+            'expired': 0,
+            'rejected_switch_full': 0,
+            'rejected_port_full': 0,
+        }
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        return iter(self._entries.values())
+
+    def port_count(self, port):
+        """Number of entries learned on a port"""
+        return self._port_count.get(port, 0)
+
+    def lookup(self, mac, vlan_id=None):
+        """Return the port a MAC was learned on, or None
+
+        Args:
+            mac (int): the MAC address as a 48-bit integer
+            vlan_id (int): VLAN id (None if untagged)
+        """
+
+        entry = self._entries.get(_key(mac, vlan_id))
+        if entry is None or self._deadline(entry) <= time.monotonic():
+            return None
+
+        return entry.port
+
+    def learn(self, mac, port, vlan_id=None):
+        """Learn or refresh a MAC address
+
+        Args:
+            mac (int): the MAC address as a 48-bit integer
+            port (int): port the MAC was seen on
+            vlan_id (int): VLAN id (None if untagged)
+
+        Returns:
+            int: NEW, REFRESHED, MOVED or REJECTED (table or port full)
+        """
+
+        now = time.monotonic()
+        key = _key(mac, vlan_id)
+        entry = self._entries.get(key)
+
+        # An expired entry the wheel has not removed yet is learned again
+        if entry is not None and self._deadline(entry) <= now:
+            del self._entries[key]
+            self._release(entry)
+            self.counters['expired'] += 1
+            entry = None
+
+        if entry is not None and entry.port == port:
+            entry.seen = now
+            return REFRESHED
+
+        if self.port_count(port) >= self.max_per_port:
+            self.counters['rejected_port_full'] += 1
+            return REJECTED
+
+        if entry is not None:
+            # The MAC moved to another port: it is learned again
+            self._release(entry)
+            self.counters['moved'] += 1
+            result = MOVED
+        elif len(self._entries) >= self.max_entries:
+            self.counters['rejected_switch_full'] += 1
+            return REJECTED
+        else:
+            self.counters['learned'] += 1
+            result = NEW
+
+        entry = MACEntry(mac, vlan_id, port, now)
+        self._entries[key] = entry
+        self._port_count[port] = self._port_count.get(port, 0) + 1
+        self._schedule(key, entry)
+
+        return result
+
+    def restore(self, mac, port, vlan_id, learned, seen):
+        """Insert an entry saved earlier (e.g. by a snapshot)
+
+        Entries already expired, or beyond the capacity limits, are skipped.
+
+        Args:
+            mac (int): the MAC address as a 48-bit integer
+            port (int): port the MAC was learned on
+            vlan_id (int): VLAN id (None if untagged)
+            learned (float): monotonic time the MAC was learned
+            seen (float): monotonic time the MAC was last seen
+
+        Returns:
+            bool: whether the entry was inserted
+        """
+
+        key = _key(mac, vlan_id)
+        entry = MACEntry(mac, vlan_id, port, learned)
+        entry.seen = seen
+
+        if (key in self._entries or
+                self._deadline(entry) <= time.monotonic() or
+                len(self._entries) >= self.max_entries or
+                self.port_count(port) >= self.max_per_port):
+            return False
+
+        self._entries[key] = entry
+        self._port_count[port] = self._port_count.get(port, 0) + 1
+        self._schedule(key, entry)
+
+        return True
+
+    def remove(self, mac, vlan_id=None):
+        """Remove an entry and return it (None if there was none)"""
+
+        entry = self._entries.pop(_key(mac, vlan_id), None)
+        if entry is not None:
+            self._release(entry)
+
+        return entry
+
+    def flush_port(self, port):
+        """Remove (and return) every entry learned on a port"""
+
+        removed = [entry for entry in self._entries.values()
+                   if entry.port == port]
+        for entry in removed:
+            self.remove(entry.mac, entry.vlan)
+
+        return removed
+
+    def expire(self, now=None):
+        """Advance the timer wheel and remove the expired entries
+
+        Only the wheel slots of the seconds elapsed since the last call are
+        visited. Entries refreshed meanwhile are rescheduled instead of
+        removed.
+
+        Returns:
+            list: expired MACEntry objects
+        """
+
+        if now is None:
+            now = time.monotonic()
+
+        expired = []
+        target = int(now)
+        ticks = min(target - self._tick, WHEEL_SIZE)
+
+        for tick in range(target - ticks + 1, target + 1):
+            # Entries rescheduled below go to later slots
+            self._tick = tick
+
+            slot = self._wheel[tick % WHEEL_SIZE]
+            if not slot:
+                continue
+
+            keys = list(slot)
+            slot.clear()
+
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+
+                if self._deadline(entry) <= now:
+                    del self._entries[key]
+                    self._release(entry)
+                    self.counters['expired'] += 1
+                    expired.append(entry)
+                else:
+                    self._schedule(key, entry)
+
+        self._tick = target
+
+        return expired
+
+    def _deadline(self, entry):
+        """Monotonic time an entry expires at"""
+
+        deadline = float('inf')
+        if self.idle_timeout:
+            deadline = entry.seen + self.idle_timeout
+        if self.hard_timeout:
+            deadline = min(deadline, entry.learned + self.hard_timeout)
+
+        return deadline
+
+    def _schedule(self, key, entry):
+        """Put an entry in the wheel slot of its deadline
+
+        Deadlines beyond the wheel size land in the last slot that is reached
+        before them; the entry is rescheduled when that slot is visited.
+        """
+
+        deadline = self._deadline(entry)
+        if deadline == float('inf'):
+            return
+
+        tick = max(int(deadline), self._tick + 1)
+        tick = min(tick, self._tick + WHEEL_SIZE)
+        self._wheel[tick % WHEEL_SIZE].add(key)
+
+    def _release(self, entry):
+        count = self._port_count.get(entry.port, 0) - 1
+        if count > 0:
+            self._port_count[entry.port] = count
+        else:
+            self._port_count.pop(entry.port, None)
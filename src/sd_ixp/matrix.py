@@ -0,0 +1,218 @@
+# Copyright (C) 2018 [SD]RSiX Project
+#
+# Licensed under the Apache License, Version 2.0 (the “License”);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an “AS IS” BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""AS-to-AS traffic matrix
+
+Built from the counters of the accounting entries (see sd_ixp.compiler): each
+entry counts the frames from a member MAC to another member MAC on the switch
+the source member is connected to. Every flow stats sample adds the byte
+increments of those entries to a dense AS x AS matrix of the current time
+bucket; a ring of buckets keeps the history, so totals over a window are the
+sum of its buckets.
+
+Memory is buckets x members² x 8 bytes: 60 buckets of 200 members take about
+19 MB.
+"""
+
+import time
+
+import numpy as np
+
+from sd_ixp import compiler
+from sd_ixp import stats
+
+# Default seconds per bucket and number of buckets (one hour of history)
+DEFAULT_BUCKET = 60
+DEFAULT_BUCKETS = 60
+
+
+class TrafficMatrix:
+    """Bytes sent between members, per time bucket
+
+    Attributes:
+        asns (list): AS number of each row and column
+        bucket (int): seconds per bucket
+        table_id (int): the accounting table
+        _index (dictionary): row of each AS number
+        _macs (dictionary): AS number of each member MAC
+        _version (int): incremented when members change
+        _matrix (numpy.ndarray): bytes, shape (buckets, members, members)
+        _numbers (numpy.ndarray): time bucket number held by each slot
+        _columns (dictionary): per switch mapping of flow columns to rows
+    """
+
+    def __init__(self, bucket=DEFAULT_BUCKET, buckets=DEFAULT_BUCKETS,
+                 table_id=compiler.ACCOUNT_TABLE):
+        self.asns = []
+        self.bucket = bucket
+        self.table_id = table_id
+
+        # Structure: { ASN, row }
+        self._index = {}
+
+        # Structure: { MAC, ASN }
+        self._macs = {}
+        self._version = 0
+
+        self._matrix = np.zeros((buckets, 0, 0))
+        self._numbers = np.full(buckets, -1, np.int64)
+
+        # Structure: { datapath_id, (generation, version, src rows, dst rows) }
+        self._columns = {}
+
+    def add_member(self, member):
+        """Add a member (or update its MACs); its history is kept"""
+
+        for mac in [mac for mac, asn in self._macs.items()
+                    if asn == member.asn]:
+            del self._macs[mac]
+        for mac in member.macs:
+            self._macs[mac] = member.asn
+
+        if member.asn not in self._index:
+            self._index[member.asn] = len(self.asns)
+            self.asns.append(member.asn)
+
+            size = len(self.asns)
+            matrix = np.zeros((len(self._numbers), size, size))
+            matrix[:, :size - 1, :size - 1] = self._matrix
+            self._matrix = matrix
+
+        self._version += 1
+
+    def remove_member(self, asn):
+        """Stop counting a member's traffic (its history is kept)"""
+
+        for mac in [mac for mac, owner in self._macs.items() if owner == asn]:
+            del self._macs[mac]
+        self._version += 1
+
+    def forget_switch(self, dpid):
+        """Drop the cached flow columns of a switch that left the fabric"""
+        self._columns.pop(dpid, None)
+
+    def update(self, dpid, collector, now=None):
+        """Add the byte increments of the last flow stats sample of a switch
+
+        Args:
+            dpid (int): datapath id of the switch
+            collector (StatsCollector): the stats of the switch
+            now (float): time of the sample (defaults to the current time)
+        """
+
+        if now is None:
+            now = time.time()
+
+        src, dst = self._rows(dpid, collector)
+        counted = src >= 0
+        if not counted.any():
+            return
+
+        deltas = collector.flows.deltas()[
+            stats.FLOW_FIELDS.index('bytes')][:len(src)]
+
+        matrix = self._slot(now)
+        np.add.at(matrix, (src[counted], dst[counted]),
+                  deltas[counted].astype(np.float64))
+
+    def matrix(self, window, now=None):
+        """Bytes sent between members over the last window seconds
+
+        Returns:
+            numpy.ndarray: [source row, destination row] bytes (rows as in
+                asns)
+        """
+        return self._window(window, now).sum(axis=0)
+
+    def totals(self, window, now=None):
+        """Bytes sent and received by each member over a window
+
+        Returns:
+            dictionary: { ASN, (bytes sent, bytes received) }
+        """
+
+        matrix = self.matrix(window, now)
+        sent = matrix.sum(axis=1).tolist()
+        received = matrix.sum(axis=0).tolist()
+
+        return {asn: (sent[row], received[row])
+                for asn, row in self._index.items()}
+
+    def top_talkers(self, count=10, window=DEFAULT_BUCKET, now=None):
+        """Member pairs that exchanged the most bytes over a window
+
+        Returns:
+            list: (source ASN, destination ASN, bytes) tuples, largest first
+        """
+
+        matrix = self.matrix(window, now).ravel()
+        count = min(count, np.count_nonzero(matrix))
+        if count == 0:
+            return []
+
+        top = np.argpartition(matrix, -count)[-count:]
+        top = top[np.argsort(matrix[top])[::-1]]
+        size = len(self.asns)
+
+        return [(self.asns[i // size], self.asns[i % size], float(matrix[i]))
+                for i in top.tolist()]
+
+    def _rows(self, dpid, collector):
+        """Source and destination rows of the flow columns of a switch (-1 for
+        columns that are not accounting entries of known MACs)"""
+
+        series = collector.flows
+        cached = self._columns.get(dpid)
+        if (cached is not None and cached[0] == series.generation and
+                cached[1] == self._version):
+            return cached[2], cached[3]
+
+        src = np.full(len(series.keys), -1, np.intp)
+        dst = np.full(len(series.keys), -1, np.intp)
+
+        for column, info in collector.flow_info.items():
+            table_id, _, match = info
+            if table_id != self.table_id or column >= len(src):
+                continue
+
+            src_asn = self._macs.get(match.get('eth_src'))
+            dst_asn = self._macs.get(match.get('eth_dst'))
+            if src_asn is not None and dst_asn is not None:
+                src[column] = self._index[src_asn]
+                dst[column] = self._index[dst_asn]
+
+        self._columns[dpid] = (series.generation, self._version, src, dst)
+        return src, dst
+
+    def _slot(self, now):
+        """Matrix of the bucket of a time, cleared if it held an older one"""
+
+        number = int(now // self.bucket)
+        slot = number % len(self._numbers)
+
+        if self._numbers[slot] != number:
+            self._matrix[slot] = 0
+            self._numbers[slot] = number
+
+        return self._matrix[slot]
+
+    def _window(self, window, now):
+        if now is None:
+            now = time.time()
+
+        number = int(now // self.bucket)
+        first = number - max(1, int(np.ceil(window / self.bucket))) + 1
+        slots = (self._numbers >= first) & (self._numbers <= number)
+
+        return self._matrix[slots]
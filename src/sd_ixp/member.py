@@ -0,0 +1,148 @@
+# Copyright (C) 2018 [SD]RSiX Project
+#
+# Licensed under the Apache License, Version 2.0 (the “License”);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an “AS IS” BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""IXP member registry
+
+Members (Autonomous Systems) are declared in a JSON file:
+
+    {
+        "members": [
+            {
+                "asn": 65001,
+                "name": "Example AS",
+                "ports": [{"dpid": 1, "port": 3}],
+                "macs": ["00:00:5e:00:53:01"],
+                "vlans": []
+            }
+        ]
+    }
+
+"ports" lists the switch ports the member's routers are connected to, "macs"
+the MAC addresses the member may use and "vlans" the VLANs the member's ports
+carry tagged (an empty list means the ports are untagged).
+"""
+
+import json
+import os
+import re
+
+_MAC_RE = re.compile(r'^([0-9a-f]{2}:){5}[0-9a-f]{2}$')
+
+
+class Member:
+    """An Autonomous System connected to the IXP
+
+    Attributes:
+        asn (int): AS number
+        name (str): AS name
+        ports (tuple): (datapath_id, port number) pairs of the member's ports
+        macs (tuple): MAC addresses the member is allowed to use
+        vlans (tuple): VLAN ids the member's ports carry (empty if untagged)
+        generation (int): registry generation of the member, carried by the
+            cookies of its flow entries (set by IXP.add_member())
+    """
+
+    def __init__(self, asn, name='', ports=(), macs=(), vlans=()):
+        self.asn = int(asn)
+        self.name = name
+        self.ports = tuple((int(dpid), int(port)) for dpid, port in ports)
+        self.macs = tuple(normalize_mac(mac) for mac in macs)
+        self.vlans = tuple(int(vid) for vid in vlans)
+        self.generation = 0
+
+        for vid in self.vlans:
+            if not 0 < vid < 4095:
+                raise ValueError('AS%d: invalid VLAN id %d' % (self.asn, vid))
+
+    def __repr__(self):
+        return 'Member(asn=%d, ports=%r, macs=%r, vlans=%r)' % (
+            self.asn, self.ports, self.macs, self.vlans)
+
+    def ports_on(self, dpid):
+        """Port numbers of the member on the given switch"""
+        return [port for port_dpid, port in self.ports if port_dpid == dpid]
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build a Member from its registry (JSON) representation"""
+
+        try:
+            return cls(
+                asn=data['asn'],
+                name=data.get('name', ''),
+                ports=[(p['dpid'], p['port']) for p in data.get('ports', [])],
+                macs=data.get('macs', []),
+                vlans=data.get('vlans', []))
+        except (KeyError, TypeError) as e:
+            raise ValueError('invalid member %r: %s' % (data, e))
+
+    def to_dict(self):
+        """Registry (JSON) representation of the Member"""
+
+        return {
+            'asn': self.asn,
+            'name': self.name,
+            'ports': [{'dpid': dpid, 'port': port}
+                      for dpid, port in self.ports],
+            'macs': list(self.macs),
+            'vlans': list(self.vlans),
+        }
+
+
+def normalize_mac(mac):
+    """Return a MAC address in the lower case, colon separated format"""
+
+    normalized = mac.strip().lower().replace('-', ':')
+    if not _MAC_RE.match(normalized):
+        raise ValueError('invalid MAC address: %r' % (mac, ))
+
+    return normalized
+
+
+def load_members(path):
+    """Load the members declared in a registry file
+
+    Args:
+        path (str): path of the JSON registry
+
+    Returns:
+        list: Member objects
+    """
+
+    with open(path) as f:
+        data = json.load(f)
+
+    return [Member.from_dict(member) for member in data.get('members', [])]
+
+
+def save_registry(path, members, vlans=()):
+    """Write the member registry (and the VLANs provisioned between the
+    members, see sd_ixp.vlan) to a file, atomically
+
+    Args:
+        path (str): path of the JSON registry
+        members (iterable): Member objects
+        vlans (iterable): VLAN objects
+    """
+
+    data = {
+        'members': [member.to_dict() for member in members],
+        'vlans': [vlan.to_dict() for vlan in vlans],
+    }
+
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f, indent=4)
+        f.write('\n')
+    os.replace(tmp, path)
@@ -0,0 +1,432 @@
+# Copyright (C) 2018 [SD]RSiX Project
+#
+# Licensed under the Apache License, Version 2.0 (the “License”);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an “AS IS” BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Controller instrumentation
+
+Event handlers decorated with timed() are timed into a histogram per handler,
+and the subsystems count what they do in Counters. What already has a size
+(the event queue, the messages waiting to reach a switch, the counters the
+job queue keeps) is read by callbacks when the metrics are scraped, so it
+costs nothing in between.
+
+The metrics are served in the Prometheus text format by a small HTTP server
+bound to localhost (see serve()), along with a sampling profiler that is
+started and stopped on demand:
+
+    GET  /metrics           the metrics
+    POST /profile/start     start sampling the call stacks
+    POST /profile/stop      stop sampling, and reply the samples
+    GET  /profile           the samples taken so far
+
+Samples are replied in the collapsed stack format of the flame graph tools: a
+line per call stack, its frames (outermost first) separated by semicolons,
+followed by the number of samples taken in it.
+"""
+
+import bisect
+import collections
+import functools
+import os
+import signal
+import time
+
+from ryu.lib import hub
+
+# Default upper bounds (in seconds) of the buckets of the timing histograms
+DEFAULT_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+                   0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10)
+
+# Default seconds of CPU time between profiler samples
+DEFAULT_INTERVAL = 0.005
+
+# Frames kept of each sampled call stack (the innermost ones)
+MAX_DEPTH = 64
+
+# Kinds of metrics
+COUNTER = 'counter'
+GAUGE = 'gauge'
+HISTOGRAM = 'histogram'
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_clock = time.perf_counter
+
+
+class Counter:
+    """A value that only goes up, per combination of label values
+
+    Attributes:
+        name (str): metric name
+        help (str): description
+        labels (tuple): label names
+        _values (Counter): { tuple of label values, value }
+    """
+
+    kind = COUNTER
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = collections.Counter()
+
+    def inc(self, values=(), amount=1):
+        """Add to the counter of the given label values"""
+        self._values[values] += amount
+
+    def samples(self):
+        """(suffix, tuple of label values, value) of every sample"""
+        return [('', values, value) for values, value in self._values.items()]
+
+
+class Histogram:
+    """Distribution of observed values (e.g. durations) in buckets, per
+    combination of label values
+
+    Attributes:
+        name (str): metric name
+        help (str): description
+        labels (tuple): label names
+        _bounds (tuple): upper bounds of the buckets
+        _values (dictionary): { tuple of label values, [ observations per
+            bucket (the last one for those over every bound), sum ] }
+    """
+
+    kind = HISTOGRAM
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._bounds = tuple(sorted(buckets))
+        self._values = {}
+
+    def observe(self, values, value):
+        """Record a value for the given label values"""
+
+        entry = self._values.get(values)
+        if entry is None:
+            entry = self._values[values] = [0] * (len(self._bounds) + 2)
+
+        entry[bisect.bisect_left(self._bounds, value)] += 1
+        entry[-1] += value
+
+    def samples(self):
+        """(suffix, tuple of label values, value) of every sample, with the
+        bucket bound as the last label value of the _bucket samples"""
+
+        samples = []
+        for values, entry in self._values.items():
+            count = 0
+            for bound, observed in zip(self._bounds + ('+Inf', ), entry):
+                count += observed
+                samples.append(('_bucket', values + (bound, ), count))
+            samples.append(('_sum', values, entry[-1]))
+            samples.append(('_count', values, count))
+        return samples
+
+
+class Callback:
+    """Metric whose samples are read from a callable when it is scraped
+
+    Attributes:
+        name (str): metric name
+        help (str): description
+        kind (str): GAUGE or COUNTER
+        labels (tuple): label names
+        _callback (callable): returns { tuple of label values, value }
+    """
+
+    def __init__(self, name, help, kind, labels, callback):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labels = tuple(labels)
+        self._callback = callback
+
+    def samples(self):
+        return [('', values, value)
+                for values, value in self._callback().items()]
+
+
+class Registry:
+    """The metrics served by an exporter
+
+    A metric registered with the name of another replaces it (e.g. the
+    callbacks of an application started again).
+    """
+
+    def __init__(self):
+        # Structure: { name, metric }
+        self._metrics = collections.OrderedDict()
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=()):
+        """Register a Counter"""
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        """Register a Histogram"""
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name, help, labels, callback):
+        """Register a gauge read from callback() (see Callback)"""
+        return self.register(Callback(name, help, GAUGE, labels, callback))
+
+    def counters(self, name, help, labels, callback):
+        """Register counters kept elsewhere, read from callback() (see
+        Callback)"""
+        return self.register(Callback(name, help, COUNTER, labels, callback))
+
+    def render(self):
+        """The metrics in the Prometheus text exposition format"""
+
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append('# HELP %s %s' % (metric.name, _escape_help(
+                metric.help)))
+            lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+
+            for suffix, values, value in metric.samples():
+                labels = metric.labels
+                if suffix == '_bucket':
+                    labels += ('le', )
+                lines.append('%s%s%s %s' % (metric.name, suffix,
+                                            _labels(labels, values),
+                                            _number(value)))
+
+        lines.append('')
+        return '\n'.join(lines)
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, _escape_label(value))
+                             for name, value in zip(names, values))
+
+
+def _escape_label(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace(
+        '"', r'\"')
+
+
+def _escape_help(text):
+    return text.replace('\\', r'\\').replace('\n', r'\n')
+
+
+def _number(value):
+    if isinstance(value, float) and value.is_integer():
+        return repr(int(value)) if abs(value) < 2 ** 53 else repr(value)
+    return repr(value)
+
+
+# The registry of the controller
+REGISTRY = Registry()
+
+HANDLER_SECONDS = REGISTRY.histogram(
+    'rsix_handler_seconds', 'Time spent in event handlers', ('handler', ))
+
+
+def timed(handler):
+    """Decorator recording the time each call of a handler takes in
+    HANDLER_SECONDS, labelled with its qualified name (e.g.
+    Switch.l2_learning)
+
+    The attributes of the handler are kept, so it may be decorated with
+    set_ev_cls() before or after.
+    """
+
+    values = (handler.__qualname__, )
+    observe = HANDLER_SECONDS.observe
+
+    @functools.wraps(handler)
+    def wrapper(*args, **kwargs):
+        start = _clock()
+        try:
+            return handler(*args, **kwargs)
+        finally:
+            observe(values, _clock() - start)
+
+    return wrapper
+
+
+class SamplingProfiler:
+    """Statistical profiler that samples the call stack running at a fixed
+    interval of CPU time
+
+    The interval timer of the process (SIGPROF) interrupts the main thread,
+    which runs every green thread, so each sample is the stack of whatever
+    green thread was running; an idle controller is not sampled at all.
+
+    Attributes:
+        _interval (float): seconds of CPU time between samples
+        _samples (Counter): { tuple of code objects, samples }
+        _previous: the SIGPROF handler replaced while sampling
+        started (float): wall clock time sampling started (None if it is not
+            running)
+    """
+
+    def __init__(self, interval=DEFAULT_INTERVAL):
+        self._interval = interval
+        self._samples = collections.Counter()
+        self._previous = None
+        self.started = None
+
+    @property
+    def running(self):
+        return self.started is not None
+
+    def start(self):
+        """Start sampling, forgetting the previous samples
+
+        Raises:
+            RuntimeError: the platform has no interval timers
+        """
+
+        if not hasattr(signal, 'setitimer'):
+            raise RuntimeError('the platform has no interval timers')
+
+        if self.running:
+            return
+
+        self._samples.clear()
+        self._previous = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self._interval, self._interval)
+        self.started = time.time()
+
+    def stop(self):
+        """Stop sampling (the samples are kept)"""
+
+        if not self.running:
+            return
+
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self._previous or signal.SIG_DFL)
+        self._previous = None
+        self.started = None
+
+    def __len__(self):
+        """Number of samples taken"""
+        return sum(self._samples.values())
+
+    def collapsed(self):
+        """The samples in the collapsed stack format, most sampled first"""
+
+        return ''.join('%s %d\n' % (';'.join(_frame(code) for code in stack),
+                                    samples)
+                       for stack, samples in self._samples.most_common())
+
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None and len(stack) < MAX_DEPTH:
+            stack.append(frame.f_code)
+            frame = frame.f_back
+        stack.reverse()
+        self._samples[tuple(stack)] += 1
+
+
+def _frame(code):
+    return '%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename),
+                           code.co_firstlineno)
+
+
+class Exporter:
+    """WSGI application serving a Registry and a SamplingProfiler
+
+    Attributes:
+        registry (Registry): the metrics served
+        profiler (SamplingProfiler): the profiler toggled (None for no
+            profiling)
+    """
+
+    def __init__(self, registry=REGISTRY, profiler=None):
+        self.registry = registry
+        self.profiler = profiler
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        method = environ.get('REQUEST_METHOD', 'GET')
+
+        if path == '/metrics':
+            if method != 'GET':
+                return _respond(start_response, 405, 'use GET\n')
+            return _respond(start_response, 200, self.registry.render(),
+                            CONTENT_TYPE)
+
+        if path.startswith('/profile'):
+            return self._profile(start_response, method, path)
+
+        return _respond(start_response, 404, 'not found\n')
+
+    def _profile(self, start_response, method, path):
+        if self.profiler is None:
+            return _respond(start_response, 404, 'profiling is disabled\n')
+
+        action = {
+            ('GET', '/profile'): None,
+            ('POST', '/profile/start'): self.profiler.start,
+            ('POST', '/profile/stop'): self.profiler.stop,
+        }.get((method, path), False)
+
+        if action is False:
+            return _respond(start_response, 404, 'not found\n')
+
+        try:
+            if action is not None:
+                action()
+        except RuntimeError as e:
+            return _respond(start_response, 501, '%s\n' % e)
+
+        if path == '/profile/start':
+            return _respond(start_response, 200, 'sampling\n')
+
+        return _respond(start_response, 200, self.profiler.collapsed())
+
+
+_REASONS = {
+    200: 'OK',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    501: 'Not Implemented',
+}
+
+
+def _respond(start_response, status, body, content_type='text/plain'):
+    body = body.encode('utf-8')
+    start_response('%d %s' % (status, _REASONS[status]), [
+        ('Content-Type', content_type),
+        ('Content-Length', str(len(body))),
+    ])
+    return [body]
+
+
+def serve(host, port, registry=REGISTRY, profiler=None):
+    """Serve a Registry (and a SamplingProfiler) over HTTP
+
+    Args:
+        host (str): address to listen on (keep it local: the endpoint has no
+            authentication)
+        port (int): TCP port to listen on
+
+    Returns:
+        the green thread of the server
+    """
+
+    server = hub.WSGIServer((host, port), Exporter(registry, profiler))
+    return hub.spawn(server.serve_forever)
@@ -0,0 +1,347 @@
+# Copyright (C) 2018 [SD]RSiX Project
+#
+# Licensed under the Apache License, Version 2.0 (the “License”);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an “AS IS” BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Neighbor discovery (ARP and IPv6 ND) subsystem
+
+ARP requests and Neighbor Solicitations are the largest share of broadcast
+and multicast traffic on a route server LAN. The controller learns the
+IP-to-MAC bindings of the members from the ARP and ND messages it receives and
+answers the requests for known addresses itself (proxy ARP/ND), so that those
+requests are not flooded across the IXP fabric.
+
+Since the answers speak for the members, a binding is only learned when the
+registry allows its MAC on the port it came from (see IXP.neighbor_allowed),
+and a valid binding learned on a port is not taken over from another port.
+"""
+
+import time
+
+from ryu.lib.packet import packet
+from ryu.lib.packet import ethernet
+from ryu.lib.packet import arp
+from ryu.lib.packet import vlan
+from ryu.lib.packet import ipv6
+from ryu.lib.packet import icmpv6
+from ryu.lib.packet import in_proto
+
+from sd_ixp import template
+from sd_ixp.flow import OUTPUT
+
+# Default time (in seconds) a learned binding is valid without being refreshed
+# by a new ARP/ND message
+DEFAULT_TIMEOUT = 3600
+
+# Neighbor Advertisement flags (RFC 4861): Router and Solicited. The Override
+# flag is not set because the controller answers as a proxy, and the Router
+# flag only if the owner of the address advertised it.
+ND_FLAG_ROUTER = 0b100
+ND_FLAG_SOLICITED = 0b010
+
+# IPv6 unspecified address, used as source by Duplicate Address Detection
+IPV6_UNSPECIFIED = '::'
+
+
+class Neighbor:
+    """A learned IP-to-MAC binding and where the MAC is connected
+
+    Attributes:
+        ip (str): IPv4 or IPv6 address
+        mac (str): MAC address the IP address resolves to
+        dpid (int): datapath id of the switch the MAC was learned on
+        port (int): port of the switch the MAC was learned on
+        vlan (int): VLAN id the binding was learned on (None if untagged)
+        expires (float): monotonic time the binding expires at
+        router (bool): whether the owner advertised itself as a router (the
+            Router flag of its Neighbor Advertisements)
+    """
+
+    __slots__ = ('ip', 'mac', 'dpid', 'port', 'vlan', 'expires', 'router')
+
+    def __init__(self, ip, mac, dpid, port, vlan, expires, router=False):
+        self.ip = ip
+        self.mac = mac
+        self.dpid = dpid
+        self.port = port
+        self.vlan = vlan
+        self.expires = expires
+        self.router = router
+
+
+class NeighborTable:
+    """Indexed ARP/ND table with proxy replies
+
+    Bindings are stored in a dictionary indexed by IP address, so looking up,
+    learning and refreshing a binding are O(1) operations. Expired bindings
+    are ignored on lookup and removed by purge().
+
+    Attributes:
+        _neighbors (dictionary): maps IP addresses to Neighbor objects
+        _timeout (int): seconds a binding is valid without being refreshed
+        listener (callable): called with each new or changed binding
+        allowed (callable): called as allowed(mac, dpid, port), tells whether
+            a MAC may be bound from a switch port (every MAC may without it)
+        rejected (int): bindings not learned
+    """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, listener=None, allowed=None):
+
+        # Structure: { IP address, Neighbor }
+        self._neighbors = {}
+
+        self._timeout = timeout
+        self.listener = listener
+        self.allowed = allowed
+        self.rejected = 0
+
+    def __len__(self):
+        return len(self._neighbors)
+
+    def __iter__(self):
+        return iter(self._neighbors.values())
+
+    def lookup(self, ip):
+        """Return the valid binding of an IP address, or None"""
+
+        entry = self._neighbors.get(ip)
+        if entry is None:
+            return None
+
+        if entry.expires < time.monotonic():
+            del self._neighbors[ip]
+            return None
+
+        return entry
+
+    def learn(self, ip, mac, dpid, port, vlan_id=None, notify=True,
+              router=None):
+        """Learn (or refresh) an IP-to-MAC binding
+
+        The binding is not learned if the registry does not allow the MAC on
+        the port (see allowed). A valid binding keeps the location where it
+        was learned first, so that copies of a message flooded through other
+        switches of the fabric do not move it, and only a message from that
+        same port changes its MAC address; otherwise it is replaced once it
+        expires.
+
+        New bindings are passed to the listener, if there is one and notify
+        is set (it is not for bindings replicated from other nodes).
+
+        Args:
+            router (bool): Router flag of a Neighbor Advertisement (None
+                keeps the flag known for the binding)
+
+        Returns:
+            Neighbor: the binding, or None if it was not learned
+        """
+
+        if self.allowed is not None and not self.allowed(mac, dpid, port):
+            self.rejected += 1
+            return None
+
+        expires = time.monotonic() + self._timeout
+        entry = self.lookup(ip)
+
+        if entry is not None and entry.mac == mac:
+            entry.expires = expires
+            if router is None or router == entry.router:
+                return entry
+            entry.router = router
+        elif entry is not None and (entry.dpid, entry.port) != (dpid, port):
+            self.rejected += 1
+            return None
+        else:
+            entry = Neighbor(ip, mac, dpid, port, vlan_id, expires,
+                             bool(router))
+            self._neighbors[ip] = entry
+
+        if notify and self.listener is not None:
+            self.listener(entry)
+
+        return entry
+
+    def restore(self, ip, mac, dpid, port, vlan_id, expires):
+        """Insert a binding saved earlier (e.g. by a snapshot)
+
+        Args:
+            expires (float): monotonic time the binding expires at
+        """
+
+        if expires > time.monotonic() and ip not in self._neighbors:
+            self._neighbors[ip] = Neighbor(ip, mac, dpid, port, vlan_id,
+                                           expires)
+
+    def forget(self, ip):
+        """Remove the binding of an IP address"""
+        self._neighbors.pop(ip, None)
+
+    def purge(self):
+        """Remove expired bindings
+
+        Returns:
+            int: number of bindings removed
+        """
+
+        now = time.monotonic()
+        expired = [ip for ip, entry in self._neighbors.items()
+                   if entry.expires < now]
+        for ip in expired:
+            del self._neighbors[ip]
+
+        return len(expired)
+
+    def discovery_handler(self, msg, flood=None, send_msg=None):
+        """Handle ARP and Neighbor Solicitation/Advertisement PacketIns
+
+        Learn the sender's binding and, for requests of known addresses, answer
+        on behalf of the target with a PacketOut through the port the request
+        came in. Anything else is flooded as the switch would do.
+
+        Args:
+            msg (OFPPacketIn): the PacketIn message
+            flood (callable): called as flood(msg, vlan_id) to flood the
+                messages not answered (e.g. Switch.flood); by default they go
+                through every port
+            send_msg (callable): called with the PacketOut of the answers
+                (e.g. Switch.send_msg); Datapath.send_msg by default
+        """
+
+        datapath = msg.datapath
+        in_port = msg.match['in_port']
+
+        pkt = packet.Packet(msg.data)
+        eth = pkt.get_protocols(ethernet.ethernet)[0]
+        vlans = pkt.get_protocols(vlan.vlan)
+        vlan_id = vlans[0].vid if vlans else None
+
+        arp_pkt = pkt.get_protocol(arp.arp)
+        if arp_pkt:
+            reply = self._arp_handler(eth, vlans, arp_pkt, datapath.id, in_port,
+                                      vlan_id)
+        else:
+            reply = self._nd_handler(pkt, eth, vlans, datapath.id, in_port,
+                                     vlan_id)
+
+        if reply is not None:
+            _packet_out(datapath, datapath.ofproto.OFPP_CONTROLLER,
+                        datapath.ofproto.OFP_NO_BUFFER, in_port, reply.data,
+                        send_msg)
+        elif flood is not None:
+            flood(msg, vlan_id)
+        else:
+            _flood(datapath, msg, in_port)
+
+    def _arp_handler(self, eth, vlans, arp_pkt, dpid, in_port, vlan_id):
+        """Learn from an ARP message and build the reply for known targets"""
+
+        # The sender of both requests and replies (including gratuitous ARP)
+        # announces its own binding
+        if arp_pkt.src_ip != '0.0.0.0':
+            self.learn(arp_pkt.src_ip, arp_pkt.src_mac, dpid, in_port, vlan_id)
+
+        if arp_pkt.opcode != arp.ARP_REQUEST:
+            return None
+
+        target = self.lookup(arp_pkt.dst_ip)
+        if target is None or target.mac == arp_pkt.src_mac:
+            return None
+
+        reply = packet.Packet()
+        reply.add_protocol(ethernet.ethernet(
+            ethertype=eth.ethertype, dst=arp_pkt.src_mac, src=target.mac))
+        for v in vlans:
+            reply.add_protocol(v)
+        reply.add_protocol(arp.arp(
+            opcode=arp.ARP_REPLY,
+            src_mac=target.mac,
+            src_ip=target.ip,
+            dst_mac=arp_pkt.src_mac,
+            dst_ip=arp_pkt.src_ip))
+        reply.serialize()
+
+        return reply
+
+    def _nd_handler(self, pkt, eth, vlans, dpid, in_port, vlan_id):
+        """Learn from an NS/NA message and build the NA for known targets"""
+
+        ip6 = pkt.get_protocol(ipv6.ipv6)
+        icmp6 = pkt.get_protocol(icmpv6.icmpv6)
+        if ip6 is None or icmp6 is None:
+            return None
+
+        nd = icmp6.data
+
+        if icmp6.type_ == icmpv6.ND_NEIGHBOR_ADVERT:
+            # The advertisement carries the binding of its target address
+            mac = _link_layer_address(nd, icmpv6.nd_option_tla) or eth.src
+            self.learn(nd.dst, mac, dpid, in_port, vlan_id,
+                       router=bool(nd.res & ND_FLAG_ROUTER))
+            return None
+
+        # Duplicate Address Detection solicitations (sent from the unspecified
+        # address) must reach the owner of the address, if any.
+        if ip6.src == IPV6_UNSPECIFIED:
+            return None
+
+        mac = _link_layer_address(nd, icmpv6.nd_option_sla) or eth.src
+        self.learn(ip6.src, mac, dpid, in_port, vlan_id)
+
+        target = self.lookup(nd.dst)
+        if target is None or target.mac == mac:
+            return None
+
+        reply = packet.Packet()
+        reply.add_protocol(ethernet.ethernet(
+            ethertype=eth.ethertype, dst=mac, src=target.mac))
+        for v in vlans:
+            reply.add_protocol(v)
+        reply.add_protocol(ipv6.ipv6(
+            nxt=in_proto.IPPROTO_ICMPV6, src=target.ip, dst=ip6.src))
+        reply.add_protocol(icmpv6.icmpv6(
+            type_=icmpv6.ND_NEIGHBOR_ADVERT,
+            data=icmpv6.nd_neighbor(
+                res=(ND_FLAG_ROUTER if target.router else 0) |
+                ND_FLAG_SOLICITED,
+                dst=target.ip,
+                option=icmpv6.nd_option_tla(hw_src=target.mac))))
+        reply.serialize()
+
+        return reply
+
+
+def _link_layer_address(nd, option_cls):
+    """Return the link-layer address ND option of the given class, if any"""
+
+    if isinstance(nd.option, option_cls):
+        return nd.option.hw_src
+    return None
+
+
+def _packet_out(datapath, in_port, buffer_id, out_port, data,
+                send_msg=None):
+    """Send a PacketOut through a single port"""
+
+    (send_msg or datapath.send_msg)(template.packet_out(
+        datapath, buffer_id, in_port, [(OUTPUT, out_port)], data))
+
+
+def _flood(datapath, msg, in_port):
+    """Flood a PacketIn the controller does not answer itself"""
+
+    ofproto = datapath.ofproto
+
+    data = None
+    if msg.buffer_id == ofproto.OFP_NO_BUFFER:
+        data = msg.data
+
+    _packet_out(datapath, in_port, msg.buffer_id, ofproto.OFPP_FLOOD, data)
@@ -0,0 +1,285 @@
+# Copyright (C) 2018 [SD]RSiX Project
+#
+# Licensed under the Apache License, Version 2.0 (the “License”);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an “AS IS” BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Outbound buffer of a switch connection
+
+Ryu writes every message sent with Datapath.send_msg() to the socket on its
+own, through a queue of 16 messages per switch whose senders block while it is
+full. Once the TCP window of a slow switch fills, the thread sending to it
+stops, and for an application that is the event thread of every switch.
+
+A Switch sends through an OutboundBuffer instead. Messages are serialized when
+they are queued, into one of four lanes:
+
+    CONTROL     requests to become the master of the switch
+    PACKET      PacketOuts
+    BULK        FlowMods, GroupMods, MeterMods, bundles, the barriers after
+                them and the requests that must follow them (the FlowQueue,
+                and the requests to give up the master role)
+    PROBE       LLDP frames and stats polls, repeated periodically
+
+A writer green thread drains the lanes in that order, joining the messages
+queued into writes of up to max_write bytes, so a PacketOut never waits behind
+a replay of the flow table. The order of the messages of a lane is kept.
+As PacketOuts overtake the GroupMods queued, they only use the groups the
+switch confirmed it has (see Switch.flood()).
+Writing to Ryu blocks the writer only: a slow switch fills its buffer instead
+of stalling the application.
+
+The buffer holds up to max_bytes. When it is full, PROBE messages and
+PacketOuts are shed: new ones are dropped, and the queued ones are evicted
+(oldest first) to make room for the other lanes. CONTROL and BULK messages are
+never dropped (the FlowQueue and the shadow table count on every FlowMod
+reaching the switch); their producers are held back instead. The PacketIn
+path checks congested() and drops the work that would create them. A
+Switch.sync() reprogramming the switch checks has_room() before it sends its
+changes: in the Ryu event thread, which must never block, the sync is deferred
+with when_room() and run once the writer has drained those lanes below
+max_bytes (the latest sync replaces those still deferred); a producer of its
+own thread (the registry changes of sd_ixp.jobs) waits in wait_room()
+instead. A sync is never held back halfway, so the lanes hold at most
+max_bytes plus the changes of a sync.
+"""
+
+import collections
+
+from ryu.lib import hub
+
+# Lanes, in the order they are written
+CONTROL = 0
+PACKET = 1
+BULK = 2
+PROBE = 3
+
+LANES = ('control', 'packet', 'bulk', 'probe')
+
+# Lanes whose messages are shed when the buffer is full, in the order they
+# are evicted to make room
+_SHED = (PROBE, PACKET)
+_SHEDS = tuple(lane in _SHED for lane in range(len(LANES)))
+
+# Default bytes buffered per switch
+DEFAULT_MAX_BYTES = 1024 * 1024
+
+# Default largest write (a single message may be larger)
+DEFAULT_MAX_WRITE = 64 * 1024
+
+
+class OutboundBuffer:
+    """Bounded, prioritized buffer of the messages sent to a switch
+
+    Attributes:
+        _datapath (ev.msg.datapath): connection to the switch
+        _max_bytes (int): bytes buffered before messages are shed
+        _max_write (int): bytes joined into a single write
+        _lanes (list): a deque of serialized messages per lane
+        _bytes (int): bytes buffered
+        _held (int): bytes buffered in the lanes that are never shed
+        _wakeup (hub.Event): set when messages are queued to an idle writer
+        _idle (bool): whether the writer waits for _wakeup
+        _room (hub.Event): set when the writer drained the lanes that are
+            never shed, for the producers waiting in wait_room()
+        _room_callbacks (list): callables to run then (see when_room())
+        _waiting (bool): whether producers wait for _room
+        _thread: the writer green thread (None once closed)
+        shed (list): messages shed per lane
+        stalls (int): times a producer waited, or was deferred, for room
+        writes (int): writes sent to the connection
+    """
+
+    def __init__(self, datapath, max_bytes=DEFAULT_MAX_BYTES,
+                 max_write=DEFAULT_MAX_WRITE):
+        self._datapath = datapath
+        self._max_bytes = max_bytes
+        self._max_write = max_write
+
+        self._lanes = [collections.deque() for _ in LANES]
+        self._bytes = 0
+        self._held = 0
+
+        self._wakeup = hub.Event()
+        self._idle = False
+
+        self._room = hub.Event()
+        self._room_callbacks = []
+        self._waiting = False
+
+        self.shed = [0] * len(LANES)
+        self.stalls = 0
+        self.writes = 0
+
+        self._thread = hub.spawn(self._writer)
+
+    def __len__(self):
+        """Number of messages buffered"""
+        return sum(len(lane) for lane in self._lanes)
+
+    @property
+    def bytes(self):
+        """Number of bytes buffered"""
+        return self._bytes
+
+    def congested(self):
+        """Whether the buffer is full (PacketOuts and probes are shed)"""
+        return self._bytes >= self._max_bytes
+
+    def has_room(self):
+        """Whether the lanes that are never shed hold less than max_bytes"""
+        return self._held < self._max_bytes
+
+    def wait_room(self):
+        """Wait until the lanes that are never shed hold less than max_bytes
+
+        Never call it from the Ryu event thread (see when_room()).
+
+        Returns:
+            bool: False if the buffer is closed
+        """
+
+        if self._held >= self._max_bytes and self._thread is not None:
+            self.stalls += 1
+
+        while self._held >= self._max_bytes and self._thread is not None:
+            self._waiting = True
+            self._room.clear()
+            self._room.wait()
+
+        return self._thread is not None
+
+    def when_room(self, callback):
+        """Call callback() in a green thread of its own once the lanes that
+        are never shed hold less than max_bytes
+
+        The callback is dropped if the buffer closes first.
+        """
+
+        if self._thread is None:
+            return
+
+        if self.has_room():
+            hub.spawn(callback)
+            return
+
+        self.stalls += 1
+        self._room_callbacks.append(callback)
+        self._waiting = True
+
+    def put(self, msg, lane):
+        """Serialize a message and queue it to a lane
+
+        Args:
+            msg: OpenFlow message (an xid is assigned if it has none)
+            lane (int): CONTROL, PACKET, BULK or PROBE
+
+        Returns:
+            bool: False if the message was shed (or the buffer is closed)
+        """
+
+        full = self._bytes >= self._max_bytes
+        if (full and _SHEDS[lane]) or self._thread is None:
+            self.shed[lane] += 1
+            return False
+
+        if msg.xid is None:
+            self._datapath.set_xid(msg)
+        msg.serialize()
+
+        self._lanes[lane].append(msg.buf)
+        self._bytes += len(msg.buf)
+        if not _SHEDS[lane]:
+            self._held += len(msg.buf)
+
+        if full:
+            self._evict()
+
+        if self._idle:
+            self._idle = False
+            self._wakeup.set()
+
+        return True
+
+    def close(self):
+        """Stop writing and drop the messages buffered"""
+
+        if self._thread is not None:
+            if self._thread is not hub.getcurrent():
+                hub.kill(self._thread)
+            self._thread = None
+
+        for lane in self._lanes:
+            lane.clear()
+        self._bytes = 0
+        self._held = 0
+
+        # Producers waiting for room give up
+        self._room_callbacks = []
+        self._room.set()
+
+    def _evict(self):
+        """Drop the oldest messages of the lanes that shed until the buffer
+        is back within its size"""
+
+        for lane in _SHED:
+            queue = self._lanes[lane]
+            while queue and self._bytes > self._max_bytes:
+                self._bytes -= len(queue.popleft())
+                self.shed[lane] += 1
+
+    def _take(self):
+        """Dequeue the messages of the next write, joined"""
+
+        bufs = []
+        size = 0
+        for lane, queue in enumerate(self._lanes):
+            start = size
+            while queue and (not bufs or
+                             size + len(queue[0]) <= self._max_write):
+                buf = queue.popleft()
+                bufs.append(buf)
+                size += len(buf)
+
+            if not _SHEDS[lane]:
+                self._held -= size - start
+
+            # A later lane must not go before the messages left in this one
+            if queue:
+                break
+
+        self._bytes -= size
+
+        if self._waiting and self._held < self._max_bytes:
+            self._waiting = False
+            self._room.set()
+
+            callbacks, self._room_callbacks = self._room_callbacks, []
+            for callback in callbacks:
+                hub.spawn(callback)
+
+        return b''.join(bufs)
+
+    def _writer(self):
+        while True:
+            data = self._take()
+            if not data:
+                self._idle = True
+                self._wakeup.clear()
+                self._wakeup.wait()
+                continue
+
+            # Blocks while Ryu's send queue of the switch is full
+            self.writes += 1
+            if not self._datapath.send(data):
+                # The connection is closing
+                self.close()
+                return
@@ -0,0 +1,140 @@
+# Copyright (C) 2018 [SD]RSiX Project
+#
+# Licensed under the Apache License, Version 2.0 (the “License”);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an “AS IS” BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""PacketIn rate limiter
+
+Every frame a switch does not know what to do with goes to the controller, so
+a loop or a broadcast storm on a single member port can flood the controller
+with PacketIns. The limiter keeps a token bucket per (datapath id, in_port):
+PacketIns over the budget are dropped before any processing, and the first
+drop of a burst "trips" the port so that the application can push a storm
+guard (a meter or a temporary drop entry) to the switch.
+"""
+
+import time
+
+# Results of PacketInLimiter.check()
+ALLOW = 0
+DROP = 1
+TRIP = 2
+
+# Default budget per port: sustained PacketIns per second and burst size
+DEFAULT_RATE = 100
+DEFAULT_BURST = 200
+
+
+class TokenBucket:
+    """Token bucket of a port
+
+    Attributes:
+        tokens (float): available tokens
+        last (float): monotonic time the bucket was last refilled
+        tripped (bool): whether the port is over budget
+        allowed (int): PacketIns allowed
+        dropped (int): PacketIns dropped
+        trips (int): times the port went over budget
+    """
+
+    __slots__ = ('tokens', 'last', 'tripped', 'allowed', 'dropped', 'trips')
+
+    def __init__(self, tokens, now):
+        self.tokens = tokens
+        self.last = now
+        self.tripped = False
+        self.allowed = 0
+        self.dropped = 0
+        self.trips = 0
+
+
+class PacketInLimiter:
+    """Token bucket limiter of PacketIns per (datapath id, in_port)
+
+    Attributes:
+        rate (float): tokens added per second
+        burst (float): bucket size
+        _buckets (dictionary): TokenBucket objects indexed by (dpid, port)
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST):
+        self.rate = rate
+        self.burst = burst
+
+        # Structure: { (datapath_id, port), TokenBucket }
+        self._buckets = {}
+
+    def check(self, dpid, port, now=None):
+        """Take a token for a PacketIn
+
+        Args:
+            dpid (int): datapath id of the switch that sent the PacketIn
+            port (int): in_port of the PacketIn
+            now (float): monotonic time (defaults to the current time)
+
+        Returns:
+            int: ALLOW, DROP, or TRIP for the first drop after the port was
+                within its budget
+        """
+
+        if now is None:
+            now = time.monotonic()
+
+        bucket = self._buckets.get((dpid, port))
+        if bucket is None:
+            bucket = self._buckets[(dpid, port)] = TokenBucket(self.burst, now)
+        else:
+            bucket.tokens = min(
+                self.burst, bucket.tokens + (now - bucket.last) * self.rate)
+            bucket.last = now
+
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            bucket.allowed += 1
+            # The port is back within its budget once the bucket has refilled
+            if bucket.tripped and bucket.tokens >= self.burst / 2:
+                bucket.tripped = False
+            return ALLOW
+
+        bucket.dropped += 1
+        if bucket.tripped:
+            return DROP
+
+        bucket.tripped = True
+        bucket.trips += 1
+        return TRIP
+
+    def forget(self, dpid, port=None):
+        """Remove the buckets of a port, or of every port of a switch"""
+
+        if port is not None:
+            self._buckets.pop((dpid, port), None)
+            return
+
+        for key in [key for key in self._buckets if key[0] == dpid]:
+            del self._buckets[key]
+
+    def counters(self):
+        """Counters of every port
+
+        Returns:
+            dictionary: { (datapath_id, port), { counter name, value } }
+        """
+
+        return {
+            key: {
+                'allowed': bucket.allowed,
+                'dropped': bucket.dropped,
+                'trips': bucket.trips,
+            }
+            for key, bucket in self._buckets.items()
+        }
@@ -0,0 +1,241 @@
+# Copyright (C) 2018 [SD]RSiX Project
+#
+# Licensed under the Apache License, Version 2.0 (the “License”);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an “AS IS” BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Snapshot of the learned state, for fast restarts
+
+A restarted controller knows no MAC and no neighbor, so every switch would
+flood it with PacketIns until everything is learned again, and reprogramming a
+switch would even delete the learned entries it still has. The app saves the
+learned MAC tables, the neighbor table and the shadow flow tables
+periodically; on restart the neighbors are restored right away and each
+switch gets its MACs and shadow table back when it connects, so it is
+reconciled with what it already has instead of starting cold.
+
+The file is binary: a header, fixed-size MAC and neighbor records, and the
+shadow flows (plain Python values) as JSON, which, unlike marshal or pickle,
+does not depend on the Python version and can not run code. It is read through
+mmap. Times are saved as ages relative to the wall clock time of the snapshot,
+since monotonic times do not survive a restart.
+
+A file that does not pass the checks (magic, version, record counts matching
+its size, well formed records and flows) raises ValueError, whatever is wrong
+with it, so a truncated or corrupt snapshot only costs the warm restart.
+
+    header      magic, version, wall time, number of MACs, number of
+                neighbors, size of the flows
+    MACs        (dpid, MAC, port, VLAN, age, idle time) records
+    neighbors   (family, IP, MAC, dpid, port, VLAN, time to live) records
+    flows       JSON of [ [ dpid, [ Flow fields ] ] ]
+"""
+
+import json
+import mmap
+import os
+import socket
+import struct
+import time
+
+from sd_ixp.flow import Flow
+
+MAGIC = b'RSIXSNAP'
+VERSION = 3
+
+_HEADER = struct.Struct('!8sHdIII')
+_MAC = struct.Struct('!QQIHdd')
+_NEIGHBOR = struct.Struct('!B16s6sQIHd')
+
+# Address families of the neighbor records
+_IPV4 = 4
+_IPV6 = 6
+
+
+class Snapshot:
+    """Learned state loaded from a snapshot file
+
+    Times are converted back to monotonic times.
+
+    Attributes:
+        taken (float): wall clock time the snapshot was taken
+        macs (dictionary): { datapath_id, [ (mac, vlan, port, learned, seen) ] }
+        neighbors (list): (ip, mac, dpid, port, vlan, expires) tuples
+        flows (dictionary): { datapath_id, [ Flow ] }
+    """
+
+    def __init__(self, taken):
+        self.taken = taken
+        self.macs = {}
+        self.neighbors = []
+        self.flows = {}
+
+    def pop_switch(self, dpid):
+        """MAC entries and shadow flows of a switch (used only once)
+
+        Returns:
+            tuple: (list of MAC tuples, list of Flow objects)
+        """
+        return self.macs.pop(dpid, []), self.flows.pop(dpid, [])
+
+
+def save(path, switches, neighbors):
+    """Write the learned state to a snapshot file (atomically)
+
+    Args:
+        path (str): file to write
+        switches (iterable): Switch objects
+        neighbors (NeighborTable): the neighbor table
+    """
+
+    wall = time.time()
+    now = time.monotonic()
+
+    macs = []
+    flows = []
+    for switch in switches:
+        entries, shadow = switch.learned_state()
+        for entry in entries:
+            macs.append(_MAC.pack(switch.dpid, entry.mac, entry.port,
+                                  entry.vlan or 0, now - entry.learned,
+                                  now - entry.seen))
+
+        flows.append((switch.dpid, [
+            (flow.table_id, flow.priority, flow.match, flow.instructions,
+             flow.idle_timeout, flow.hard_timeout, flow.cookie)
+            for flow in shadow]))
+
+    records = []
+    for entry in neighbors:
+        ttl = entry.expires - now
+        if ttl <= 0:
+            continue
+
+        if ':' in entry.ip:
+            family, ip = _IPV6, socket.inet_pton(socket.AF_INET6, entry.ip)
+        else:
+            family, ip = _IPV4, socket.inet_pton(socket.AF_INET, entry.ip)
+
+        records.append(_NEIGHBOR.pack(
+            family, ip, bytes.fromhex(entry.mac.replace(':', '')),
+            entry.dpid, entry.port, entry.vlan or 0, ttl))
+
+    blob = json.dumps(flows, separators=(',', ':')).encode()
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, wall, len(macs), len(records),
+                             len(blob)))
+        f.write(b''.join(macs))
+        f.write(b''.join(records))
+        f.write(blob)
+    os.replace(tmp, path)
+
+
+def load(path, max_age=None):
+    """Read a snapshot file
+
+    Args:
+        path (str): file to read
+        max_age (float): ignore snapshots older than this (seconds)
+
+    Returns:
+        Snapshot: the state, or None if there is no (usable) snapshot
+
+    Raises:
+        ValueError: the file is not a snapshot, or it is truncated or corrupt
+    """
+
+    if not os.path.exists(path) or not os.path.getsize(path):
+        return None
+
+    with open(path, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+
+        if len(data) < _HEADER.size:
+            raise ValueError('%s: truncated snapshot' % path)
+
+        magic, version, wall, n_macs, n_neighbors, n_flows = \
+            _HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('%s: not a snapshot (version %d)' % (path,
+                                                                   VERSION))
+
+        size = (_HEADER.size + n_macs * _MAC.size +
+                n_neighbors * _NEIGHBOR.size + n_flows)
+        if len(data) != size:
+            raise ValueError('%s: %d bytes, the header describes %d' % (
+                path, len(data), size))
+
+        elapsed = time.time() - wall
+        if elapsed < 0 or (max_age is not None and elapsed > max_age):
+            return None
+
+        view = memoryview(data)
+        try:
+            return _decode(view, wall, elapsed, n_macs, n_neighbors)
+        except (ValueError, TypeError, KeyError, IndexError, OSError,
+                struct.error) as e:
+            # json.JSONDecodeError and UnicodeDecodeError are ValueErrors
+            raise ValueError('%s: corrupt snapshot (%s)' % (path, e))
+        finally:
+            view.release()
+
+
+def _tuples(value):
+    """Turn the lists JSON decodes back into the tuples of a Flow"""
+
+    if isinstance(value, list):
+        return tuple(_tuples(item) for item in value)
+    return value
+
+
+def _decode(view, wall, elapsed, n_macs, n_neighbors):
+    """Decode the records and flows of a snapshot (after its header)"""
+
+    # Saved ages are relative to the snapshot; now they are older
+    now = time.monotonic() - elapsed
+    snapshot = Snapshot(wall)
+
+    offset = _HEADER.size
+    end = offset + n_macs * _MAC.size
+    for dpid, mac, port, vlan, age, idle in _MAC.iter_unpack(
+            view[offset:end]):
+        snapshot.macs.setdefault(dpid, []).append(
+            (mac, vlan or None, port, now - age, now - idle))
+
+    offset = end
+    end = offset + n_neighbors * _NEIGHBOR.size
+    for family, ip, mac, dpid, port, vlan, ttl in \
+            _NEIGHBOR.iter_unpack(view[offset:end]):
+        if family == _IPV6:
+            ip = socket.inet_ntop(socket.AF_INET6, ip)
+        elif family == _IPV4:
+            ip = socket.inet_ntop(socket.AF_INET, ip[:4])
+        else:
+            raise ValueError('unknown address family %d' % family)
+
+        snapshot.neighbors.append(
+            (ip, ':'.join('%02x' % b for b in mac), dpid, port,
+             vlan or None, now + ttl))
+
+    for dpid, entries in json.loads(bytes(view[end:]).decode()):
+        snapshot.flows[dpid] = [
+            Flow(table_id, priority, dict(_tuples(match)),
+                 _tuples(instructions), idle, hard, cookie)
+            for table_id, priority, match, instructions, idle, hard, cookie
+            in entries]
+
+    return snapshot
@@ -0,0 +1,477 @@
+# Copyright (C) 2018 [SD]RSiX Project
+#
+# Licensed under the Apache License, Version 2.0 (the “License”);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an “AS IS” BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Port and flow statistics of a switch
+
+Every switch has a StatsCollector that polls port and flow stats on an
+adaptive schedule (faster while the traffic changes, slower while it is
+steady, with jitter so switches are not polled in lockstep) and keeps the
+samples in NumPy ring buffers: one CounterSeries for the ports and one for the
+flow entries, a column per port or entry.
+
+Counters are read straight from the reply buffers on OpenFlow 1.3 and 1.4 (the
+port stats of OpenFlow 1.3 are an array of fixed-size structures; flow stats
+entries are walked by their length only), so updating thousands of flow
+counters is a handful of array operations. After every sample the rates
+(per second) of the last interval are computed for all the columns at once and
+kept in the series, where the monitoring export reads them.
+"""
+
+import random
+import struct
+import time
+
+import numpy as np
+
+from ryu.ofproto import ofproto_v1_3, ofproto_v1_4
+
+# Default number of samples kept per series
+DEFAULT_CAPACITY = 64
+
+# Default bounds (in seconds) of the polling interval
+DEFAULT_MIN_INTERVAL = 5
+DEFAULT_MAX_INTERVAL = 60
+
+# Share of the interval the next poll is moved by, at random
+JITTER = 0.1
+
+# Relative change of the traffic of a switch that makes polling faster
+ADAPT_THRESHOLD = 0.1
+
+# Fields of the series
+PORT_FIELDS = ('rx_bytes', 'tx_bytes', 'rx_packets', 'tx_packets',
+               'rx_dropped', 'tx_dropped')
+FLOW_FIELDS = ('bytes', 'packets')
+
+# Kinds of stats requests
+PORT_STATS = 'port'
+FLOW_STATS = 'flow'
+
+# ofp_header and the multipart reply header before the body
+_MULTIPART_HEADER = 16
+
+# OpenFlow 1.3 ofp_port_stats (OFP_PORT_STATS_PACK_STR)
+_PORT_STATS_13 = np.dtype([
+    ('port_no', '>u4'), ('pad', 'V4'),
+    ('rx_packets', '>u8'), ('tx_packets', '>u8'),
+    ('rx_bytes', '>u8'), ('tx_bytes', '>u8'),
+    ('rx_dropped', '>u8'), ('tx_dropped', '>u8'),
+    ('rx_errors', '>u8'), ('tx_errors', '>u8'),
+    ('rx_frame_err', '>u8'), ('rx_over_err', '>u8'),
+    ('rx_crc_err', '>u8'), ('collisions', '>u8'),
+    ('duration_sec', '>u4'), ('duration_nsec', '>u4'),
+])
+
+# Offsets in ofp_flow_stats (OpenFlow 1.3 and 1.4) of the fields read
+_FLOW_TABLE_ID = 2
+_FLOW_PRIORITY = 12
+_FLOW_PACKETS = 32
+_FLOW_BYTES = 40
+_FLOW_MATCH = 48
+
+# Entry length, and match length (in the match header)
+_FLOW_LENGTHS = struct.Struct('!H%dxH' % (_FLOW_MATCH))
+
+# Bytes of a big-endian 64-bit counter
+_COUNTER_BYTES = np.arange(8)
+
+
+def _counters(raw, offsets):
+    """64-bit big-endian counters at the given offsets of a buffer"""
+    return raw[offsets[:, None] + _COUNTER_BYTES].view('>u8').ravel()
+
+
+class CounterSeries:
+    """Ring buffer of samples of counters, a column per counted object
+
+    Attributes:
+        fields (tuple): names of the counters of each column
+        keys (list): the object of each column (None for a free column)
+        rates (numpy.ndarray): per second rates of the last interval, shape
+            (fields, columns); zero for columns missing in either sample
+        generation (int): incremented whenever a column is assigned
+        _index (dictionary): column of each object
+        _free (list): columns of objects gone for the whole buffer
+        _times (numpy.ndarray): monotonic time of each sample
+        _values (numpy.ndarray): counters, shape (samples, fields, columns)
+        _present (numpy.ndarray): whether a column was in a sample
+        _head (int): row of the latest sample
+        _count (int): samples recorded (up to the capacity)
+    """
+
+    def __init__(self, fields, capacity=DEFAULT_CAPACITY, columns=64):
+        self.fields = fields
+        self.keys = []
+        self.rates = np.zeros((len(fields), 0))
+        self.generation = 0
+
+        # Structure: { object, column }
+        self._index = {}
+        self._free = []
+
+        self._times = np.zeros(capacity)
+        self._values = np.zeros((capacity, len(fields), columns), np.uint64)
+        self._present = np.zeros((capacity, columns), bool)
+        self._head = -1
+        self._count = 0
+
+    def __len__(self):
+        """Number of samples"""
+        return self._count
+
+    @property
+    def capacity(self):
+        return len(self._times)
+
+    def find(self, key):
+        """Column of an object, or None if it has none"""
+        return self._index.get(key)
+
+    def column(self, key):
+        """Column of an object, assigned on its first sample"""
+
+        col = self._index.get(key)
+        if col is not None:
+            return col
+
+        if self._free:
+            col = self._free.pop()
+            self.keys[col] = key
+        else:
+            col = len(self.keys)
+            self.keys.append(key)
+            if col == self._values.shape[2]:
+                self._grow()
+
+        self._index[key] = col
+        self.generation += 1
+        return col
+
+    def record(self, now, columns, values):
+        """Add a sample and compute the rates of the last interval
+
+        Args:
+            now (float): monotonic time of the sample
+            columns (numpy.ndarray): columns of the sampled objects
+            values (numpy.ndarray): their counters, shape (fields, columns)
+        """
+
+        prev = self._head
+        self._head = row = (self._head + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+        self._times[row] = now
+        self._values[row] = 0
+        self._values[row][:, columns] = values
+        self._present[row] = False
+        self._present[row][columns] = True
+
+        if self._count > 1:
+            self.rates = self._rates(prev, row)
+        else:
+            self.rates = np.zeros((len(self.fields), len(self.keys)))
+
+        # Once per lap of the buffer, free the columns of objects that were in
+        # none of its samples (e.g. flow entries of MACs that expired)
+        if row == self.capacity - 1:
+            self._reclaim()
+
+    def rates_over(self, samples):
+        """Per second rates between the latest sample and an older one
+
+        Args:
+            samples (int): how many samples back (1 is the last interval)
+
+        Returns:
+            numpy.ndarray: shape (fields, columns)
+        """
+
+        samples = min(samples, self._count - 1)
+        if samples < 1:
+            return np.zeros((len(self.fields), len(self.keys)))
+
+        return self._rates((self._head - samples) % self.capacity, self._head)
+
+    def latest(self):
+        """Counters of the latest sample, shape (fields, columns)"""
+
+        if self._count == 0:
+            return np.zeros((len(self.fields), len(self.keys)), np.uint64)
+        return self._values[self._head][:, :len(self.keys)]
+
+    def deltas(self):
+        """Counter increments of the last interval, shape (fields, columns)
+
+        Zero for columns missing in either sample.
+        """
+
+        if self._count < 2:
+            return np.zeros((len(self.fields), len(self.keys)), np.uint64)
+        return self._deltas((self._head - 1) % self.capacity, self._head)
+
+    def _deltas(self, old, new):
+        width = len(self.keys)
+        before = self._values[old][:, :width]
+        after = self._values[new][:, :width]
+
+        # A counter that went back was reset (e.g. the entry was reinstalled)
+        delta = np.where(after >= before, after - before, after)
+        both = self._present[old][:width] & self._present[new][:width]
+
+        return np.where(both, delta, 0)
+
+    def _rates(self, old, new):
+        elapsed = self._times[new] - self._times[old]
+        if elapsed <= 0:
+            return np.zeros((len(self.fields), len(self.keys)))
+
+        return self._deltas(old, new) / elapsed
+
+    def _grow(self):
+        columns = self._values.shape[2] * 2
+        values = np.zeros(self._values.shape[:2] + (columns, ), np.uint64)
+        values[:, :, :self._values.shape[2]] = self._values
+        present = np.zeros((self.capacity, columns), bool)
+        present[:, :self._present.shape[1]] = self._present
+
+        self._values = values
+        self._present = present
+
+    def _reclaim(self):
+        gone = ~self._present[:, :len(self.keys)].any(axis=0)
+        for col in np.flatnonzero(gone).tolist():
+            key = self.keys[col]
+            if key is not None:
+                del self._index[key]
+                self.keys[col] = None
+                self._free.append(col)
+
+
+class StatsCollector:
+    """Polling schedule and counter series of a switch
+
+    Attributes:
+        ports (CounterSeries): port counters, a column per port number
+        flows (CounterSeries): flow entry counters, a column per entry
+        flow_info (dictionary): (table_id, priority, match dictionary) of the
+            flow entry of each column
+        interval (float): current polling interval
+        next_poll (float): monotonic time of the next poll
+        _pending (dictionary): requests waiting for their (last) reply
+        _sent (float): monotonic time the pending requests were sent
+        _callbacks (list): called after every sample
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY,
+                 min_interval=DEFAULT_MIN_INTERVAL,
+                 max_interval=DEFAULT_MAX_INTERVAL):
+
+        self.ports = CounterSeries(PORT_FIELDS, capacity)
+        self.flows = CounterSeries(FLOW_FIELDS, capacity, columns=1024)
+
+        # Structure: { column, (table_id, priority, { field, value }) }
+        self.flow_info = {}
+
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self.next_poll = 0
+        self._sent = 0
+
+        # Structure: { xid, (kind, [ (columns, values) ]) }
+        self._pending = {}
+
+        self._callbacks = []
+
+    def add_callback(self, callback):
+        """Call callback(collector, kind) after every port or flow sample
+
+        kind is PORT_STATS or FLOW_STATS.
+        """
+        self._callbacks.append(callback)
+
+    def due(self, now=None):
+        """Whether the switch must be polled (and no poll is in progress)"""
+
+        if now is None:
+            now = time.monotonic()
+
+        # Requests the switch never replied (e.g. it sent an error instead)
+        # are given up after the longest interval
+        if self._pending:
+            if now - self._sent < self.max_interval:
+                return False
+            self._pending.clear()
+
+        return now >= self.next_poll
+
+    def expect(self, xid, kind):
+        """Record a stats request sent to the switch"""
+
+        self._pending[xid] = (kind, [])
+        self._sent = time.monotonic()
+
+    def port_stats_reply(self, msg, now=None):
+        """Handle a (part of a) port stats reply
+
+        Returns:
+            bool: False if the reply is not for a request of the collector
+        """
+
+        pending = self._pending.get(msg.xid)
+        if pending is None or pending[0] != PORT_STATS:
+            return False
+
+        ofproto = msg.datapath.ofproto
+        if ofproto.OFP_VERSION == ofproto_v1_3.OFP_VERSION and msg.buf:
+            body = np.frombuffer(msg.buf, _PORT_STATS_13,
+                                 offset=_MULTIPART_HEADER)
+            numbers = body['port_no'].tolist()
+            values = np.array([body[field] for field in PORT_FIELDS],
+                              np.uint64)
+        else:
+            numbers = [stats.port_no for stats in msg.body]
+            values = np.array(
+                [[getattr(stats, field) for stats in msg.body]
+                 for field in PORT_FIELDS], np.uint64)
+
+        columns = np.array([self.ports.column(port) for port in numbers],
+                           np.intp)
+        pending[1].append((columns, values))
+
+        if not msg.flags & ofproto.OFPMPF_REPLY_MORE:
+            self._complete(msg.xid, self.ports, now)
+
+        return True
+
+    def flow_stats_reply(self, msg, now=None):
+        """Handle a (part of a) flow stats reply
+
+        Returns:
+            bool: False if the reply is not for a request of the collector
+        """
+
+        pending = self._pending.get(msg.xid)
+        if pending is None or pending[0] != FLOW_STATS:
+            return False
+
+        ofproto = msg.datapath.ofproto
+        if (ofproto.OFP_VERSION in (ofproto_v1_3.OFP_VERSION,
+                                    ofproto_v1_4.OFP_VERSION) and msg.buf):
+            columns, values = self._parse_flow_stats(msg)
+        else:
+            # OpenFlow 1.5 carries the counters in OXS fields
+            columns = np.array([self._flow_column(stats)
+                                for stats in msg.body], np.intp)
+            values = np.array(
+                [[stats.stats.get('byte_count', 0) for stats in msg.body],
+                 [stats.stats.get('packet_count', 0) for stats in msg.body]],
+                np.uint64)
+
+        pending[1].append((columns, values))
+
+        if not msg.flags & ofproto.OFPMPF_REPLY_MORE:
+            self._complete(msg.xid, self.flows, now)
+
+        return True
+
+    def _parse_flow_stats(self, msg):
+        """Columns and counters of the entries of a raw flow stats reply
+
+        Entries are told apart by table, priority and the raw bytes of their
+        match, so only the entries never seen before are looked at as objects.
+        """
+
+        buf = bytes(msg.buf)
+        offsets = []
+        columns = []
+
+        offset = _MULTIPART_HEADER
+        for i in range(len(msg.body)):
+            length, match_len = _FLOW_LENGTHS.unpack_from(buf, offset)
+            key = buf[offset + _FLOW_TABLE_ID:offset + _FLOW_TABLE_ID + 1] + \
+                buf[offset + _FLOW_PRIORITY:offset + _FLOW_PRIORITY + 2] + \
+                buf[offset + _FLOW_MATCH:offset + _FLOW_MATCH + match_len]
+
+            column = self.flows.find(key)
+            if column is None:
+                column = self._new_flow(key, msg.body[i])
+
+            offsets.append(offset)
+            columns.append(column)
+            offset += length
+
+        if not offsets:
+            return (np.zeros(0, np.intp),
+                    np.zeros((len(FLOW_FIELDS), 0), np.uint64))
+
+        raw = np.frombuffer(buf, np.uint8)
+        offsets = np.array(offsets, np.intp)
+        values = np.array([_counters(raw, offsets + _FLOW_BYTES),
+                           _counters(raw, offsets + _FLOW_PACKETS)],
+                          np.uint64)
+
+        return np.array(columns, np.intp), values
+
+    def _flow_column(self, stats):
+        key = (stats.table_id, stats.priority,
+               tuple(sorted(stats.match.items())))
+        column = self.flows.find(key)
+        if column is None:
+            column = self._new_flow(key, stats)
+        return column
+
+    def _new_flow(self, key, stats):
+        column = self.flows.column(key)
+        self.flow_info[column] = (stats.table_id, stats.priority,
+                                  dict(stats.match.items()))
+        return column
+
+    def _complete(self, xid, series, now):
+        """Record the sample of a complete reply and schedule the next poll"""
+
+        if now is None:
+            now = time.monotonic()
+
+        kind, parts = self._pending.pop(xid)
+        if parts:
+            columns = np.concatenate([part[0] for part in parts])
+            values = np.concatenate([part[1] for part in parts], axis=1)
+        else:
+            columns = np.zeros(0, np.intp)
+            values = np.zeros((len(series.fields), 0), np.uint64)
+
+        before = series.rates
+        series.record(now, columns, values)
+
+        # The port counters drive the schedule
+        if kind == PORT_STATS:
+            self._schedule(now, before, series.rates)
+
+        for callback in self._callbacks:
+            callback(self, kind)
+
+    def _schedule(self, now, before, after):
+        """Poll sooner while the traffic changes, later while it is steady"""
+
+        old = before[0].sum() + before[1].sum()
+        new = after[0].sum() + after[1].sum()
+
+        if abs(new - old) > ADAPT_THRESHOLD * max(old, 1.0):
+            self.interval = max(self.min_interval, self.interval / 2)
+        else:
+            self.interval = min(self.max_interval, self.interval * 1.5)
+
+        jitter = random.uniform(-JITTER, JITTER) * self.interval
+        self.next_poll = now + self.interval + jitter
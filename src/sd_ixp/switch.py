@@ -12,9 +12,40 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
+
 from ryu.controller import ofp_event
 from ryu.ofproto import ofproto_v1_3
 
+from sd_ixp import allowlist
+from sd_ixp import classifier
+from sd_ixp import cluster
+from sd_ixp import compiler
+from sd_ixp import cookie as cookies
+from sd_ixp import mactable
+from sd_ixp import metrics
+from sd_ixp import stats
+from sd_ixp import template
+from sd_ixp import topology
+from sd_ixp.flow import GROUP, OUTPUT
+from sd_ixp.flow import Flow, drop, from_stats, meter, output
+from sd_ixp.flowqueue import Completion, FlowQueue, gather
+from sd_ixp.flowtable import FlowTable
+from sd_ixp.outbound import BULK, CONTROL, PACKET, PROBE, OutboundBuffer
+
+# Seconds without traffic after which the switch removes the entries of a
+# learned MAC
+LEARNED_IDLE_TIMEOUT = mactable.DEFAULT_IDLE_TIMEOUT
+
+# Seconds a storm guard stays on a port
+GUARD_DURATION = 10
+
+# Seconds a source MAC a member port does not accept stays blocked
+BLOCK_DURATION = allowlist.DEFAULT_BLOCK_DURATION
+
+# Group bit of the first octet of a MAC address (as a 48-bit integer)
+MULTICAST_BIT = 1 << 40
+
 
 class Switch:
     """OpenFlow switches abstraction.
@@ -28,9 +59,37 @@ class Switch:
         _of_version (ev.msg.datapath.ofproto.OFP_VERSION): OpenFlow version
         _ports (dictionary): Maps ports to what is connected to it (AS or
             another IXP's switch)
+        _outbound (OutboundBuffer): buffers the messages sent to the switch
+        _flows (FlowQueue): batches the FlowMods sent to the switch
+        _deferred (tuple): flows and groups of the sync() deferred until the
+            outbound buffer has room (None if there is none)
+        _deferred_completion (Completion): Completion of the deferred sync()
+        _shadow (FlowTable): flow entries the controller installed on the
+            switch
+        _base_flows (list): flow entries the switch always has (table-miss)
+        _flow_stats (dictionary): flow stats replies being received
+        _macs (MACTable): MACs learned on ports without a registered member
+        _meters (set): ids of the meters added to the switch
+        _stats (StatsCollector): polled port and flow counters
+        _master (bool): whether the controller may modify the switch (False
+            while it is a slave of a clustered controller)
+        replicator (callable): called as replicator(kind, dpid, mac, vlan,
+            port) when a MAC is learned (kind cluster.LEARN) or forgotten
+            (cluster.FORGET)
+        _pipeline (Pipeline): table ids of the pipeline stages
+        _groups (dictionary): flood groups installed on the switch
+        _applied_groups (set): flood groups the switch confirmed it has, the
+            only ones PacketOuts may use (PacketOuts overtake GroupMods, see
+            sd_ixp.outbound)
+        _group_mods (dictionary): Completion of the last GroupMod adding each
+            group not confirmed yet
+        _trunks (dictionary): ports linked to other switches of the fabric,
+            and the switch each one leads to
+        _lldp (dictionary): LLDP frame of each port (see sd_ixp.topology)
+        _lldp_key (bytes): key the frames of _lldp are tagged with
     """
 
-    def __init__(self, datapath):
+    def __init__(self, datapath, master=True, pipeline=compiler.PIPELINE):
 
         # Initialize the MAC-port-VLAN dictionary mapping
         self._ports = {}
@@ -40,7 +99,188 @@ class Switch:
         self._datapath = datapath
         self._of_version = self._datapath.ofproto.OFP_VERSION
 
+        # Messages are written to the switch in batches by priority (see
+        # sd_ixp.outbound), so a slow switch can not stall the controller
+        self._outbound = OutboundBuffer(self._datapath)
+
+        # FlowMods are sent in batches followed by a barrier (or as bundles on
+        # OpenFlow 1.4+) instead of one write per rule
+        self._flows = FlowQueue(
+            self._datapath,
+            send_msg=lambda msg: self._outbound.put(msg, BULK))
+
+        # A sync() while the buffer has no room for it is deferred until it
+        # has (see sd_ixp.outbound); a later sync() replaces it
+        self._deferred = None
+        self._deferred_completion = None
+
+        # Shadow of the switch flow table, so that changes are sent as diffs
+        self._shadow = FlowTable()
+        self._base_flows = []
+
+        # Structure: { xid, ([ Flow ], callback) }
+        self._flow_stats = {}
+
+        # Groups the controller installed on the switch (see
+        # compiler.compile_flood_groups), and group desc replies being
+        # received with the callbacks waiting for them
+        # Structure: { group_id, tuple of ports }
+        self._groups = {}
+        self._applied_groups = set()
+        # Structure: { group_id, Completion }
+        self._group_mods = {}
+        # Structure: { xid, [ (group_id, ports) ] }
+        self._group_desc = {}
+        self._group_callbacks = []
+
+        # Idle aging of learned MACs is done by the switch (the learned filter
+        # entries have an idle timeout); the table does the hard aging.
+        self._macs = mactable.MACTable(idle_timeout=0)
+
+        self._meters = set()
+
+        self._stats = stats.StatsCollector()
+
+        self._master = master
+        self.replicator = None
+
+        self._pipeline = pipeline
+
+        # Structure: { port, peer datapath_id }
+        self._trunks = {}
+
+        # Structure: { port, LLDP frame }
+        self._lldp = {}
+        self._lldp_key = None
+
         self._table_miss()
+        if master:
+            self.flush()
+
+    @property
+    def dpid(self):
+        """Datapath id of the switch"""
+        return self._datapath.id
+
+    @property
+    def datapath(self):
+        """Connection to the switch (a new one on every reconnection)"""
+        return self._datapath
+
+    @property
+    def master(self):
+        """Whether the controller may modify the switch"""
+        return self._master
+
+    def set_master(self, master):
+        """Record the role of the controller (see sd_ixp.cluster)"""
+        self._master = master
+
+    def request_role(self, role, generation_id):
+        """Send a role request (OFPCR_ROLE_MASTER or OFPCR_ROLE_SLAVE)
+
+        Becoming the master goes ahead of everything queued, which the switch
+        only accepts from its master; any other role goes after the FlowMods
+        queued, so the switch still accepts them.
+        """
+
+        ofproto = self._datapath.ofproto
+        parser = self._datapath.ofproto_parser
+
+        lane = CONTROL
+        if role != ofproto.OFPCR_ROLE_MASTER:
+            self.flush()
+            lane = BULK
+
+        self.send_msg(parser.OFPRoleRequest(
+            self._datapath, role, generation_id), lane)
+
+    @property
+    def outbound(self):
+        """Buffer of the messages sent to the switch (OutboundBuffer)"""
+        return self._outbound
+
+    def send_msg(self, msg, lane=PACKET):
+        """Send a message through the outbound buffer of the switch
+
+        Args:
+            msg: OpenFlow message
+            lane (int): lane of the message (see sd_ixp.outbound)
+
+        Returns:
+            bool: False if the message was shed
+        """
+        return self._outbound.put(msg, lane)
+
+    def congested(self):
+        """Whether the switch reads its messages slower than they are sent,
+        so PacketOuts and probes are being shed"""
+        return self._outbound.congested()
+
+    @property
+    def stats(self):
+        """Port and flow counters of the switch (StatsCollector)"""
+        return self._stats
+
+    @property
+    def macs(self):
+        """MACs learned on ports without a registered member (MACTable)"""
+        return self._macs
+
+    def set_ports(self, ports):
+        """Record what is connected to the member ports: { port, AS number }
+
+        Replaces what was recorded, so the ports of the members removed from
+        the registry are forgotten.
+        """
+        self._ports = dict(ports)
+
+    def set_trunks(self, trunks):
+        """Record the ports linked to other switches: { port, peer dpid }
+
+        No MAC is learned on a trunk: frames coming through it were learned
+        by the switch they entered the fabric through.
+        """
+        self._trunks = dict(trunks)
+
+    def send_lldp(self, key):
+        """Send an LLDP frame through every port of the switch but the
+        member ports
+
+        Args:
+            key (bytes): key the frames are tagged with (see
+                topology.lldp_frame())
+
+        Returns:
+            int: number of frames sent
+        """
+
+        ofproto = self._datapath.ofproto
+
+        # The ports are kept up to date by Ryu (port desc and port status)
+        ports = getattr(self._datapath, 'ports', None) or {}
+
+        if key != self._lldp_key:
+            self._lldp, self._lldp_key = {}, key
+
+        sent = 0
+        for port, desc in ports.items():
+            # Members must not see (and replay) the frames
+            if port > ofproto.OFPP_MAX or self._ports.get(port) is not None:
+                continue
+
+            frame = self._lldp.get(port)
+            if frame is None:
+                frame = self._lldp[port] = topology.lldp_frame(
+                    self.dpid, port, key, desc.hw_addr)
+
+            if self.send_msg(template.packet_out(
+                    self._datapath, ofproto.OFP_NO_BUFFER,
+                    ofproto.OFPP_CONTROLLER, [(OUTPUT, port)], frame),
+                    PROBE):
+                sent += 1
+
+        return sent
 
     def _table_miss(self):
         """Install table-miss flow entry
@@ -52,35 +292,27 @@ class Switch:
         # ofproto module that supports the OpenFlow version in use
         ofproto = self._datapath.ofproto
 
-        # ofproto_parser module
-        parser = self._datapath.ofproto_parser
+        # An empty match matches every packet; the lowest priority (0) makes
+        # the entry apply only to packets no other entry matches.
+        #
+        # The action outputs the packet to the controller. The switch may
+        # buffer the packet that generates the PacketIn; to avoid that the
+        # action would need max_len=ofproto.OFPCML_NO_BUFFER.
+        #
+        # The action is applied with an "apply actions" instruction, so the
+        # switch runs it in that very same processing stage (see sd_ixp.flow).
+        table_miss = Flow(0, 0, {}, [output(ofproto.OFPP_CONTROLLER)])
 
-        # create an empty match to match every packet
-        match = parser.OFPMatch()
+        # The table-miss entry is always part of the switch state, whatever
+        # the compiled flow entries are
+        self._base_flows.append(table_miss)
 
-        # create an instance of OFPActionOutput class setting controller as the
-        # output port.
-        actions = [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER)]
+        # A slave can not modify the switch; the master installed it
+        if self._master:
+            self.install_flow(table_miss)
 
-        # and NO_BUFFER, so that the switch will not buffer the
-        # the packets that generate a PacketIn
-        # actions = [
-        #     parser.OFPActionOutput(ofproto.OFPP_CONTROLLER,
-        #                            ofproto.OFPCML_NO_BUFFER)
-        # ]
-
-        # Instructions are executed when a packet matches a flow entry; it
-        # differs from the actions lists that the switch executes at the end of
-        # the processing.
-        # Using "ofproto.OFPIT_APPLY_ACTIONS" parameter, the controller informs
-        # the switch to run the action list in that very same processing stage.
-        instructions = [
-            parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions)
-        ]
-
-        self.add_flow(0, match, instructions, actions)
-
-    def add_flow(self, priority, match, instructions, actions, buffer_id=None):
+    def add_flow(self, priority, match, instructions, actions, buffer_id=None,
+                 cookie=cookies.OWNER):
         """ Install a flow mod on the switch
 
         Args:
@@ -94,6 +326,13 @@ class Switch:
             buffer_id (default=None): id of the packet buffered at the switch.
                     When there is no buffered packet associated buffer_id must
                     be set to OFP_NO_BUFFER in the flow_mod.
+            cookie (int): owner, feature, member and generation of the entry
+                    (see sd_ixp.cookie), so it can be deleted along with the
+                    other entries of its member or feature (see
+                    delete_flows())
+
+        Returns:
+            Completion: resolves when the switch has applied the flow mod
         """
 
         parser = self._datapath.ofproto_parser
@@ -102,6 +341,7 @@ class Switch:
         if buffer_id:
             mod = parser.OFPFlowMod(
                 datapath=self._datapath,
+                cookie=cookie,
                 buffer_id=buffer_id,
                 priority=priority,
                 match=match,
@@ -109,18 +349,751 @@ class Switch:
         else:
             mod = parser.OFPFlowMod(
                 datapath=self._datapath,
+                cookie=cookie,
                 priority=priority,
                 match=match,
                 instructions=instructions)
 
-        self._datapath.send_msg(mod)
+        return self._flows.put(mod)
+
+    def install_flow(self, flow):
+        """Install a Flow (see sd_ixp.flow) on the switch
+
+        Args:
+            flow (Flow): the flow entry to install
+
+        Returns:
+            Completion: resolves when the switch has applied the flow mod
+        """
+
+        self._shadow.add(flow)
+        return self._flows.put(
+            self._flow_mod(flow, self._datapath.ofproto.OFPFC_ADD))
+
+    def modify_flow(self, flow):
+        """Replace the instructions of an installed Flow
+
+        Returns:
+            Completion: resolves when the switch has applied the flow mod
+        """
+
+        self._shadow.add(flow)
+        return self._flows.put(
+            self._flow_mod(flow, self._datapath.ofproto.OFPFC_MODIFY_STRICT))
+
+    def remove_flow(self, flow):
+        """Remove an installed Flow (strictly matching match and priority)
+
+        Returns:
+            Completion: resolves when the switch has applied the flow mod
+        """
+
+        self._shadow.remove(flow)
+        return self._flows.put(
+            self._flow_mod(flow, self._datapath.ofproto.OFPFC_DELETE_STRICT))
+
+    def delete_flows(self, cookie, mask=cookies.FULL_MASK):
+        """Remove every entry whose cookie matches, from all the tables, with
+        a single flow mod
+
+        E.g. delete_flows(*cookie.match(member=65001)) removes every entry of
+        AS65001. The learned MACs are not forgotten: deleting their entries
+        only makes sync() install them again.
+
+        Args:
+            cookie (int): cookie value (see sd_ixp.cookie)
+            mask (int): bits of the cookie that must match
+
+        Returns:
+            Completion: resolves when the switch has applied the flow mod
+        """
+
+        for flow in [flow for flow in self._shadow
+                     if flow.cookie & mask == cookie]:
+            self._shadow.remove(flow)
+
+        return self._flows.put(self._delete_mod(cookie, mask))
+
+    @metrics.timed
+    def sync(self, flows, groups=None, wait=False):
+        """Bring the switch to the desired set of flow entries
+
+        Only the difference between the desired flows and the shadow table is
+        sent: new entries are added, entries whose instructions changed are
+        modified and entries no longer desired are deleted.
+
+        Groups are changed the same way, around the flows that use them: new
+        and modified groups go before the flows, deleted groups after them.
+
+        The changes may span several batches of the FlowQueue; the Completion
+        returned covers all of them, with the errors of every batch.
+
+        While the outbound buffer has no room, the sync is deferred until it
+        has, and only the latest sync deferred runs; the callers that may
+        block (not the Ryu event thread) wait for room instead, before any
+        change is sent.
+
+        Args:
+            flows (iterable): Flow objects the switch must have (the
+                table-miss entry is added implicitly)
+            groups (dictionary): { group_id, tuple of ports } of the flood
+                groups the switch must have (None leaves the groups alone)
+            wait (bool): wait for room in the outbound buffer instead of
+                deferring the sync
+
+        Returns:
+            Completion: resolves when the switch has applied the changes
+        """
+
+        if not self._outbound.has_room():
+            if not wait:
+                return self._defer_sync(flows, groups)
+            self._outbound.wait_room()
+
+        # This sync supersedes the one deferred
+        deferred = self._deferred_completion
+        self._deferred = self._deferred_completion = None
+
+        ofproto = self._datapath.ofproto
+
+        # Completions of the batches the changes go in
+        completions = []
+
+        if groups is not None:
+            for group_id, ports in sorted(groups.items()):
+                current = self._groups.get(group_id)
+                if current is None:
+                    completions.append(self._group_mod(
+                        ofproto.OFPGC_ADD, group_id, ports))
+                elif current != ports:
+                    completions.append(self._group_mod(
+                        ofproto.OFPGC_MODIFY, group_id, ports))
+
+        desired = list(self._base_flows) + list(flows)
+
+        # Temporary entries (e.g. storm guards) expire by themselves
+        desired.extend(flow for flow in self._shadow if flow.hard_timeout)
+
+        for entry in self._macs:
+            desired.extend(self._learned_flows(entry.mac, entry.port,
+                                               entry.vlan))
+
+        diff = self._shadow.diff(desired)
+
+        # Entries of a member that left (or of any cookie none of the entries
+        # kept has) go with a single delete
+        bulk = self._bulk_deletes(diff)
+        for cookie in sorted(bulk):
+            for flow in bulk[cookie]:
+                self._shadow.remove(flow)
+            completions.append(self._flows.put(
+                self._delete_mod(cookie, cookies.FULL_MASK)))
+
+        for flow in diff.delete:
+            if flow.cookie not in bulk:
+                completions.append(self.remove_flow(flow))
+        for flow in diff.modify:
+            completions.append(self.modify_flow(flow))
+        for flow in diff.add:
+            completions.append(self.install_flow(flow))
+
+        if groups is not None:
+            for group_id in sorted(set(self._groups) - set(groups)):
+                completions.append(self._group_mod(ofproto.OFPGC_DELETE,
+                                                   group_id))
+
+        completions.append(self.flush())
+        completion = gather(completions)
+
+        if deferred is not None:
+            deferred.follow(completion)
+        return completion
+
+    def _defer_sync(self, flows, groups):
+        """Defer a sync() until the outbound buffer has room for it"""
+
+        if self._deferred is None:
+            self._deferred_completion = Completion()
+            self._outbound.when_room(self._resync)
+        elif groups is None:
+            groups = self._deferred[1]
+
+        self._deferred = (list(flows), groups)
+        return self._deferred_completion
+
+    def _resync(self):
+        # A sync may have run since it was deferred
+        if self._deferred is None:
+            return
+
+        if not self._outbound.has_room():
+            self._outbound.when_room(self._resync)
+            return
+
+        self.sync(*self._deferred)
+
+    def _bulk_deletes(self, diff):
+        """Entries of a diff that can be deleted by cookie
+
+        Every installed entry with the cookie must be deleted, and no entry
+        added with it: the switch may reorder the delete and the flow mods of
+        the entries it would catch.
+
+        Returns:
+            dictionary: { cookie, [ Flow ] }
+        """
+
+        deleted = collections.defaultdict(list)
+        for flow in diff.delete:
+            deleted[flow.cookie].append(flow)
+
+        # A single entry is deleted strictly as well
+        deleted = {cookie: flows for cookie, flows in deleted.items()
+                   if len(flows) > 1}
+        if not deleted:
+            return {}
+
+        added = {flow.cookie for flow in diff.add}
+        installed = collections.Counter(flow.cookie for flow in self._shadow)
+
+        return {cookie: flows for cookie, flows in deleted.items()
+                if cookie not in added and installed[cookie] == len(flows)}
+
+    def _delete_mod(self, cookie, mask):
+        """OFPFlowMod deleting the entries of all the tables whose cookie
+        matches"""
+
+        ofproto = self._datapath.ofproto
+
+        return self._datapath.ofproto_parser.OFPFlowMod(
+            datapath=self._datapath,
+            cookie=cookie,
+            cookie_mask=mask,
+            table_id=ofproto.OFPTT_ALL,
+            command=ofproto.OFPFC_DELETE,
+            out_port=ofproto.OFPP_ANY,
+            out_group=ofproto.OFPG_ANY)
+
+    def _group_mod(self, command, group_id, ports=()):
+        """Queue a GroupMod of an ALL group outputting to ports"""
+
+        ofproto = self._datapath.ofproto
+        parser = self._datapath.ofproto_parser
+
+        if command == ofproto.OFPGC_DELETE:
+            self._groups.pop(group_id, None)
+            self._applied_groups.discard(group_id)
+            self._group_mods.pop(group_id, None)
+        else:
+            self._groups[group_id] = tuple(ports)
+
+        # OpenFlow 1.5 identifies the buckets of a group
+        if hasattr(ofproto, 'OFPG_BUCKET_ALL'):
+            buckets = [parser.OFPBucket(bucket_id=i, actions=[
+                parser.OFPActionOutput(port)])
+                for i, port in enumerate(ports)]
+        else:
+            buckets = [parser.OFPBucket(actions=[
+                parser.OFPActionOutput(port)]) for port in ports]
+
+        completion = self._flows.put(parser.OFPGroupMod(
+            self._datapath, command=command, type_=ofproto.OFPGT_ALL,
+            group_id=group_id, buckets=buckets))
+
+        # A new group is flooded to once the switch confirms it has it
+        if (command == ofproto.OFPGC_ADD and
+                group_id not in self._applied_groups):
+            self._group_mods[group_id] = completion
+            completion.add_done_callback(
+                lambda completion: self._group_applied(group_id, completion))
+
+        return completion
+
+    def _group_applied(self, group_id, completion):
+        if self._group_mods.get(group_id) is not completion:
+            return
+
+        del self._group_mods[group_id]
+        if completion.ok:
+            self._applied_groups.add(group_id)
+
+    def _flow_mod(self, flow, command):
+        """Encode a Flow into a FlowMod with the given command (see
+        sd_ixp.template)"""
+
+        # Entries with a timeout notify the controller when they expire
+        flags = 0
+        if flow.idle_timeout or flow.hard_timeout:
+            flags = self._datapath.ofproto.OFPFF_SEND_FLOW_REM
+
+        return template.flow_mod(self._datapath, flow, command, flags)
+
+    def flush(self):
+        """Send the queued flow mods followed by a barrier
+
+        Returns:
+            Completion: resolves when the switch has applied every flow mod
+                sent so far
+        """
+        return self._flows.flush()
+
+    def close(self):
+        """Release what the switch holds once it disconnected
+
+        The flow mods not sent yet are discarded, the Completions waiting for
+        the switch are cancelled and the replies still expected forgotten.
+        """
+
+        self._flows.close()
+        self._outbound.close()
+        if self._deferred_completion is not None:
+            self._deferred_completion._cancel()
+            self._deferred = self._deferred_completion = None
+        self._flow_stats.clear()
+        self._group_desc.clear()
+        self._group_callbacks = []
+        self.replicator = None
+
+    def backlog(self):
+        """Messages on their way to the switch
+
+        Returns:
+            tuple: FlowMods batched and not sent yet, messages in the
+                outbound buffer, writes waiting in Ryu's send queue of the
+                connection, and barriers sent and not replied yet
+        """
+
+        send_q = getattr(self._datapath, 'send_q', None)
+        return (len(self._flows), len(self._outbound),
+                send_q.qsize() if send_q is not None else 0,
+                self._flows.pending())
+
+    @metrics.timed
+    def barrier_reply(self, msg):
+        """Handle a barrier reply sent by the switch"""
+        return self._flows.barrier_reply(msg)
 
-    def l2_learning(self, msg):
+    @metrics.timed
+    def error(self, msg):
+        """Handle an OpenFlow error sent by the switch"""
+        return self._flows.error(msg)
+
+    @metrics.timed
+    def l2_learning(self, msg, vlan_id=None):
         """ Layer 2 learning feature
 
-        Learn MAC addresses
+        Learn the source MAC of a PacketIn that came from a port without a
+        registered member, install its filter and forwarding entries, and
+        forward the packet: through the port of the destination MAC if it is
+        known, flooding it otherwise.
+
+        Args:
+            msg (OFPPacketIn): the PacketIn message
+            vlan_id (int): VLAN id of the frame (None if untagged)
+        """
+
+        ofproto = self._datapath.ofproto
+        in_port = msg.match['in_port']
+
+        src = classifier.eth_src(msg.data)
+        dst = classifier.eth_dst(msg.data)
+
+        # Member ports are programmed from the registry, and multicast source
+        # addresses are invalid
+        if (self._ports.get(in_port) is None and in_port not in self._trunks
+                and not src & MULTICAST_BIT):
+            old_port = self._macs.lookup(src, vlan_id)
+            result = self._macs.learn(src, in_port, vlan_id)
+
+            if result == mactable.MOVED and old_port is not None:
+                for flow in self._learned_flows(src, old_port, vlan_id):
+                    self.remove_flow(flow)
+
+            if result in (mactable.NEW, mactable.MOVED):
+                for flow in self._learned_flows(src, in_port, vlan_id):
+                    self.install_flow(flow)
+                self._replicate(cluster.LEARN, src, vlan_id, in_port)
+
+        out_port = self._macs.lookup(dst, vlan_id)
+        if out_port is None:
+            self.flood(msg, vlan_id)
+        else:
+            self.packet_out(msg, out_port)
+
+    @metrics.timed
+    def expire_macs(self):
+        """Remove the learned MACs that reached their hard timeout, and their
+        flow entries
+
+        Returns:
+            int: number of MACs removed
+        """
+
+        expired = self._macs.expire()
+        for entry in expired:
+            # The master of the switch replicates its own expirations
+            if not self._master:
+                continue
+
+            self._replicate(cluster.FORGET, entry.mac, entry.vlan, entry.port)
+            for flow in self._learned_flows(entry.mac, entry.port, entry.vlan):
+                self.remove_flow(flow)
+
+        return len(expired)
+
+    @metrics.timed
+    def apply_replicated(self, kind, mac, vlan_id, port):
+        """Apply a MAC learned or forgotten by another controller node
+
+        Only the learning table changes: the master of the switch installs
+        and removes the flow entries.
+
+        Args:
+            kind (str): cluster.LEARN or cluster.FORGET
+            mac (int): the MAC address as a 48-bit integer
+            vlan_id (int): VLAN id (None if untagged)
+            port (int): port the MAC was learned on
+        """
+
+        if kind == cluster.LEARN:
+            self._macs.learn(mac, port, vlan_id)
+        elif kind == cluster.FORGET:
+            self._macs.remove(mac, vlan_id)
+
+    def _replicate(self, kind, mac, vlan_id, port):
+        if self.replicator is not None:
+            self.replicator(kind, self.dpid, mac, vlan_id, port)
+
+    @metrics.timed
+    def flow_removed(self, msg):
+        """Handle a flow removed message sent by the switch
+
+        The switch removed the entry itself (e.g. idle timeout), so it leaves
+        the shadow table. When it is the filter entry of a learned MAC, the MAC
+        is forgotten and its forwarding entry removed.
+
+        Args:
+            msg (OFPFlowRemoved): the flow removed message
+        """
+
+        match = dict(msg.match.items())
+        self._shadow.remove(Flow(msg.table_id, msg.priority, match, ()))
+
+        if (msg.table_id != self._pipeline.filter or
+                msg.priority != compiler.LEARNED_PRIORITY):
+            return
+
+        vlan_vid = match.get('vlan_vid', 0)
+        vlan_id = vlan_vid & 0x0fff if vlan_vid else None
+        mac = mactable.mac_to_int(match['eth_src'])
+
+        entry = self._macs.remove(mac, vlan_id)
+        if entry is not None:
+            self._replicate(cluster.FORGET, mac, vlan_id, entry.port)
+            self.remove_flow(
+                self._learned_flows(mac, entry.port, vlan_id)[1])
+
+    @metrics.timed
+    def guard_port(self, port, rate=None, duration=GUARD_DURATION):
+        """Push a storm guard for a port that is over its PacketIn budget
+
+        Traffic of the port that would go to the controller is either rate
+        limited by an OpenFlow meter (when rate is given) or dropped. The guard
+        only matches what reaches the table-miss entries, so the member's
+        regular traffic is not affected, and it expires after duration seconds.
+
+        Args:
+            port (int): the port to guard
+            rate (int): PacketIns per second allowed through a meter (None
+                installs a drop entry instead)
+            duration (int): seconds the guard stays installed
+
+        Returns:
+            Completion: resolves when the switch has applied the guard
+        """
+
+        ofproto = self._datapath.ofproto
+
+        if rate:
+            self._set_meter(port, rate)
+            instructions = [meter(port), output(ofproto.OFPP_CONTROLLER)]
+        else:
+            instructions = [drop()]
+
+        for table_id in (self._pipeline.filter, self._pipeline.forward):
+            self.install_flow(Flow(
+                table_id, compiler.GUARD_PRIORITY, {'in_port': port},
+                instructions, hard_timeout=duration,
+                cookie=cookies.make(cookies.GUARD)))
+
+        return self.flush()
+
+    @metrics.timed
+    def block_source(self, port, mac, duration=BLOCK_DURATION):
+        """Drop the frames of a source MAC a member port does not accept
+
+        Args:
+            port (int): the member port
+            mac (str): the source MAC
+            duration (int): seconds the source stays blocked
+
+        Returns:
+            Completion: resolves when the switch has applied the drop entry
+        """
+
+        self.install_flow(compiler.compile_blocked(port, mac, duration,
+                                                   self._pipeline))
+        return self.flush()
+
+    def unblock_sources(self, allowed):
+        """Remove the drop entries of the sources allowed again (e.g. the MAC
+        was registered after it was blocked)
+
+        Args:
+            allowed (callable): allowed(port, mac) tells whether a port
+                accepts a source MAC (48-bit integer)
+        """
+
+        for flow in list(self._shadow):
+            feature = cookies.parse(flow.cookie)
+            if feature is None or feature[0] != cookies.BLOCKED:
+                continue
+
+            match = dict(flow.match)
+            if allowed(match['in_port'],
+                       mactable.mac_to_int(match['eth_src'])):
+                self.remove_flow(flow)
+
+    def _set_meter(self, meter_id, rate):
+        """Add (or update) a packets-per-second drop meter"""
+
+        ofproto = self._datapath.ofproto
+        parser = self._datapath.ofproto_parser
+
+        if meter_id in self._meters:
+            command = ofproto.OFPMC_MODIFY
+        else:
+            command = ofproto.OFPMC_ADD
+            self._meters.add(meter_id)
+
+        self._flows.put(parser.OFPMeterMod(
+            self._datapath,
+            command=command,
+            flags=ofproto.OFPMF_PKTPS | ofproto.OFPMF_BURST,
+            meter_id=meter_id,
+            bands=[parser.OFPMeterBandDrop(rate=rate, burst_size=rate)]))
+
+    def packet_out(self, msg, out_port):
+        """Send the packet of a PacketIn through a port
+
+        Args:
+            msg (OFPPacketIn): the PacketIn message
+            out_port (int): output port (may be a reserved port as OFPP_FLOOD)
         """
-        pass
+
+        self._send_packet(msg, [(OUTPUT, out_port)])
+
+    def flood(self, msg, vlan_id=None):
+        """Flood the packet of a PacketIn within its VLAN
+
+        The packet goes to the flood group of the VLAN, if the switch has
+        confirmed it has one (see compiler.compile_flood_groups), and through
+        every port otherwise.
+
+        Args:
+            msg (OFPPacketIn): the PacketIn message
+            vlan_id (int): VLAN id of the frame (None if untagged)
+        """
+
+        group_id = compiler.flood_group_id(compiler.vlan_vid_of(vlan_id))
+        if group_id in self._applied_groups:
+            action = (GROUP, group_id)
+        else:
+            action = (OUTPUT, self._datapath.ofproto.OFPP_FLOOD)
+
+        self._send_packet(msg, [action])
+
+    def _send_packet(self, msg, actions):
+        """PacketOut of the packet of a PacketIn
+
+        Args:
+            msg (OFPPacketIn): the PacketIn message
+            actions (list): action tuples (see sd_ixp.flow)
+        """
+
+        # Buffered packets are released by buffer id; the others are sent back
+        data = None
+        if msg.buffer_id == self._datapath.ofproto.OFP_NO_BUFFER:
+            data = msg.data
+
+        self.send_msg(template.packet_out(
+            self._datapath, msg.buffer_id, msg.match['in_port'], actions,
+            data))
+
+    def _learned_flows(self, mac, port, vlan_id):
+        """Filter and forwarding Flows of a learned MAC (48-bit integer)"""
+
+        return compiler.compile_learned(
+            mactable.int_to_mac(mac), port, vlan_id,
+            idle_timeout=LEARNED_IDLE_TIMEOUT, pipeline=self._pipeline)
+
+    def learned_state(self):
+        """Learned MACs and shadow flows of the switch (see sd_ixp.snapshot)
+
+        Returns:
+            tuple: (list of MACEntry objects, list of Flow objects)
+        """
+        return list(self._macs), list(self._shadow)
+
+    def restore(self, macs, flows):
+        """Restore the learned MACs and shadow flows saved by a snapshot
+
+        Called before the switch is programmed, so that its learned entries
+        are kept instead of deleted. The shadow table is replaced anyway by
+        the flow entries the switch reports, when it does.
+
+        Args:
+            macs (list): (mac, vlan, port, learned, seen) tuples
+            flows (list): Flow objects
+        """
+
+        for mac, vlan, port, learned, seen in macs:
+            self._macs.restore(mac, port, vlan, learned, seen)
+
+        for flow in flows:
+            self._shadow.add(flow)
 
     def get_flow_entries(self):
-        pass
+        """Flow entries the controller believes are installed on the switch
+
+        Returns:
+            list: Flow objects of the shadow table
+        """
+        return list(self._shadow)
+
+    def request_flow_entries(self, callback=None):
+        """Load the shadow table from the flow entries the switch reports
+
+        Sends a group desc and a flow stats request; when the last replies
+        arrive the groups and the shadow table are replaced with their content
+        and callback(switch) is called. Used when a switch (re)connects with
+        entries of a previous session.
+
+        The entries without the owner of the controller in their cookie (see
+        sd_ixp.cookie) are deleted first, with a flow mod per bit of the owner
+        byte, so they are neither reported nor deleted one by one.
+        """
+
+        parser = self._datapath.ofproto_parser
+
+        # The barrier makes the switch delete them before it replies the dump
+        for cookie, mask in cookies.foreign():
+            self._flows.put(self._delete_mod(cookie, mask))
+        self.flush()
+
+        req = parser.OFPGroupDescStatsRequest(self._datapath)
+        self._datapath.set_xid(req)
+        self._group_desc[req.xid] = []
+        self.send_msg(req, BULK)
+
+        # OpenFlow 1.5 moved instructions to the flow description request
+        if hasattr(parser, 'OFPFlowDescStatsRequest'):
+            req = parser.OFPFlowDescStatsRequest(self._datapath)
+        else:
+            req = parser.OFPFlowStatsRequest(self._datapath)
+
+        self._datapath.set_xid(req)
+        self._flow_stats[req.xid] = ([], callback)
+        self.send_msg(req, BULK)
+
+    @metrics.timed
+    def flow_stats_reply(self, msg):
+        """Handle a (part of a) flow stats reply sent by the switch"""
+
+        entry = self._flow_stats.get(msg.xid)
+        if entry is None:
+            return self._stats.flow_stats_reply(msg)
+
+        flows, callback = entry
+        ofproto = self._datapath.ofproto
+        flows.extend(from_stats(ofproto, stats) for stats in msg.body)
+
+        # Multipart replies: wait for the last part
+        if msg.flags & ofproto.OFPMPF_REPLY_MORE:
+            return True
+
+        del self._flow_stats[msg.xid]
+        self._shadow.replace(flows)
+
+        if callback is not None:
+            # The groups the flows use must be known before syncing them
+            if self._group_desc:
+                self._group_callbacks.append(callback)
+            else:
+                callback(self)
+
+        return True
+
+    @metrics.timed
+    def group_desc_reply(self, msg):
+        """Handle a (part of a) group desc reply sent by the switch
+
+        Only ALL groups that output to ports are kept as they are; any other
+        group is recorded with no ports, so syncing replaces it.
+        """
+
+        groups = self._group_desc.get(msg.xid)
+        if groups is None:
+            return False
+
+        ofproto = self._datapath.ofproto
+        for desc in msg.body:
+            ports = []
+            for bucket in desc.buckets:
+                ports.extend(action.port for action in bucket.actions
+                             if action.type == ofproto.OFPAT_OUTPUT)
+
+            if desc.type != ofproto.OFPGT_ALL or len(ports) != len(
+                    desc.buckets):
+                ports = [None]
+            groups.append((desc.group_id, tuple(ports)))
+
+        if msg.flags & ofproto.OFPMPF_REPLY_MORE:
+            return True
+
+        del self._group_desc[msg.xid]
+        self._groups = dict(groups)
+        self._applied_groups = set(self._groups)
+        self._group_mods.clear()
+
+        if not self._group_desc:
+            callbacks, self._group_callbacks = self._group_callbacks, []
+            for callback in callbacks:
+                callback(self)
+
+        return True
+
+    def request_stats(self):
+        """Poll the port and flow counters of the switch
+
+        The replies are recorded by the stats collector (see sd_ixp.stats).
+        """
+
+        ofproto = self._datapath.ofproto
+        parser = self._datapath.ofproto_parser
+
+        requests = (
+            (stats.PORT_STATS,
+             parser.OFPPortStatsRequest(self._datapath, 0, ofproto.OFPP_ANY)),
+            (stats.FLOW_STATS, parser.OFPFlowStatsRequest(self._datapath)),
+        )
+
+        for kind, req in requests:
+            self._datapath.set_xid(req)
+            if self.send_msg(req, PROBE):
+                self._stats.expect(req.xid, kind)
+
+    @metrics.timed
+    def port_stats_reply(self, msg):
+        """Handle a (part of a) port stats reply sent by the switch"""
+        return self._stats.port_stats_reply(msg)
@@ -0,0 +1,542 @@
+# Copyright (C) 2018 [SD]RSiX Project
+#
+# Licensed under the Apache License, Version 2.0 (the “License”);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an “AS IS” BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Pre-encoded FlowMod and PacketOut messages
+
+Building an OFPFlowMod with Ryu creates a match, instruction and action
+objects, and serializing it walks all of them again; most of the controller's
+CPU time while it provisions a member or replays a reconnecting switch goes
+there. Yet the messages it sends have a handful of shapes: the entries of
+different members differ only in their MACs, ports, VLANs and cookies.
+
+The first message of a shape (OpenFlow version, command, match fields and
+instruction structure) is built by Ryu and becomes the template of the shape:
+each variable field is flipped in turn to find where it lies in the encoded
+message, and the bytes in between are kept as they are. The next messages of
+the shape are packed from the template with a single struct call, and their
+xid is filled in when they are sent.
+
+A shape whose fields can not be located (a value that changes the layout of
+the message) is built by Ryu every time, as is every shape beyond
+MAX_TEMPLATES.
+"""
+
+import struct
+
+from ryu.ofproto import ofproto_parser
+from ryu.ofproto import ofproto_v1_5
+
+from sd_ixp import mactable
+from sd_ixp.flow import APPLY, GOTO, GROUP, METADATA, METER, OUTPUT
+from sd_ixp.flow import Flow, render_actions, render_instructions
+from sd_ixp.flow import render_match
+
+# Most shapes a template is kept for (shared by every switch)
+MAX_TEMPLATES = 1024
+
+# Width in bytes of the buffer id, cookie, table id, idle timeout, hard timeout
+# and priority of a FlowMod
+_FLOW_MOD_WIDTHS = (4, 8, 1, 2, 2, 2)
+
+# Width of the values of the instructions and actions (see sd_ixp.flow)
+_INSTRUCTION_WIDTHS = {GOTO: (1, ), METER: (4, ), METADATA: (8, 8)}
+_ACTION_WIDTHS = {OUTPUT: (4, ), GROUP: (4, )}
+
+# struct format of the integer fields of each width
+_FORMATS = {1: 'B', 2: 'H', 4: 'I', 8: 'Q'}
+
+_MAC_LENGTH = 17
+
+_LENGTH = struct.Struct('!H')
+_XID = struct.Struct('!I')
+
+# Structure: { (OF version, kind, shape), Template or None }
+_templates = {}
+
+# Structure: { (OF version, OXM field name), width }
+_match_widths = {}
+
+
+class EncodedMsg(ofproto_parser.MsgBase):
+    """Message packed from a template
+
+    It only sets its xid when serialized, so it is sent as any message Ryu
+    builds: by Datapath.send_msg() or inside a bundle.
+    """
+
+    def __init__(self, datapath, msg_type, buf):
+        super(EncodedMsg, self).__init__(datapath)
+        self.version = datapath.ofproto.OFP_VERSION
+        self.msg_type = msg_type
+        self.msg_len = len(buf)
+        self.buf = buf
+
+    def serialize(self):
+        if self.xid is None:
+            self.xid = 0
+        _XID.pack_into(self.buf, 4, self.xid)
+
+
+class EncodedFlowMod(EncodedMsg):
+    """FlowMod packed from a template"""
+
+
+class EncodedPacketOut(EncodedMsg):
+    """PacketOut packed from a template"""
+
+
+class Template:
+    """Encoded message of a shape with its variable fields left open
+
+    Attributes:
+        msg_type (int): OpenFlow message type
+        length (int): length of the encoded message
+        _struct (Struct): the whole message; the constant spans are 's'
+            fields
+        _args (list): arguments of _struct, with None for the variable fields
+        _fields (list): (position in _args, index of the value, whether it is
+            a MAC) of each variable field
+    """
+
+    def __init__(self, reference, fields):
+        """
+        Args:
+            reference (bytes): a message of the shape
+            fields (list): (offset, width, index of the value, whether it is a
+                MAC) of each variable field, by offset
+        """
+
+        self.msg_type = reference[1]
+        self.length = len(reference)
+
+        fmt = ['!']
+        self._args = []
+        self._fields = []
+
+        offset = 0
+        for start, width, index, mac in fields:
+            if start > offset:
+                fmt.append('%ds' % (start - offset))
+                self._args.append(reference[offset:start])
+
+            fmt.append('6s' if mac else _FORMATS[width])
+            self._fields.append((len(self._args), index, mac))
+            self._args.append(None)
+            offset = start + width
+
+        if offset < len(reference):
+            fmt.append('%ds' % (len(reference) - offset))
+            self._args.append(reference[offset:])
+
+        self._struct = struct.Struct(''.join(fmt))
+
+    def encode(self, values):
+        """Pack a message of the shape
+
+        Returns:
+            bytearray: the message (with xid 0)
+        """
+
+        args = self._args[:]
+        for position, index, mac in self._fields:
+            value = values[index]
+            args[position] = _mac_to_bin(value) if mac else value
+
+        return bytearray(self._struct.pack(*args))
+
+
+def flow_mod(datapath, flow, command, flags=0, buffer_id=None):
+    """FlowMod of a Flow (see sd_ixp.flow)
+
+    Args:
+        datapath: datapath of the switch
+        flow (Flow): the flow entry
+        command (int): OFPFC_* command
+        flags (int): OFPFF_* flags
+        buffer_id (int): buffered packet to apply the entry to (None for no
+            buffer)
+
+    Returns:
+        MsgBase: an EncodedFlowMod, or an OFPFlowMod if the shape of the
+            flow has no template
+    """
+
+    ofproto = datapath.ofproto
+    if buffer_id is None:
+        buffer_id = ofproto.OFP_NO_BUFFER
+
+    values = [buffer_id, flow.cookie, flow.table_id, flow.idle_timeout,
+              flow.hard_timeout, flow.priority]
+    widths = list(_FLOW_MOD_WIDTHS)
+    masks = {}
+
+    shape = _flow_shape(ofproto, flow, values, widths, masks)
+    if shape is None:
+        return build_flow_mod(datapath, flow, command, flags, buffer_id)
+
+    match, instructions = shape
+
+    def build(values):
+        return build_flow_mod(
+            datapath, _rebuild_flow(match, instructions, values[1:]),
+            command, flags, values[0])
+
+    template = _template(
+        (ofproto.OFP_VERSION, 'flow_mod', command, flags, match,
+         instructions), values, widths, build, masks)
+    if template is None:
+        return build(values)
+
+    return EncodedFlowMod(datapath, template.msg_type,
+                          template.encode(values))
+
+
+def packet_out(datapath, buffer_id, in_port, actions, data=None):
+    """PacketOut of a packet
+
+    Args:
+        datapath: datapath of the switch
+        buffer_id (int): buffered packet to send (OFP_NO_BUFFER if data is
+            sent)
+        in_port (int): port the packet came in through
+        actions (iterable): action tuples (see sd_ixp.flow)
+        data (bytes): the packet, when it is not buffered
+
+    Returns:
+        MsgBase: an EncodedPacketOut, or an OFPPacketOut if the actions have
+            no template
+    """
+
+    names = []
+    values = [buffer_id, in_port]
+    widths = [4, 4]
+    for action in actions:
+        if not _add_values(_ACTION_WIDTHS, action, values, widths):
+            return build_packet_out(datapath, buffer_id, in_port, actions,
+                                    data)
+        names.append(action[0])
+    names = tuple(names)
+
+    # The template is built without the packet, which is appended to it
+    # (OpenFlow 1.5 wants the empty packet of an unbuffered PacketOut)
+    def build(values):
+        empty = b'' if values[0] == datapath.ofproto.OFP_NO_BUFFER else None
+        return build_packet_out(datapath, values[0], values[1],
+                                _rebuild_actions(names, values, 2)[0], empty)
+
+    template = _template((datapath.ofproto.OFP_VERSION, 'packet_out', names),
+                         values, widths, build)
+    if template is None:
+        return build_packet_out(datapath, buffer_id, in_port, actions, data)
+
+    buf = template.encode(values)
+    if data:
+        buf += data
+        _LENGTH.pack_into(buf, 2, len(buf))
+
+    return EncodedPacketOut(datapath, template.msg_type, buf)
+
+
+def build_flow_mod(datapath, flow, command, flags=0, buffer_id=None):
+    """OFPFlowMod of a Flow, built by Ryu"""
+
+    ofproto = datapath.ofproto
+    if buffer_id is None:
+        buffer_id = ofproto.OFP_NO_BUFFER
+
+    return datapath.ofproto_parser.OFPFlowMod(
+        datapath=datapath,
+        cookie=flow.cookie,
+        table_id=flow.table_id,
+        command=command,
+        idle_timeout=flow.idle_timeout,
+        hard_timeout=flow.hard_timeout,
+        priority=flow.priority,
+        buffer_id=buffer_id,
+        flags=flags,
+        out_port=ofproto.OFPP_ANY,
+        out_group=ofproto.OFPG_ANY,
+        match=render_match(datapath, flow),
+        instructions=render_instructions(datapath, flow))
+
+
+def build_packet_out(datapath, buffer_id, in_port, actions, data=None):
+    """OFPPacketOut of a packet, built by Ryu"""
+
+    parser = datapath.ofproto_parser
+
+    # OpenFlow 1.5 moved the in port into a match
+    if datapath.ofproto.OFP_VERSION >= ofproto_v1_5.OFP_VERSION:
+        return parser.OFPPacketOut(
+            datapath=datapath,
+            buffer_id=buffer_id,
+            match=parser.OFPMatch(in_port=in_port),
+            actions=render_actions(datapath, actions),
+            data=data)
+
+    return parser.OFPPacketOut(
+        datapath=datapath,
+        buffer_id=buffer_id,
+        in_port=in_port,
+        actions=render_actions(datapath, actions),
+        data=data)
+
+
+def _template(key, values, widths, build, masks=None):
+    """Template of a shape, compiled the first time the shape is seen"""
+
+    try:
+        return _templates[key]
+    except KeyError:
+        pass
+
+    if len(_templates) >= MAX_TEMPLATES:
+        return None
+
+    template = _templates[key] = _compile(values, widths, build, masks)
+    return template
+
+
+def _compile(values, widths, build, masks=None):
+    """Locate the variable fields of a shape in the messages Ryu builds
+
+    Args:
+        values (list): values of a message of the shape
+        widths (list): width in bytes of the field of each value
+        build (callable): builds the Ryu message of a list of values
+        masks (dictionary): mask of the values of masked match fields, by
+            index (Ryu only sends the bits of the value under the mask)
+
+    Returns:
+        Template: the template of the shape, or None if a field could not be
+            located
+    """
+
+    masks = masks or {}
+    reference = _serialize(build(values))
+
+    fields = []
+    flipped = []
+    for index, width in enumerate(widths):
+        mask = masks.get(index, (1 << 8 * width) - 1)
+        value = _flip(values[index], mask)
+        flipped.append(value)
+
+        variant = _serialize(build(values[:index] + [value] +
+                                   values[index + 1:]))
+        if len(variant) != len(reference):
+            return None
+
+        # The bytes of the field under the mask change, and nothing else does
+        octets = [i for i in range(width)
+                  if mask >> 8 * (width - 1 - i) & 0xff]
+        changed = [i for i in range(len(reference))
+                   if reference[i] != variant[i]]
+        if not changed:
+            return None
+        start = changed[0] - octets[0]
+        if changed != [start + i for i in octets]:
+            return None
+
+        fields.append((start, width, index, isinstance(value, str)))
+
+    fields.sort()
+    for field, following in zip(fields, fields[1:]):
+        if field[0] + field[1] > following[0]:
+            return None
+
+    template = Template(reference, fields)
+
+    # The fields are independent of each other
+    if (template.encode(values) != reference or
+            template.encode(flipped) != _serialize(build(flipped))):
+        return None
+
+    return template
+
+
+def _flow_shape(ofproto, flow, values, widths, masks):
+    """Shape of a Flow, adding its match and instruction values
+
+    The masks of the masked match fields are part of the shape.
+
+    Returns:
+        tuple: (match shape, instruction shape), or None if the flow has
+            values no template can hold
+    """
+
+    match = []
+    for name, value in flow.match:
+        mask = None
+        if isinstance(value, tuple):
+            value, mask = value
+
+        width = _match_width(ofproto, name, value)
+        if width is None:
+            return None
+
+        if mask is not None:
+            if _match_width(ofproto, name, mask) != width:
+                return None
+            bits = _to_int(mask)
+            masks[len(values)] = bits
+            value = _masked(value, bits)
+
+        values.append(value)
+        widths.append(width)
+        match.append((name, mask))
+
+    instructions = []
+    for instruction in flow.instructions:
+        if instruction[0] == APPLY:
+            names = []
+            for action in instruction[1]:
+                if not _add_values(_ACTION_WIDTHS, action, values, widths):
+                    return None
+                names.append(action[0])
+            instructions.append((APPLY, tuple(names)))
+        else:
+            if not _add_values(_INSTRUCTION_WIDTHS, instruction, values,
+                               widths):
+                return None
+            instructions.append(instruction[0])
+
+    return tuple(match), tuple(instructions)
+
+
+def _add_values(known, item, values, widths):
+    """Add the values of an instruction or action tuple
+
+    Returns:
+        bool: whether the tuple has the values its name calls for
+    """
+
+    item_widths = known.get(item[0])
+    if item_widths is None or len(item) != len(item_widths) + 1:
+        return False
+
+    for value in item[1:]:
+        if not isinstance(value, int):
+            return False
+
+    values.extend(item[1:])
+    widths.extend(item_widths)
+    return True
+
+
+def _match_width(ofproto, name, value):
+    """Width of the value of a match field (None if it can not be packed)"""
+
+    if isinstance(value, str):
+        # Only MACs in the xx:xx:xx:xx:xx:xx form
+        if len(value) != _MAC_LENGTH:
+            return None
+        return 6
+
+    if not isinstance(value, int):
+        return None
+
+    key = (ofproto.OFP_VERSION, name)
+    width = _match_widths.get(key)
+    if width is None:
+        try:
+            width = len(ofproto.oxm_from_user(name, value)[1])
+        except (KeyError, TypeError, ValueError):
+            return None
+        if width not in _FORMATS:
+            return None
+        _match_widths[key] = width
+
+    return width
+
+
+def _rebuild_flow(match, instructions, values):
+    """Flow of a shape with the given values (cookie first)"""
+
+    cookie, table_id, idle, hard, priority = values[:5]
+    index = 5
+
+    fields = {}
+    for name, mask in match:
+        if mask is None:
+            fields[name] = values[index]
+        else:
+            fields[name] = (values[index], mask)
+        index += 1
+
+    rebuilt = []
+    for instruction in instructions:
+        if isinstance(instruction, tuple):
+            actions, index = _rebuild_actions(instruction[1], values, index)
+            rebuilt.append((APPLY, tuple(actions)))
+        else:
+            count = len(_INSTRUCTION_WIDTHS[instruction])
+            rebuilt.append((instruction, ) +
+                           tuple(values[index:index + count]))
+            index += count
+
+    return Flow(table_id, priority, fields, rebuilt, idle, hard, cookie)
+
+
+def _rebuild_actions(names, values, index):
+    """Action tuples of a shape from values[index:]
+
+    Returns:
+        tuple: (actions, index of the next value)
+    """
+
+    actions = []
+    for name in names:
+        count = len(_ACTION_WIDTHS[name])
+        actions.append((name, ) + tuple(values[index:index + count]))
+        index += count
+
+    return actions, index
+
+
+def _flip(value, mask):
+    """Value with the bits of mask inverted"""
+
+    if isinstance(value, str):
+        return mactable.int_to_mac(mactable.mac_to_int(value) ^ mask)
+
+    return value ^ mask
+
+
+def _masked(value, mask):
+    """Bits of a value under a mask"""
+
+    if isinstance(value, str):
+        return mactable.int_to_mac(mactable.mac_to_int(value) & mask)
+
+    return value & mask
+
+
+def _to_int(value):
+    if isinstance(value, str):
+        return mactable.mac_to_int(value)
+
+    return value
+
+
+def _mac_to_bin(mac):
+    return bytes.fromhex(mac.replace(':', ''))
+
+
+def _serialize(msg):
+    """Encoded message, with xid 0"""
+
+    msg.set_xid(0)
+    msg.serialize()
+    return bytes(msg.buf)
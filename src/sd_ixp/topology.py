@@ -0,0 +1,393 @@
+# Copyright (C) 2018 [SD]RSiX Project
+#
+# Licensed under the Apache License, Version 2.0 (the “License”);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an “AS IS” BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Fabric topology discovered with LLDP
+
+The controller sends an LLDP frame through every port of every switch, naming
+the switch and the port it left through; when another switch of the fabric
+receives it, the frame comes back as a PacketIn and reveals a link between the
+two ports. Links are directed (each direction is seen by its own LLDP frame)
+and expire when their frames stop arriving, or right away when the port goes
+down.
+
+Paths are computed once per source switch (breadth first, fewest hops) and
+cached, so the next hop towards a switch is a dictionary lookup. The cache is
+invalidated incrementally: a link that goes away only drops the sources whose
+paths used it, and a new link only the sources it gives a shorter path to.
+
+A spanning tree of the fabric (rooted at the lowest datapath id) gives the
+ports broadcasts may be replicated through without loops.
+
+A frame naming a switch port could make any port a trunk, and traffic between
+switches would then be sent through it. The frames are therefore never sent
+through member ports (nor accepted from them, see IXP.lldp_received()), and
+they carry a tag authenticating the switch and port they name: an HMAC of
+both under a key only the controller knows (see new_key()).
+"""
+
+import collections
+import hashlib
+import hmac
+import os
+import struct
+import time
+
+from ryu.lib.packet import ethernet
+from ryu.lib.packet import lldp
+from ryu.lib.packet import packet
+from ryu.ofproto import ether
+
+# Seconds between LLDP rounds, and without LLDP frames after which a link is
+# considered gone
+LLDP_INTERVAL = 5
+LINK_TIMEOUT = 3 * LLDP_INTERVAL
+
+# Chassis ids of the LLDP frames of the controller
+_CHASSIS_PREFIX = b'dpid:'
+
+_PORT = struct.Struct('!I')
+
+# Organizationally specific TLV carrying the tag of the frames (OUI and
+# subtype), and bytes of the tag and of the keys
+_TAG_OUI = b'\x00\x00\x5d'
+_TAG_SUBTYPE = 1
+TAG_SIZE = 16
+KEY_SIZE = 32
+
+
+def new_key():
+    """Random key to tag the LLDP frames of a controller with"""
+    return os.urandom(KEY_SIZE)
+
+
+def _tag(key, chassis_id, port_id):
+    return hmac.new(key, chassis_id + port_id,
+                    hashlib.sha256).digest()[:TAG_SIZE]
+
+
+def lldp_frame(dpid, port, key, src='00:00:00:00:00:00'):
+    """LLDP frame announcing a switch port
+
+    Args:
+        dpid (int): datapath id of the switch
+        port (int): port the frame is sent through
+        key (bytes): key the frame is tagged with
+        src (str): source MAC address (usually the MAC of the port)
+
+    Returns:
+        bytes: the frame
+    """
+
+    chassis_id = _CHASSIS_PREFIX + b'%016x' % dpid
+    port_id = _PORT.pack(port)
+
+    pkt = packet.Packet()
+    pkt.add_protocol(ethernet.ethernet(
+        lldp.LLDP_MAC_NEAREST_BRIDGE, src, ether.ETH_TYPE_LLDP))
+    pkt.add_protocol(lldp.lldp([
+        lldp.ChassisID(subtype=lldp.ChassisID.SUB_LOCALLY_ASSIGNED,
+                       chassis_id=chassis_id),
+        lldp.PortID(subtype=lldp.PortID.SUB_PORT_COMPONENT,
+                    port_id=port_id),
+        lldp.TTL(ttl=LINK_TIMEOUT),
+        lldp.OrganizationallySpecific(oui=_TAG_OUI, subtype=_TAG_SUBTYPE,
+                                      info=_tag(key, chassis_id, port_id)),
+        lldp.End(),
+    ]))
+    pkt.serialize()
+
+    return bytes(pkt.data)
+
+
+def parse_lldp(data, key, offset=14):
+    """Switch and port an LLDP frame of the controller was sent through
+
+    Args:
+        data (bytes): the frame
+        key (bytes): key the frames of the controller are tagged with
+        offset (int): offset of the LLDP payload (after the Ethernet header)
+
+    Returns:
+        tuple: (dpid, port), or None if the frame is not from the controller
+            (or its tag does not match)
+    """
+
+    try:
+        tlvs, _, _ = lldp.lldp.parser(data[offset:])
+    except (struct.error, IndexError, ValueError):
+        return None
+
+    # Ryu's parser returns None for a frame cut short
+    if tlvs is None or len(tlvs.tlvs) < 2:
+        return None
+
+    chassis, port = tlvs.tlvs[0], tlvs.tlvs[1]
+    if (not isinstance(chassis, lldp.ChassisID) or
+            not isinstance(port, lldp.PortID) or
+            chassis.subtype != lldp.ChassisID.SUB_LOCALLY_ASSIGNED or
+            not chassis.chassis_id.startswith(_CHASSIS_PREFIX) or
+            port.subtype != lldp.PortID.SUB_PORT_COMPONENT or
+            len(port.port_id) != _PORT.size):
+        return None
+
+    tags = [tlv.info for tlv in tlvs.tlvs
+            if isinstance(tlv, lldp.OrganizationallySpecific) and
+            tlv.oui == _TAG_OUI and tlv.subtype == _TAG_SUBTYPE]
+    if len(tags) != 1 or not hmac.compare_digest(
+            tags[0], _tag(key, chassis.chassis_id, port.port_id)):
+        return None
+
+    try:
+        dpid = int(chassis.chassis_id[len(_CHASSIS_PREFIX):], 16)
+    except ValueError:
+        return None
+
+    return dpid, _PORT.unpack(port.port_id)[0]
+
+
+class Topology:
+    """Links between the switches of the fabric and the paths over them
+
+    Attributes:
+        version (int): incremented whenever the links change
+        _links (dictionary): destination (dpid, port) and last time seen of
+            each link, by source (dpid, port)
+        _adjacency (dictionary): per switch, the switch each port leads to
+        _paths (dictionary): per source switch, the cached next hops,
+            distances and links of its shortest path tree
+        _tree (dictionary): spanning tree ports per switch (None when stale)
+    """
+
+    def __init__(self):
+        self.version = 0
+
+        # Structure: { (dpid, port), (peer dpid, peer port, monotonic time) }
+        self._links = {}
+
+        # Structure: { dpid, { port, peer dpid } }
+        self._adjacency = collections.defaultdict(dict)
+
+        # Structure: { source dpid, ({ dpid, port }, { dpid, hops },
+        #                            set of (dpid, port) links) }
+        self._paths = {}
+
+        # Structure: { dpid, set of ports }
+        self._tree = None
+
+    def __len__(self):
+        return len(self._links)
+
+    def links(self):
+        """Links as ((dpid, port), (peer dpid, peer port)) pairs"""
+        return [(src, dst[:2]) for src, dst in self._links.items()]
+
+    def link_seen(self, dpid, port, peer, peer_port, now=None):
+        """Record a link (dpid, port) -> (peer, peer_port) seen by LLDP
+
+        Returns:
+            bool: whether the link is new (the paths changed)
+        """
+
+        if now is None:
+            now = time.monotonic()
+
+        src = (dpid, port)
+        current = self._links.get(src)
+        if current is not None and current[:2] == (peer, peer_port):
+            self._links[src] = (peer, peer_port, now)
+            return False
+
+        if current is not None:
+            self._remove(src)
+
+        self._links[src] = (peer, peer_port, now)
+        self._adjacency[dpid][port] = peer
+        self._link_added(dpid, peer)
+
+        return True
+
+    def port_down(self, dpid, port):
+        """Remove the links from and to a port
+
+        Returns:
+            bool: whether any link was removed
+        """
+
+        removed = [src for src, dst in self._links.items()
+                   if src == (dpid, port) or dst[:2] == (dpid, port)]
+        for src in removed:
+            self._remove(src)
+
+        return bool(removed)
+
+    def remove_switch(self, dpid):
+        """Remove the links from and to a switch
+
+        Returns:
+            bool: whether any link was removed
+        """
+
+        removed = [src for src, dst in self._links.items()
+                   if src[0] == dpid or dst[0] == dpid]
+        for src in removed:
+            self._remove(src)
+
+        self._adjacency.pop(dpid, None)
+        self._paths.pop(dpid, None)
+
+        return bool(removed)
+
+    def expire(self, now=None):
+        """Remove the links whose LLDP frames stopped arriving
+
+        Returns:
+            list: the (dpid, port) sources of the links removed
+        """
+
+        if now is None:
+            now = time.monotonic()
+
+        expired = [src for src, dst in self._links.items()
+                   if now - dst[2] > LINK_TIMEOUT]
+        for src in expired:
+            self._remove(src)
+
+        return expired
+
+    def trunk_ports(self, dpid):
+        """Ports of a switch that lead to other switches of the fabric
+
+        Returns:
+            dictionary: { port, peer dpid }
+        """
+        return dict(self._adjacency.get(dpid, {}))
+
+    def paths(self, dpid):
+        """Next hops from a switch to every switch it can reach
+
+        Returns:
+            dictionary: { destination dpid, output port }
+        """
+        return self._tree_from(dpid)[0]
+
+    def next_hop(self, src, dst):
+        """Port of src that leads to dst (None if dst is unreachable)"""
+        return self._tree_from(src)[0].get(dst)
+
+    def distance(self, src, dst):
+        """Hops from src to dst (None if dst is unreachable)"""
+        return self._tree_from(src)[1].get(dst)
+
+    def tree_ports(self, dpid):
+        """Ports of a switch that belong to the spanning tree of the fabric
+
+        Broadcasts replicated through the tree ports (and the edge ports)
+        reach every switch once.
+        """
+
+        if self._tree is None:
+            self._tree = self._spanning_tree()
+        return self._tree.get(dpid, set())
+
+    def _tree_from(self, source):
+        """Shortest path tree of a source switch (cached)"""
+
+        cached = self._paths.get(source)
+        if cached is not None:
+            return cached
+
+        next_hops = {}
+        hops = {source: 0}
+        used = set()
+        queue = collections.deque([source])
+
+        while queue:
+            dpid = queue.popleft()
+            for port, peer in sorted(self._adjacency.get(dpid, {}).items()):
+                if peer in hops:
+                    continue
+
+                hops[peer] = hops[dpid] + 1
+                next_hops[peer] = (port if dpid == source
+                                   else next_hops[dpid])
+                used.add((dpid, port))
+                queue.append(peer)
+
+        cached = self._paths[source] = (next_hops, hops, used)
+        return cached
+
+    def _spanning_tree(self):
+        """Ports of a breadth first spanning tree of every connected part"""
+
+        tree = collections.defaultdict(set)
+        visited = set()
+
+        for root in sorted(self._adjacency):
+            if root in visited:
+                continue
+
+            visited.add(root)
+            queue = collections.deque([root])
+            while queue:
+                dpid = queue.popleft()
+                for port, peer in sorted(self._adjacency[dpid].items()):
+                    if peer in visited:
+                        continue
+
+                    # The tree needs both directions of the link
+                    back = self._port_to(peer, dpid)
+                    if back is None:
+                        continue
+
+                    visited.add(peer)
+                    tree[dpid].add(port)
+                    tree[peer].add(back)
+                    queue.append(peer)
+
+        return dict(tree)
+
+    def _port_to(self, dpid, peer):
+        for port, other in sorted(self._adjacency.get(dpid, {}).items()):
+            if other == peer:
+                return port
+        return None
+
+    def _remove(self, src):
+        peer = self._links.pop(src)[0]
+
+        ports = self._adjacency.get(src[0])
+        if ports is not None:
+            ports.pop(src[1], None)
+
+        # Only the trees that used the link change
+        for source, cached in list(self._paths.items()):
+            if src in cached[2]:
+                del self._paths[source]
+
+        self._changed()
+        return peer
+
+    def _link_added(self, dpid, peer):
+        # Only the trees the link gives a shorter path to change
+        for source, cached in list(self._paths.items()):
+            hops = cached[1]
+            if dpid in hops and (peer not in hops or
+                                 hops[peer] > hops[dpid] + 1):
+                del self._paths[source]
+
+        self._changed()
+
+    def _changed(self):
+        self.version += 1
+        self._tree = None
@@ -0,0 +1,151 @@
+# Copyright (C) 2018 [SD]RSiX Project
+#
+# Licensed under the Apache License, Version 2.0 (the “License”);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an “AS IS” BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Changes applied to several switches at once
+
+A registry change (e.g. a new VLAN) is sent to all the switches it affects
+without waiting for any of them, so it takes one round trip however many
+switches there are. The Completions of the switches (see sd_ixp.flowqueue) are
+gathered in a Transaction, which commits when every switch confirmed the
+change with its barrier reply. When any switch reports an error, or does not
+reply in time, the Transaction calls its rollback, which restores the previous
+registry and brings the switches back to it.
+
+Transactions are resolved by the barrier replies, in the event loop: callers
+must not wait for them in an event handler, but use add_done_callback().
+"""
+
+from ryu.lib import hub
+
+# Seconds the switches have to confirm a change
+DEFAULT_TIMEOUT = 5
+
+# States
+PENDING = 'pending'
+COMMITTED = 'committed'
+ROLLED_BACK = 'rolled back'
+
+
+class Transaction:
+    """A change sent to several switches, committed or rolled back as a whole
+
+    Attributes:
+        description (str): what the change is (for logs)
+        state (str): PENDING, COMMITTED or ROLLED_BACK
+        errors (dictionary): { datapath_id, [ OFPErrorMsg ] } of the switches
+            that failed (an empty list means the switch did not reply in time)
+        _rollback (callable): undoes the change
+        _pending (dictionary): Completions not resolved yet, by datapath id
+    """
+
+    def __init__(self, description, rollback, timeout=DEFAULT_TIMEOUT):
+        self.description = description
+        self.state = PENDING
+        self.errors = {}
+        self._rollback = rollback
+        self._timeout = timeout
+
+        # Structure: { datapath_id, Completion }
+        self._pending = {}
+
+        self._started = False
+        self._timer = None
+        self._event = hub.Event()
+        self._callbacks = []
+
+    def add(self, dpid, completion):
+        """Add the Completion of the change on a switch"""
+
+        self._pending[dpid] = completion
+        completion.add_done_callback(
+            lambda completion: self._resolved(dpid, completion))
+
+    def start(self):
+        """Start waiting for the switches (called once every switch was added)
+
+        Returns:
+            Transaction: self
+        """
+
+        self._started = True
+        if self.state == PENDING:
+            if self._pending:
+                self._timer = hub.spawn_after(self._timeout, self._expired)
+            else:
+                self._finish()
+
+        return self
+
+    def done(self):
+        """Whether the Transaction committed or rolled back"""
+        return self.state != PENDING
+
+    @property
+    def ok(self):
+        """Whether every switch applied the change"""
+        return self.state == COMMITTED
+
+    def wait(self, timeout=None):
+        """Wait until the Transaction resolves (not from an event handler)
+
+        Returns:
+            bool: True if it resolved, False if the timeout expired
+        """
+        return self._event.wait(timeout)
+
+    def add_done_callback(self, callback):
+        """Call callback(transaction) when the Transaction resolves"""
+
+        if self.done():
+            callback(self)
+        else:
+            self._callbacks.append(callback)
+
+    def _resolved(self, dpid, completion):
+        if self._pending.pop(dpid, None) is None or self.done():
+            return
+
+        if not completion.ok:
+            self.errors[dpid] = list(completion.errors)
+
+        if self._started and not self._pending:
+            self._finish()
+
+    def _expired(self):
+        # Called by the timer thread: _finish() must not kill it
+        self._timer = None
+        if self.done():
+            return
+
+        for dpid in self._pending:
+            self.errors[dpid] = []
+        self._pending.clear()
+        self._finish()
+
+    def _finish(self):
+        if self._timer is not None:
+            hub.kill(self._timer)
+            self._timer = None
+
+        if self.errors:
+            self.state = ROLLED_BACK
+            self._rollback()
+        else:
+            self.state = COMMITTED
+
+        self._event.set()
+
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
@@ -0,0 +1,112 @@
+# Copyright (C) 2018 [SD]RSiX Project
+#
+# Licensed under the Apache License, Version 2.0 (the “License”);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an “AS IS” BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Provisioned VLANs between members
+
+Besides the VLANs a member's ports carry for the IXP peering LAN (see
+sd_ixp.member), members get VLANs of their own: bilateral VLANs between two
+members (private interconnects) and multilateral VLANs among a group of them.
+Only the members of a VLAN have entries for it, so its traffic never reaches
+other members. They are declared in the member registry file as well:
+
+    {
+        "members": [ ... ],
+        "vlans": [
+            {
+                "vid": 3001,
+                "kind": "bilateral",
+                "members": [65001, 65002],
+                "name": "AS65001-AS65002 PNI"
+            }
+        ]
+    }
+
+The VLANs are tagged on every port of their members.
+"""
+
+import json
+
+MULTILATERAL = 'multilateral'
+BILATERAL = 'bilateral'
+
+
+class VLAN:
+    """A VLAN provisioned between members
+
+    Attributes:
+        vid (int): VLAN id
+        kind (str): BILATERAL or MULTILATERAL
+        asns (tuple): sorted AS numbers of the members
+        name (str): description
+    """
+
+    def __init__(self, vid, asns, kind=MULTILATERAL, name=''):
+        self.vid = int(vid)
+        self.asns = tuple(sorted(set(int(asn) for asn in asns)))
+        self.kind = kind
+        self.name = name
+
+        if not 0 < self.vid < 4095:
+            raise ValueError('invalid VLAN id %d' % self.vid)
+
+        if kind == BILATERAL:
+            if len(self.asns) != 2:
+                raise ValueError('bilateral VLAN %d must have 2 members, not '
+                                 '%d' % (self.vid, len(self.asns)))
+        elif kind == MULTILATERAL:
+            if not self.asns:
+                raise ValueError('VLAN %d has no members' % self.vid)
+        else:
+            raise ValueError('VLAN %d: invalid kind %r' % (self.vid, kind))
+
+    def __repr__(self):
+        return 'VLAN(vid=%d, kind=%s, asns=%r)' % (self.vid, self.kind,
+                                                   self.asns)
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build a VLAN from its registry (JSON) representation"""
+
+        try:
+            return cls(vid=data['vid'], asns=data['members'],
+                       kind=data.get('kind', MULTILATERAL),
+                       name=data.get('name', ''))
+        except (KeyError, TypeError) as e:
+            raise ValueError('invalid VLAN %r: %s' % (data, e))
+
+    def to_dict(self):
+        """Registry (JSON) representation of the VLAN"""
+
+        return {
+            'vid': self.vid,
+            'kind': self.kind,
+            'members': list(self.asns),
+            'name': self.name,
+        }
+
+
+def load_vlans(path):
+    """Load the VLANs declared in a registry file
+
+    Args:
+        path (str): path of the JSON registry
+
+    Returns:
+        list: VLAN objects
+    """
+
+    with open(path) as f:
+        data = json.load(f)
+
+    return [VLAN.from_dict(vlan) for vlan in data.get('vlans', [])]
@@ -0,0 +1,79 @@
+# Copyright (C) 2018 [SD]RSiX Project
+#
+# Licensed under the Apache License, Version 2.0 (the “License”);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an “AS IS” BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Fixtures of the tests
+
+The modules are imported from src, as Ryu loads the apps, and the switches
+are the fake datapaths of the benchmark (see bench/fakedp.py), which record
+the messages sent to them.
+"""
+
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(_ROOT, 'src'), os.path.join(_ROOT, 'bench')]
+
+from ryu.lib import hub  # noqa: E402
+
+# Green sockets, as ryu-manager patches them
+hub.patch(thread=False)
+
+import fakedp  # noqa: E402
+from sd_ixp.switch import Switch  # noqa: E402
+
+
+@pytest.fixture
+def connect():
+    """connect(dpid=1, **kwargs): a Switch on a FakeDatapath, and the
+    datapath (its messages are recorded)"""
+
+    switches = []
+
+    def connect(dpid=1, **kwargs):
+        datapath = fakedp.FakeDatapath(dpid, record=True)
+        switch = Switch(datapath, **kwargs)
+        switches.append(switch)
+
+        # Let the outbound buffer write to the datapath
+        hub.sleep(0)
+        return switch, datapath
+
+    yield connect
+
+    for switch in switches:
+        switch.close()
+
+
+@pytest.fixture
+def reply():
+    """reply(switch, datapath, errors=()): reply the barriers sent to a
+    switch, after an error for each xid in errors"""
+
+    def reply(switch, datapath, errors=()):
+        hub.sleep(0)
+
+        for xid in errors:
+            switch.error(SimpleNamespace(xid=xid, type=1, code=0))
+
+        barriers = [msg for msg in datapath.messages
+                    if msg.name == 'OFPBarrierRequest']
+        datapath.messages = []
+        for barrier in barriers:
+            switch.barrier_reply(SimpleNamespace(xid=barrier.xid))
+
+    return reply
@@ -0,0 +1,78 @@
+# Copyright (C) 2018 [SD]RSiX Project
+#
+# Licensed under the Apache License, Version 2.0 (the “License”);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an “AS IS” BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from sd_ixp import allowlist
+from sd_ixp.allowlist import MACAllowlist
+from sd_ixp.member import Member
+
+MAC1 = 0x020000000001
+OTHER = 0x020000000099
+
+
+def _allowlist(**kwargs):
+    macs = MACAllowlist(**kwargs)
+    macs.add_member(Member(65001, ports=[(1, 1), (2, 1)],
+                           macs=['02:00:00:00:00:01']))
+    return macs
+
+
+def test_member_ports_accept_only_their_macs():
+    macs = _allowlist()
+
+    assert len(macs) == 2
+    assert macs.allowed(1, 1, MAC1) and macs.allowed(2, 1, MAC1)
+    assert not macs.allowed(1, 1, OTHER)
+    # Ports without a member accept any source
+    assert macs.allowed(1, 2, OTHER)
+    assert macs.check(1, 2, OTHER) == allowlist.ALLOW
+
+
+def test_first_frame_of_a_source_blocks_it():
+    macs = _allowlist(block_duration=10)
+
+    assert macs.check(1, 1, OTHER, now=0) == allowlist.BLOCK
+    assert macs.check(1, 1, OTHER, now=1) == allowlist.DENY
+    # Blocked again once the drop entry expired
+    assert macs.check(1, 1, OTHER, now=11) == allowlist.BLOCK
+    assert (macs.denied, macs.blocked) == (3, 2)
+
+
+def test_blocked_sources_are_bounded_per_port():
+    macs = _allowlist(max_per_port=2)
+
+    assert [macs.check(1, 1, OTHER + i, now=0) for i in range(3)] == [
+        allowlist.BLOCK, allowlist.BLOCK, allowlist.DENY]
+    assert macs.check(2, 1, OTHER, now=0) == allowlist.BLOCK
+
+
+def test_removed_member_lifts_the_restriction():
+    macs = _allowlist()
+    macs.check(1, 1, OTHER, now=0)
+    member = Member(65001, ports=[(1, 1), (2, 1)])
+    macs.remove_member(member)
+
+    assert len(macs) == 0
+    assert macs.check(1, 1, OTHER) == allowlist.ALLOW
+    # The sources blocked on its ports are forgotten too
+    assert not macs._blocked
+
+
+def test_forget_switch():
+    macs = _allowlist()
+    macs.check(1, 1, OTHER, now=0)
+    macs.check(2, 1, OTHER, now=0)
+    macs.forget(1)
+
+    assert macs.check(1, 1, OTHER, now=1) == allowlist.BLOCK
+    assert macs.check(2, 1, OTHER, now=1) == allowlist.DENY
@@ -0,0 +1,61 @@
+# Copyright (C) 2018 [SD]RSiX Project
+#
+# Licensed under the Apache License, Version 2.0 (the “License”);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an “AS IS” BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import struct
+
+import pytest
+
+from sd_ixp import classifier
+
+_DST = bytes.fromhex('ffffffffffff')
+_SRC = bytes.fromhex('020000000001')
+
+
+def _frame(ethertype, payload=b'', vlans=()):
+    tags = b''.join(struct.pack('!HH', tpid, vid) for tpid, vid in vlans)
+    return _DST + _SRC + tags + struct.pack('!H', ethertype) + payload
+
+
+def _icmpv6(icmp_type):
+    header = bytearray(40)
+    header[6] = classifier.IPPROTO_ICMPV6
+    return bytes(header) + bytes([icmp_type]) + bytes(23)
+
+
+@pytest.mark.parametrize('frame, kind', [
+    (_frame(0x0806, bytes(28)), classifier.ARP),
+    (_frame(0x0800, bytes(20)), classifier.IPV4),
+    (_frame(0x88cc, bytes(10)), classifier.LLDP),
+    (_frame(0x86dd, _icmpv6(classifier.ICMPV6_NS)), classifier.ND_NS),
+    (_frame(0x86dd, _icmpv6(classifier.ICMPV6_NA)), classifier.ND_NA),
+    (_frame(0x86dd, _icmpv6(128)), classifier.IPV6),
+    (_frame(0x86dd, bytes(10)), classifier.IPV6),
+    (_frame(0x88b5), classifier.OTHER),
+    (_DST + _SRC, classifier.IGNORE),
+])
+def test_classify(frame, kind):
+    assert classifier.classify(frame)[0] == kind
+
+
+def test_vlan_tags():
+    frame = _frame(0x0806, bytes(28), vlans=[(0x88a8, 0x2064),
+                                             (0x8100, 0x00c8)])
+    assert classifier.classify(frame) == (classifier.ARP, 100, 22)
+    assert classifier.classify(frame[:16])[0] == classifier.IGNORE
+
+
+def test_addresses():
+    frame = _frame(0x0800)
+    assert classifier.eth_dst(frame) == 0xffffffffffff
+    assert classifier.eth_src(frame) == 0x020000000001
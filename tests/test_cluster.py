@@ -0,0 +1,129 @@
+# Copyright (C) 2018 [SD]RSiX Project
+#
+# Licensed under the Apache License, Version 2.0 (the “License”);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an “AS IS” BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import socket
+
+from ryu.lib import hub
+
+from sd_ixp import cluster
+
+
+def _ring_owners(nodes, dpids):
+    ring = cluster.HashRing(nodes)
+    return {dpid: ring.owner(dpid) for dpid in dpids}
+
+
+def test_hash_ring_spreads_and_is_stable():
+    dpids = range(1, 1001)
+    owners = _ring_owners(['a', 'b', 'c'], dpids)
+
+    assert set(owners.values()) == {'a', 'b', 'c'}
+    assert owners == _ring_owners(['c', 'b', 'a'], dpids)
+
+
+def test_hash_ring_only_moves_switches_of_removed_node():
+    dpids = range(1, 1001)
+    before = _ring_owners(['a', 'b', 'c'], dpids)
+    after = _ring_owners(['a', 'b'], dpids)
+
+    assert all(after[dpid] == owner for dpid, owner in before.items()
+               if owner != 'c')
+    assert cluster.HashRing([]).owner(1) is None
+
+
+def test_valid():
+    nodes = {'c1', 'c2'}
+    learn = {'type': cluster.LEARN, 'node': 'c2', 'dpid': 1, 'mac': 2,
+             'vlan': None, 'port': 3}
+    neighbor = {'type': cluster.NEIGHBOR, 'node': 'c2', 'ip': '10.0.0.1',
+                'mac': '02:00:00:00:00:01', 'dpid': 1, 'port': 3,
+                'vlan': 100, 'router': True}
+
+    assert cluster.valid(learn, nodes)
+    assert cluster.valid(neighbor, nodes)
+    assert cluster.valid({'type': cluster.HEARTBEAT, 'node': 'c1'}, nodes)
+
+    assert not cluster.valid([], nodes)
+    assert not cluster.valid({'type': 'other', 'node': 'c2'}, nodes)
+    assert not cluster.valid(dict(learn, node='c9'), nodes)
+    assert not cluster.valid({k: v for k, v in learn.items() if k != 'dpid'},
+                             nodes)
+    assert not cluster.valid(dict(learn, port='3'), nodes)
+    assert not cluster.valid(dict(learn, port=True), nodes)
+    assert not cluster.valid(dict(neighbor, ip='10.0.0.300'), nodes)
+    assert not cluster.valid(dict(neighbor, router=1), nodes)
+
+
+def test_unknown_node_heartbeat_is_ignored():
+    backend = cluster.LocalBackend()
+    received = []
+    node = cluster.Cluster('c1', ['c1', 'c2'], backend,
+                           on_message=received.append)
+
+    backend.send('c9', {'type': cluster.HEARTBEAT, 'node': 'c9'})
+    backend.send('c2', {'type': cluster.LEARN, 'node': 'c2', 'dpid': 1})
+
+    assert 'c9' not in node._seen
+    assert received == []
+
+
+def _port(sock):
+    return sock.getsockname()[1]
+
+
+def test_udp_backend_accepts_only_signed_messages_of_peers():
+    # Reserve two ports
+    probes = [socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+              for _ in range(2)]
+    for probe in probes:
+        probe.bind(('127.0.0.1', 0))
+    a, b = [('127.0.0.1', _port(probe)) for probe in probes]
+    for probe in probes:
+        probe.close()
+
+    received = []
+    receiver = cluster.UDPBackend(b, {'c1': a}, b'secret')
+    receiver.attach('c2', received.append)
+    sender = cluster.UDPBackend(a, {'c2': b}, b'secret')
+
+    stranger = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    stranger.bind(('127.0.0.1', 0))
+    try:
+        heartbeat = {'type': cluster.HEARTBEAT, 'node': 'c1'}
+
+        # Unsigned, from an unknown address, and another node's name
+        sender._socket.sendto(json.dumps(heartbeat).encode(), b)
+        stranger.sendto(b'x' * 40, b)
+        sender.send('c1', {'type': cluster.HEARTBEAT, 'node': 'c3'})
+        sender.send('c1', heartbeat)
+
+        for _ in range(100):
+            hub.sleep(0.01)
+            if received:
+                break
+
+        assert received == [heartbeat]
+        assert receiver.dropped == 3
+    finally:
+        stranger.close()
+        sender.close()
+        receiver.close()
+
+
+def test_derive_key():
+    assert cluster.derive_key(b's', b'lldp') == cluster.derive_key(b's',
+                                                                   b'lldp')
+    assert cluster.derive_key(b's', b'lldp') != cluster.derive_key(b't',
+                                                                   b'lldp')
@@ -0,0 +1,43 @@
+# Copyright (C) 2018 [SD]RSiX Project
+#
+# Licensed under the Apache License, Version 2.0 (the “License”);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an “AS IS” BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from sd_ixp import compiler
+from sd_ixp.member import Member
+
+
+def _keys(flows):
+    return [flow.key for flow in flows]
+
+
+def test_member_port_entries_have_distinct_keys():
+    member = Member(65001, ports=[(1, 1)], macs=['02:00:00:00:00:01'],
+                    vlans=[100])
+
+    # A provisioned VLAN that is also a VLAN of the member
+    flows = compiler.compile_member_port(member, 1, vlans=[200, 100])
+    keys = _keys(flows)
+
+    assert len(keys) == len(set(keys))
+    assert keys == _keys(compiler.compile_member_port(member, 1,
+                                                      vlans=[200]))
+
+
+def test_untagged_member_port_matches_provisioned_vlans():
+    member = Member(65001, ports=[(1, 1)], macs=['02:00:00:00:00:01'])
+    flows = compiler.compile_member_port(member, 1, vlans=[300, 200, 300])
+
+    vids = [dict(flow.match).get('vlan_vid')
+            for flow in flows if flow.table_id == compiler.PIPELINE.vlan]
+    assert vids == [compiler.vlan_vid_of(None), compiler.vlan_vid_of(200),
+                    compiler.vlan_vid_of(300)]
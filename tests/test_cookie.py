@@ -0,0 +1,36 @@
+# Copyright (C) 2018 [SD]RSiX Project
+#
+# Licensed under the Apache License, Version 2.0 (the “License”);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an “AS IS” BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from sd_ixp import cookie as cookies
+
+
+def _deleted(value):
+    return sum(value & mask == cookie for cookie, mask in cookies.foreign())
+
+
+def test_foreign_matches_every_other_owner_once():
+    for owner in range(256):
+        value = owner << 56 | 0x123456789abc
+        assert _deleted(value) == (owner != 0x5d)
+
+
+def test_foreign_spares_the_controller():
+    assert not _deleted(cookies.make(cookies.MEMBER, 65001, 3))
+    assert not _deleted(cookies.OWNER)
+
+
+def test_parse():
+    value = cookies.make(cookies.LEARNED, 65001, 0x1ffff)
+    assert cookies.parse(value) == (cookies.LEARNED, 65001, 0xffff)
+    assert cookies.parse(0) is None
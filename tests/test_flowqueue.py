@@ -0,0 +1,134 @@
+# Copyright (C) 2018 [SD]RSiX Project
+#
+# Licensed under the Apache License, Version 2.0 (the “License”);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an “AS IS” BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from types import SimpleNamespace
+
+import fakedp
+from ryu.lib import hub
+from ryu.ofproto import ofproto_v1_4, ofproto_v1_4_parser
+
+from sd_ixp import flowqueue
+from sd_ixp.flowqueue import FlowQueue
+
+
+def _queue(**kwargs):
+    datapath = fakedp.FakeDatapath(1, record=True)
+    return FlowQueue(datapath, **kwargs), datapath
+
+
+def _msg(datapath):
+    return datapath.ofproto_parser.OFPEchoRequest(datapath)
+
+
+def _barriers(datapath):
+    return [msg.xid for msg in datapath.messages
+            if msg.name == 'OFPBarrierRequest']
+
+
+def test_full_batch_is_flushed_with_a_barrier():
+    queue, datapath = _queue(max_batch=3, max_delay=60)
+    first = [queue.put(_msg(datapath)) for _ in range(3)]
+    second = queue.put(_msg(datapath))
+
+    assert first[0] is first[1] is first[2]
+    assert second is not first[0]
+    assert [msg.name for msg in datapath.messages] == [
+        'OFPEchoRequest'] * 3 + ['OFPBarrierRequest']
+    assert len(queue) == 1 and queue.pending() == 1
+
+    queue.close()
+
+
+def test_old_batch_is_flushed():
+    queue, datapath = _queue(max_delay=0.01)
+    completion = queue.put(_msg(datapath))
+    assert not datapath.messages
+
+    hub.sleep(0.05)
+    assert len(_barriers(datapath)) == 1
+    assert not completion.done()
+
+    queue.barrier_reply(SimpleNamespace(xid=_barriers(datapath)[0]))
+    assert completion.done() and completion.ok
+
+
+def test_errors_go_to_the_completion_of_their_batch():
+    queue, datapath = _queue(max_batch=2, max_delay=60)
+    first = queue.put(_msg(datapath))
+    queue.put(_msg(datapath))
+    second = queue.put(_msg(datapath))
+    queue.flush()
+
+    failed = datapath.messages[1].xid
+    assert queue.error(SimpleNamespace(xid=failed))
+    assert not queue.error(SimpleNamespace(xid=failed + 1000))
+
+    for xid in _barriers(datapath):
+        assert queue.barrier_reply(SimpleNamespace(xid=xid))
+
+    assert not first.ok and len(first.errors) == 1
+    assert second.ok
+
+
+def test_gather_waits_for_every_batch_and_collects_their_errors():
+    queue, datapath = _queue(max_batch=2, max_delay=60)
+    completions = [queue.put(_msg(datapath)) for _ in range(5)]
+    completions.append(queue.flush())
+    gathered = flowqueue.gather(completions)
+
+    queue.error(SimpleNamespace(xid=datapath.messages[0].xid))
+    barriers = _barriers(datapath)
+    assert len(barriers) == 3
+
+    for xid in barriers[:-1]:
+        queue.barrier_reply(SimpleNamespace(xid=xid))
+    assert not gathered.done()
+
+    queue.barrier_reply(SimpleNamespace(xid=barriers[-1]))
+    assert gathered.done()
+    assert not gathered.ok and len(gathered.errors) == 1
+
+
+def test_gather_of_a_single_completion_is_itself():
+    queue, datapath = _queue()
+    completion = queue.flush()
+    assert flowqueue.gather([completion, completion]) is completion
+
+
+def test_close_cancels_pending_completions():
+    queue, datapath = _queue(max_batch=2, max_delay=60)
+    sent = queue.put(_msg(datapath))
+    queue.put(_msg(datapath))
+    queued = queue.put(_msg(datapath))
+    gathered = flowqueue.gather([sent, queued])
+
+    queue.close()
+
+    assert sent.cancelled and queued.cancelled
+    assert gathered.done() and gathered.cancelled
+    assert len(queue) == 0 and queue.pending() == 0
+
+
+def test_batches_are_bundles_on_openflow_14():
+    datapath = fakedp.FakeDatapath(1, ofproto=ofproto_v1_4,
+                                   ofproto_parser=ofproto_v1_4_parser,
+                                   record=True)
+    queue = FlowQueue(datapath, max_delay=60)
+    queue.put(_msg(datapath))
+    queue.put(_msg(datapath))
+    queue.flush()
+
+    assert [msg.name for msg in datapath.messages] == [
+        'OFPBundleCtrlMsg', 'OFPBundleAddMsg', 'OFPBundleAddMsg',
+        'OFPBundleCtrlMsg', 'OFPBarrierRequest']
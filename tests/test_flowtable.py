@@ -0,0 +1,66 @@
+# Copyright (C) 2018 [SD]RSiX Project
+#
+# Licensed under the Apache License, Version 2.0 (the “License”);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an “AS IS” BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from sd_ixp import cookie as cookies
+from sd_ixp import flow
+from sd_ixp.flow import Flow
+from sd_ixp.flowtable import FlowTable
+
+
+def _flow(port=1, out=2, **kwargs):
+    return Flow(0, 10, {'in_port': port}, [flow.output(out)], **kwargs)
+
+
+def test_diff_of_identical_tables_is_empty():
+    table = FlowTable([_flow(1), _flow(2)])
+    assert len(table.diff([_flow(2), _flow(1)])) == 0
+
+
+def test_diff_adds_modifies_and_deletes():
+    table = FlowTable([_flow(1), _flow(2), _flow(3)])
+    diff = table.diff([_flow(1), _flow(2, out=9), _flow(4)])
+
+    assert diff.add == [_flow(4)]
+    assert diff.modify == [_flow(2, out=9)]
+    assert diff.delete == [_flow(3)]
+
+
+def test_diff_replaces_entries_of_another_cookie():
+    table = FlowTable([_flow(1)])
+    desired = _flow(1, cookie=cookies.make(cookies.MEMBER, 65001, 2))
+
+    diff = table.diff([desired])
+    assert diff.add == [desired]
+    assert not diff.modify and not diff.delete
+
+
+def test_diff_replaces_entries_with_other_timeouts():
+    table = FlowTable([_flow(1), _flow(2, hard_timeout=60)])
+    desired = [_flow(1, idle_timeout=30), _flow(2, hard_timeout=120)]
+
+    diff = table.diff(desired)
+    assert diff.add == desired
+    assert not diff.modify and not diff.delete
+
+
+def test_table_tracks_entries_by_key():
+    table = FlowTable([_flow(1)])
+    table.add(_flow(1, out=3))
+
+    assert len(table) == 1
+    assert _flow(1, out=3) in table
+    assert _flow(1) not in table
+
+    table.remove(_flow(1, out=7))
+    assert len(table) == 0
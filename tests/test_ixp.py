@@ -0,0 +1,45 @@
+# Copyright (C) 2018 [SD]RSiX Project
+#
+# Licensed under the Apache License, Version 2.0 (the “License”);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an “AS IS” BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from sd_ixp.ixp import IXP
+from sd_ixp.member import Member
+from sd_ixp.vlan import VLAN
+
+
+def test_registry_is_validated_at_load():
+    with pytest.raises(ValueError):
+        IXP([Member(65001, ports=[(1, 1)]), Member(65002, ports=[(1, 1)])])
+    with pytest.raises(ValueError):
+        IXP([Member(65001, macs=['02:00:00:00:00:01']),
+             Member(65002, macs=['02:00:00:00:00:01'])])
+    with pytest.raises(ValueError):
+        IXP([Member(65001, ports=[(1, 1)]), Member(65001, ports=[(1, 2)])])
+    with pytest.raises(ValueError):
+        IXP([Member(65001, ports=[(1, 1)])], vlans=[VLAN(100, [65001, 65009])])
+
+
+def test_program_forgets_ports_of_removed_members(connect, reply):
+    ixp = IXP([Member(65001, ports=[(1, 1)]), Member(65002, ports=[(1, 2)])])
+    switch, datapath = connect()
+    ixp.add_switch(switch, program=False)
+    ixp.program(switch)
+    reply(switch, datapath)
+    assert switch._ports == {1: 65001, 2: 65002}
+
+    ixp.remove_member(65002)
+    ixp.program(switch)
+    reply(switch, datapath)
+    assert switch._ports == {1: 65001}
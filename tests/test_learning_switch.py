@@ -0,0 +1,63 @@
+# Copyright (C) 2018 [SD]RSiX Project
+#
+# Licensed under the Apache License, Version 2.0 (the “License”);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an “AS IS” BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+from ryu import cfg
+from ryu.controller import ofp_event
+from ryu.lib import hub
+
+import fakedp
+import generators
+import learning_switch_13
+
+CONF = cfg.CONF
+
+
+@pytest.fixture
+def app():
+    CONF.set_override('mac_max_per_port', 2, group='learning')
+    app = learning_switch_13.LearningSwitch()
+    yield app
+    for thread in app.threads:
+        hub.kill(thread)
+    CONF.clear_override('mac_max_per_port', group='learning')
+
+
+def _packet_in(app, datapath, port, src, dst):
+    frame = generators.unicast(generators.host_mac(src),
+                               generators.host_mac(dst))
+    app._packet_in_handler(
+        ofp_event.EventOFPPacketIn(datapath.packet_in(frame, port)))
+
+
+def test_learned_macs_are_bounded_per_port(app):
+    datapath = fakedp.FakeDatapath(1, record=True)
+    for src in range(3):
+        _packet_in(app, datapath, 1, src, 9)
+    _packet_in(app, datapath, 2, 9, 2)
+
+    table = app.mac_to_port[1]
+    assert table.port_count(1) == 2
+    assert table.counters['rejected_port_full'] == 1
+    # Frames to the MAC that was not learned are flooded
+    assert datapath.sent['EncodedFlowMod'] == 0
+
+
+def test_learned_macs_are_forwarded_to(app):
+    datapath = fakedp.FakeDatapath(1, record=True)
+    _packet_in(app, datapath, 1, 0, 9)
+    _packet_in(app, datapath, 2, 9, 0)
+
+    assert len(app.mac_to_port[1]) == 2
+    assert datapath.sent['EncodedFlowMod'] == 1
@@ -0,0 +1,101 @@
+# Copyright (C) 2018 [SD]RSiX Project
+#
+# Licensed under the Apache License, Version 2.0 (the “License”);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an “AS IS” BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from ryu.lib.packet import ethernet
+from ryu.lib.packet import icmpv6
+from ryu.lib.packet import in_proto
+from ryu.lib.packet import ipv6
+from ryu.lib.packet import packet
+
+from sd_ixp import neighbor
+from sd_ixp.ixp import IXP
+from sd_ixp.member import Member
+
+MAC1 = '02:00:00:00:00:01'
+MAC2 = '02:00:00:00:00:02'
+
+
+def _table():
+    ixp = IXP([Member(65001, ports=[(1, 1)], macs=[MAC1]),
+               Member(65002, ports=[(1, 2)], macs=[MAC2])])
+    return neighbor.NeighborTable(allowed=ixp.neighbor_allowed)
+
+
+def test_learn_checks_the_registry():
+    table = _table()
+
+    assert table.learn('10.0.0.1', MAC1, 1, 1) is not None
+    # A member MAC from another member's port, or from a port without member
+    assert table.learn('10.0.0.2', MAC1, 1, 2) is None
+    assert table.learn('10.0.0.2', MAC1, 1, 9) is None
+    # An unregistered MAC on a member port
+    assert table.learn('10.0.0.3', '02:00:00:00:00:09', 1, 1) is None
+    # An unregistered MAC on a port without member
+    assert table.learn('10.0.0.4', '02:00:00:00:00:09', 1, 9) is not None
+
+    assert table.rejected == 3
+
+
+def test_binding_is_not_taken_over_from_another_port():
+    table = _table()
+    table.learn('10.0.0.1', MAC1, 1, 1)
+
+    assert table.learn('10.0.0.1', MAC2, 1, 2) is None
+    assert table.lookup('10.0.0.1').mac == MAC1
+
+    # The port it was learned on may change it
+    table.allowed = None
+    assert table.learn('10.0.0.1', MAC2, 1, 1).mac == MAC2
+
+
+def test_listener_gets_new_and_changed_bindings():
+    changed = []
+    table = neighbor.NeighborTable(listener=changed.append)
+    table.learn('2001:db8::1', MAC1, 1, 1)
+    table.learn('2001:db8::1', MAC1, 1, 1)
+    table.learn('2001:db8::1', MAC1, 1, 1, router=True)
+    table.learn('2001:db8::2', MAC2, 1, 2, notify=False)
+
+    assert [(entry.ip, entry.router) for entry in changed] == [
+        ('2001:db8::1', True), ('2001:db8::1', True)]
+
+
+def _solicitation_reply(table):
+    pkt = packet.Packet()
+    pkt.add_protocol(ethernet.ethernet(
+        ethertype=0x86dd, dst='33:33:ff:00:00:01', src=MAC2))
+    pkt.add_protocol(ipv6.ipv6(nxt=in_proto.IPPROTO_ICMPV6,
+                               src='2001:db8::2', dst='ff02::1:ff00:1'))
+    pkt.add_protocol(icmpv6.icmpv6(
+        type_=icmpv6.ND_NEIGHBOR_SOLICIT,
+        data=icmpv6.nd_neighbor(
+            dst='2001:db8::1',
+            option=icmpv6.nd_option_sla(hw_src=MAC2))))
+    pkt.serialize()
+
+    parsed = packet.Packet(pkt.data)
+    reply = table._nd_handler(parsed, parsed.get_protocol(ethernet.ethernet),
+                              [], 1, 2, None)
+    return packet.Packet(reply.data).get_protocol(icmpv6.icmpv6).data.res
+
+
+def test_router_flag_only_for_routers():
+    table = _table()
+
+    table.learn('2001:db8::1', MAC1, 1, 1)
+    assert _solicitation_reply(table) == neighbor.ND_FLAG_SOLICITED
+
+    table.learn('2001:db8::1', MAC1, 1, 1, router=True)
+    assert _solicitation_reply(table) == (neighbor.ND_FLAG_ROUTER |
+                                          neighbor.ND_FLAG_SOLICITED)
@@ -0,0 +1,100 @@
+# Copyright (C) 2018 [SD]RSiX Project
+#
+# Licensed under the Apache License, Version 2.0 (the “License”);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an “AS IS” BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from ryu.lib import hub
+
+from sd_ixp.flow import Flow, output
+
+
+def _flows(port, count=50):
+    return [Flow(0, 10, {'eth_dst': '02:00:00:00:%02x:%02x' % (i >> 8,
+                                                              i & 0xff)},
+                 [output(port)])
+            for i in range(count)]
+
+
+def _slow(switch, datapath):
+    """Make the switch read one message per write, once released"""
+
+    switch.outbound._max_bytes = 1000
+    switch.outbound._max_write = 1
+
+    release = hub.Event()
+    send = datapath.send
+
+    def slow_send(buf, close_socket=False):
+        release.wait()
+        return send(buf, close_socket)
+
+    datapath.send = slow_send
+    return release
+
+
+def _until(condition):
+    for _ in range(1000):
+        if condition():
+            return True
+        hub.sleep(0)
+    return False
+
+
+def _installed(switch):
+    return {flow for flow in switch.get_flow_entries() if flow.priority == 10}
+
+
+def _full(connect):
+    switch, datapath = connect()
+    release = _slow(switch, datapath)
+    switch.sync(_flows(1))
+    hub.sleep(0)
+    assert not switch.outbound.has_room()
+    return switch, datapath, release
+
+
+def test_sync_is_deferred_while_the_buffer_is_full(connect):
+    switch, datapath, release = _full(connect)
+
+    deferred = switch.sync(_flows(2))
+    assert switch.sync(_flows(3)) is deferred
+    assert switch.outbound.stalls == 1
+
+    # Only the latest sync runs, once there is room
+    release.set()
+    assert _until(lambda: _installed(switch) == set(_flows(3)) and
+                  switch.backlog()[:2] == (0, 0))
+    # The table-miss entry, the first sync and the latest one
+    assert datapath.sent['OFPFlowMod'] == 1 + 50 + 50
+
+
+def test_sync_that_may_wait_supersedes_the_deferred_one(connect):
+    switch, datapath, release = _full(connect)
+    deferred = switch.sync(_flows(2))
+
+    done = []
+    hub.spawn(lambda: done.append(switch.sync(_flows(3), wait=True)))
+    hub.sleep(0)
+    assert not done
+
+    release.set()
+    assert _until(lambda: done)
+    assert not deferred.done()
+    assert _installed(switch) == set(_flows(3))
+
+
+def test_closing_cancels_the_deferred_sync(connect):
+    switch, datapath, release = _full(connect)
+    deferred = switch.sync(_flows(2))
+    switch.close()
+
+    assert deferred.cancelled
@@ -0,0 +1,116 @@
+# Copyright (C) 2018 [SD]RSiX Project
+#
+# Licensed under the Apache License, Version 2.0 (the “License”);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an “AS IS” BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import struct
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from sd_ixp import flow
+from sd_ixp import snapshot
+from sd_ixp.flow import Flow
+
+
+def _state():
+    now = time.monotonic()
+    macs = [SimpleNamespace(mac=0x020000000001, port=1, vlan=None,
+                            learned=now - 10, seen=now - 1),
+            SimpleNamespace(mac=0x020000000002, port=2, vlan=100,
+                            learned=now - 5, seen=now)]
+    flows = [Flow(0, 10, {'in_port': 1, 'eth_src': '02:00:00:00:00:01'},
+                  [flow.goto(1)]),
+             Flow(1, 20, {'eth_dst': ('01:00:00:00:00:00',
+                                      '01:00:00:00:00:00')},
+                  [flow.write_metadata(4, 0xff), flow.group(7)],
+                  idle_timeout=30, hard_timeout=300)]
+    switch = SimpleNamespace(dpid=1, learned_state=lambda: (macs, flows))
+    neighbors = [SimpleNamespace(ip='10.0.0.1', mac='02:00:00:00:00:01',
+                                 dpid=1, port=1, vlan=None, expires=now + 60),
+                 SimpleNamespace(ip='2001:db8::1', mac='02:00:00:00:00:02',
+                                 dpid=1, port=2, vlan=100, expires=now + 60),
+                 SimpleNamespace(ip='10.0.0.9', mac='02:00:00:00:00:09',
+                                 dpid=1, port=3, vlan=None, expires=now - 1)]
+    return [switch], neighbors, flows
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'state' / 'rsix.snapshot')
+    switches, neighbors, flows = _state()
+    snapshot.save(path, switches, neighbors)
+
+    state = snapshot.load(path)
+    macs, restored = state.pop_switch(1)
+
+    assert [(mac, vlan, port) for mac, vlan, port, _, _ in macs] == [
+        (0x020000000001, None, 1), (0x020000000002, 100, 2)]
+    assert restored == flows
+    assert [neighbor[:5] for neighbor in state.neighbors] == [
+        ('10.0.0.1', '02:00:00:00:00:01', 1, 1, None),
+        ('2001:db8::1', '02:00:00:00:00:02', 1, 2, 100)]
+    assert state.pop_switch(1) == ([], [])
+
+
+def test_missing_or_old(tmp_path):
+    path = str(tmp_path / 'rsix.snapshot')
+    assert snapshot.load(path) is None
+
+    snapshot.save(path, [], [])
+    assert snapshot.load(path, max_age=-1) is None
+
+
+@pytest.mark.parametrize('cut', [1, 20, 40, 100])
+def test_truncated(tmp_path, cut):
+    path = str(tmp_path / 'rsix.snapshot')
+    snapshot.save(path, *_state()[:2])
+    with open(path, 'rb') as f:
+        data = f.read()
+    with open(path, 'wb') as f:
+        f.write(data[:-cut])
+
+    with pytest.raises(ValueError):
+        snapshot.load(path)
+
+
+def test_corrupt_flows(tmp_path):
+    path = str(tmp_path / 'rsix.snapshot')
+    for blob in (b'\xff\xfe', b'{"1": 2}', b'[[1, [[0]]]]', b'[1]'):
+        with open(path, 'wb') as f:
+            f.write(snapshot._HEADER.pack(snapshot.MAGIC, snapshot.VERSION,
+                                          time.time(), 0, 0, len(blob)))
+            f.write(blob)
+
+        with pytest.raises(ValueError):
+            snapshot.load(path)
+
+
+def test_corrupt_neighbor(tmp_path):
+    path = str(tmp_path / 'rsix.snapshot')
+    with open(path, 'wb') as f:
+        f.write(snapshot._HEADER.pack(snapshot.MAGIC, snapshot.VERSION,
+                                      time.time(), 0, 1, 2))
+        f.write(snapshot._NEIGHBOR.pack(9, bytes(16), bytes(6), 1, 1, 0, 60))
+        f.write(b'[]')
+
+    with pytest.raises(ValueError):
+        snapshot.load(path)
+
+
+def test_not_a_snapshot(tmp_path):
+    path = str(tmp_path / 'rsix.snapshot')
+    with open(path, 'wb') as f:
+        f.write(struct.pack('!8sHdIII', b'RSIXSNAP', 2, time.time(), 0, 0, 0))
+
+    with pytest.raises(ValueError):
+        snapshot.load(path)
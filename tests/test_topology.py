@@ -0,0 +1,101 @@
+# Copyright (C) 2018 [SD]RSiX Project
+#
+# Licensed under the Apache License, Version 2.0 (the “License”);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an “AS IS” BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from sd_ixp import topology
+from sd_ixp.topology import Topology
+
+
+def _line(*dpids):
+    """Topology of switches linked in a line: port 2 goes right, 1 left"""
+
+    fabric = Topology()
+    for left, right in zip(dpids, dpids[1:]):
+        fabric.link_seen(left, 2, right, 1, now=0)
+        fabric.link_seen(right, 1, left, 2, now=0)
+    return fabric
+
+
+def test_paths():
+    fabric = _line(1, 2, 3)
+
+    assert fabric.paths(1) == {2: 2, 3: 2}
+    assert fabric.next_hop(3, 1) == 1
+    assert fabric.distance(1, 3) == 2
+    assert fabric.trunk_ports(2) == {1: 1, 2: 3}
+
+
+def test_removed_link_invalidates_the_paths_that_used_it():
+    fabric = _line(1, 2, 3)
+    fabric.link_seen(3, 3, 4, 1, now=0)
+    fabric.link_seen(4, 1, 3, 3, now=0)
+    fabric.paths(1)
+    fabric.paths(4)
+
+    # 3 -> 4 is not on the tree of 1 towards 3; 2 -> 3 is on both
+    assert fabric.port_down(2, 2)
+    assert fabric.next_hop(1, 3) is None
+    assert fabric.next_hop(4, 2) is None
+    assert fabric.next_hop(4, 3) == 1
+
+
+def test_shorter_link_invalidates_paths():
+    fabric = _line(1, 2, 3)
+    assert fabric.distance(1, 3) == 2
+
+    version = fabric.version
+    assert fabric.link_seen(1, 3, 3, 3, now=0)
+    assert fabric.version > version
+    assert fabric.distance(1, 3) == 1
+    assert fabric.next_hop(1, 3) == 3
+
+    # Seen again: nothing changes
+    version = fabric.version
+    assert not fabric.link_seen(1, 3, 3, 3, now=1)
+    assert fabric.version == version
+
+
+def test_links_expire():
+    fabric = _line(1, 2)
+    fabric.link_seen(1, 2, 2, 1, now=topology.LINK_TIMEOUT)
+
+    assert fabric.expire(now=topology.LINK_TIMEOUT + 1) == [(2, 1)]
+    assert fabric.links() == [((1, 2), (2, 1))]
+    assert fabric.tree_ports(1) == set()
+
+
+def test_spanning_tree_has_no_loop():
+    fabric = _line(1, 2, 3)
+    fabric.link_seen(1, 3, 3, 3, now=0)
+    fabric.link_seen(3, 3, 1, 3, now=0)
+
+    ports = {dpid: fabric.tree_ports(dpid) for dpid in (1, 2, 3)}
+    # Two of the three links, both ends of each
+    assert sum(len(tree) for tree in ports.values()) == 4
+
+    fabric.remove_switch(2)
+    assert fabric.tree_ports(1) == {3} and fabric.tree_ports(3) == {3}
+
+
+def test_lldp_frames_are_authenticated():
+    key = topology.new_key()
+    frame = topology.lldp_frame(0x1234, 7, key)
+
+    assert topology.parse_lldp(frame, key) == (0x1234, 7)
+    assert topology.parse_lldp(frame, topology.new_key()) is None
+    assert topology.parse_lldp(frame[:30], key) is None
+
+    # Another port named with the tag of port 7
+    forged = topology.lldp_frame(0x1234, 8, key)
+    tag = frame[-(topology.TAG_SIZE + 2):]
+    assert topology.parse_lldp(forged[:-len(tag)] + tag, key) is None
@@ -0,0 +1,85 @@
+# Copyright (C) 2018 [SD]RSiX Project
+#
+# Licensed under the Apache License, Version 2.0 (the “License”);
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an “AS IS” BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from ryu.lib import hub
+
+from sd_ixp import flowqueue
+from sd_ixp import transaction
+from sd_ixp.ixp import IXP
+from sd_ixp.member import Member
+
+
+def _member(asn, port, macs=1):
+    return Member(asn, ports=[(1, port)],
+                  macs=['02:00:00:%02x:%02x:%02x' % (asn & 0xff, i >> 8,
+                                                     i & 0xff)
+                        for i in range(macs)])
+
+
+def _programmed(connect, reply, members=()):
+    ixp = IXP(members)
+    switch, datapath = connect()
+    ixp.add_switch(switch, program=False)
+    ixp.program(switch)
+    reply(switch, datapath)
+    return ixp, switch, datapath
+
+
+def test_commit(connect, reply):
+    ixp, switch, datapath = _programmed(connect, reply, [_member(65001, 1)])
+
+    txn = ixp.change(members=[_member(65002, 2)])
+    reply(switch, datapath)
+
+    assert txn.state == transaction.COMMITTED
+    assert 65002 in ixp.members
+
+
+def test_error_in_first_batch_of_large_change_rolls_back(connect, reply):
+    ixp, switch, datapath = _programmed(connect, reply, [_member(65001, 1)])
+
+    # Two entries per MAC: the change spans several batches
+    txn = ixp.change(members=[_member(65002, 2, macs=400)])
+    hub.sleep(0)
+    sent = list(datapath.messages)
+    assert sum(msg.name == 'OFPBarrierRequest'
+               for msg in sent) > 2
+    assert len(sent) > 2 * flowqueue.DEFAULT_MAX_BATCH
+
+    first = next(msg for msg in sent if msg.name == 'OFPFlowMod')
+    reply(switch, datapath, errors=[first.xid])
+
+    assert txn.state == transaction.ROLLED_BACK
+    assert list(txn.errors) == [1]
+    assert 65002 not in ixp.members
+
+
+def test_rollback_restores_replaced_registration(connect, reply):
+    old = _member(65001, 1)
+    ixp, switch, datapath = _programmed(connect, reply, [old])
+
+    txn = ixp.change(members=[_member(65001, 1, macs=2)])
+    hub.sleep(0)
+    first = next(msg for msg in datapath.messages
+                 if msg.name == 'OFPFlowMod')
+    reply(switch, datapath, errors=[first.xid])
+
+    assert txn.state == transaction.ROLLED_BACK
+    assert ixp.members[65001] is old
+
+
+def test_no_switches_commits_at_once():
+    ixp = IXP()
+    txn = ixp.change(members=[_member(65001, 1)])
+    assert txn.state == transaction.COMMITTED